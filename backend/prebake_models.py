@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+模型预置工具
+下载 ASR/TTS 模型并登记到本地清单 (MODEL_DIR/manifest.json)，
+用于构建容器镜像，使运行时以 MODEL_OFFLINE=1 零网络启动
+
+用法:
+    python3 prebake_models.py            # 下载并登记
+    python3 prebake_models.py --verify   # 仅做 sha256 完整校验
+"""
+
+import argparse
+import os
+import sys
+
+from loguru import logger
+
+from services.asr_service import ASRService
+from services.tts_service import TTSService
+from utils.model_manifest import ModelManifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="预置 ASR/TTS 模型到本地清单")
+    parser.add_argument("--verify", action="store_true", help="只校验清单中的模型 (sha256)")
+    parser.add_argument("--skip-tts", action="store_true", help="不预置 TTS 模型")
+    parser.add_argument(
+        "--tts-repo",
+        default=os.getenv("TTS_MODEL_REPO"),
+        help="TTS 模型的 ModelScope 仓库 (默认 iic/$TTS_MODEL)",
+    )
+    return parser.parse_args()
+
+
+def prebake_tts(tts: TTSService, repo: str):
+    if tts.resolve_model_dir():
+        return
+
+    from modelscope.hub.snapshot_download import snapshot_download
+
+    repo = repo or f"iic/{tts.model_name}"
+    model_dir = snapshot_download(repo, cache_dir=tts.manifest.cache_dir)
+    tts.manifest.register(tts.model_name, model_dir, source=f"modelscope:{repo}")
+
+
+def main():
+    args = parse_args()
+    asr = ASRService()
+    tts = TTSService()
+
+    if not args.verify:
+        asr.resolve_model_dir()
+        if not args.skip_tts:
+            prebake_tts(tts, args.tts_repo)
+
+    manifest = ModelManifest()
+    ok = True
+    for model_id, entry in manifest.entries.items():
+        valid = manifest.verify(entry, "sha256")
+        ok &= valid
+        status = "ok" if valid else "FAILED"
+        logger.info(f"{model_id}: {entry['path']} ({len(entry['files'])} files) {status}")
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,10 +5,12 @@
 """
 
 import asyncio
+import contextlib
 import json
 import logging
 import os
-from typing import Dict, Optional
+import uuid
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional
 from datetime import datetime
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Request
@@ -22,7 +24,20 @@ import base64
 from services.asr_service import ASRService
 from services.tts_service import TTSService
 from services.llm_service import LLMService
+from services.batch_transcriber import BatchTranscriber, PathNotAllowed
+from services.conversation_history import ConversationHistory
+from services.llm_speculation import ClaimedStream
+from services.admission import AdmissionController, Overloaded, WS_CLOSE_TRY_AGAIN_LATER
 from utils.audio_utils import AudioProcessor
+from utils.audio_codec import (
+    DEFAULT_AUDIO_FORMAT,
+    available_formats,
+    check_audio_format,
+    create_encoder,
+    negotiate_format,
+)
+from utils.audio_frame import pack_audio_frame
+from utils.playback import PlaybackTracker
 
 # 配置日志
 logger.add(
@@ -47,36 +62,50 @@ app.add_middleware(
 asr_service: Optional[ASRService] = None
 tts_service: Optional[TTSService] = None
 llm_service: Optional[LLMService] = None
+batch_transcriber: Optional[BatchTranscriber] = None
+admission: Optional[AdmissionController] = None
 audio_processor: AudioProcessor = AudioProcessor()
 
 # 活跃连接管理
 active_connections: Dict[str, WebSocket] = {}
 
+# 检测到新的语音起点时打断正在播报的回复
+BARGE_IN_ON_SPEECH = os.getenv("BARGE_IN_ON_SPEECH", "1") == "1"
+
 
 @app.on_event("startup")
 async def startup_event():
     """启动时初始化模型"""
-    global asr_service, tts_service, llm_service
+    global asr_service, tts_service, llm_service, batch_transcriber, admission
     
     logger.info("🚀 Starting Local Voice Agent Server...")
+    admission = AdmissionController()
     
     try:
         # 初始化 ASR 服务
         logger.info("Loading ASR model...")
         asr_service = ASRService()
         await asr_service.load_model()
+        asr_service.limiter = admission["asr"]
+        batch_transcriber = BatchTranscriber(asr_service)
         logger.success("✅ ASR model loaded")
         
         # 初始化 TTS 服务
         logger.info("Loading TTS model...")
         tts_service = TTSService()
         await tts_service.load_model()
+        tts_service.limiter = admission["tts"]
         logger.success("✅ TTS model loaded")
         
-        # 初始化 LLM 服务 (远程 API)
+        # 初始化 LLM 服务: 建立连接池并预热模型，避免首个请求承担冷启动
         logger.info("Initializing LLM service...")
         llm_service = LLMService()
-        logger.success("✅ LLM service initialized")
+        llm_service.limiter = admission["llm"]
+        try:
+            await llm_service.initialize()
+            logger.success("✅ LLM service initialized")
+        except Exception as e:
+            logger.warning(f"LLM warm-up failed, the first request will load the model: {e}")
         
         logger.success("🎉 All services ready!")
         
@@ -93,6 +122,8 @@ async def shutdown_event():
         await asr_service.cleanup()
     if tts_service:
         await tts_service.cleanup()
+    if llm_service:
+        await llm_service.close()
 
 
 @app.get("/health")
@@ -109,6 +140,18 @@ async def health_check():
     }
 
 
+@app.get("/stats")
+async def stats():
+    """运行时统计：队列深度、批大小等"""
+    return {
+        "asr": asr_service.stats() if asr_service else None,
+        "tts": tts_service.stats() if tts_service else None,
+        "llm": llm_service.stats() if llm_service else None,
+        "admission": admission.stats() if admission else None,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
 @app.get("/")
 async def root_metadata():
     """根路由：返回 API 元数据与端点映射（与前端集成文档一致）。"""
@@ -117,15 +160,19 @@ async def root_metadata():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
+            "stats": "/stats",
             "websocket": "/ws/voice",
             "api": {
                 "voice": "/api/voice",
                 "voice_stream": "/api/voice/stream",
                 "asr": "/api/asr",
+                "asr_batch": "/api/asr/batch",
                 "llm": "/api/llm",
                 "tts": "/api/tts",
+                "tts_stream": "/api/tts/stream",
             },
         },
+        "audio_formats": available_formats(),
     }
 
 
@@ -134,15 +181,23 @@ async def websocket_endpoint(websocket: WebSocket):
     """WebSocket 主连接 - 处理实时语音对话"""
     client_id = f"client_{datetime.now().timestamp()}"
     await websocket.accept()
+    rejection = admission.open_session()
+    if rejection:
+        await reject_websocket(websocket, rejection)
+        return
     active_connections[client_id] = websocket
     
     logger.info(f"✅ Client {client_id} connected")
     
     # 会话状态
     session = {
-        "asr_buffer": [],
-        "conversation_history": [],
+        "asr_stream": asr_service.create_stream(client_id),
+        "conversation_history": ConversationHistory(summarize=llm_service.summarize_history),
+        "speculator": llm_service.create_speculator(),
         "is_speaking": False,
+        "turn": None,
+        "turn_task": None,
+        "output_audio_format": DEFAULT_AUDIO_FORMAT,
     }
     
     try:
@@ -176,6 +231,12 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         logger.error(f"Error in WebSocket connection: {e}")
     finally:
+        await interrupt_turn(websocket, session, "disconnect")
+        asr_service.close_stream(client_id)
+        admission.close_session()
+        if session["speculator"]:
+            session["speculator"].cancel()
+        session["conversation_history"].clear()
         if client_id in active_connections:
             del active_connections[client_id]
 
@@ -187,28 +248,52 @@ async def websocket_voice(websocket: WebSocket):
     - 接收二进制音频分片（MediaRecorder data），进行 ASR 并发送 {type: 'asr', content: {text}}。
     - 进行 LLM 流式生成，发送 {type: 'llm', content: {text, partial}}。
     - 进行 TTS 流式生成，发送 {type: 'tts', content: {audio}}，其中 audio 为 base64 编码字节。
-    - 支持控制命令：clear、ping。
+    - 二进制传输模式 (连接参数 ?audio_transport=binary 或 session.update)：
+      TTS 音频改为带固定帧头的二进制帧 (见 utils/audio_frame.py)，其余事件仍为 JSON。
+    - 支持控制命令：clear、ping、cancel (可带 played_ms: 客户端实际播放的毫秒数)。
+    - 回复被打断 (cancel、新的语音起点或新的输入) 时发送 {type: 'interrupted', content: {reason, played_ms, sent_ms, text}}，
+      text 为已播放的部分，对话历史同步截断到这里。
     """
     client_id = f"client_{datetime.now().timestamp()}"
     await websocket.accept()
+    rejection = admission.open_session()
+    if rejection:
+        await reject_websocket(websocket, rejection)
+        return
     active_connections[client_id] = websocket
 
     logger.info(f"✅ [/ws/voice] Client {client_id} connected")
 
     session = {
-        "asr_buffer": [],
-        "conversation_history": [],
+        "asr_stream": asr_service.create_stream(client_id),
+        "conversation_history": ConversationHistory(summarize=llm_service.summarize_history),
+        "speculator": llm_service.create_speculator(),
         "is_speaking": False,
+        "turn": None,
+        "turn_task": None,
+        "output_audio_format": DEFAULT_AUDIO_FORMAT,
+        "audio_transport": "json",
+        "audio_stream_id": 0,
     }
 
     try:
+        if "audio_transport" in websocket.query_params:
+            try:
+                apply_session_update(session, {"audio_transport": websocket.query_params["audio_transport"]})
+            except ValueError as e:
+                await websocket.send_json({
+                    "type": "error",
+                    "content": {"message": str(e)},
+                    "timestamp": datetime.now().timestamp(),
+                })
+
         while True:
             data = await websocket.receive()
             if "bytes" in data:
                 # 音频输入 → ASR
                 try:
                     audio_chunk = audio_processor.process_input_audio(data["bytes"])
-                    asr_result = await asr_service.transcribe_stream(audio_chunk)
+                    asr_result = await transcribe_chunk(websocket, session, audio_chunk)
                     if asr_result and asr_result.get("text"):
                         text = asr_result["text"]
                         is_final = asr_result.get("is_final", False)
@@ -219,8 +304,19 @@ async def websocket_voice(websocket: WebSocket):
                             "timestamp": datetime.now().timestamp(),
                         })
                         if is_final:
+                            await interrupt_turn(websocket, session, "new_turn")
+                            chunks = claim_speculation(session, text)
                             session["conversation_history"].append({"role": "user", "content": text})
-                            asyncio.create_task(handle_llm_and_tts_voice(websocket, client_id, text, session))
+                            start_turn(session, lambda turn: handle_llm_and_tts_voice(
+                                websocket, client_id, text, session, turn, chunks
+                            ))
+                except Overloaded as e:
+                    # 本句未能识别 (ASR 过载)，连接保持
+                    await websocket.send_json({
+                        "type": "error",
+                        "content": {"message": str(e), "code": "busy", "retry_after": e.retry_after},
+                        "timestamp": datetime.now().timestamp(),
+                    })
                 except Exception as e:
                     logger.error(f"[/ws/voice] audio error: {e}")
                     await websocket.send_json({
@@ -236,28 +332,59 @@ async def websocket_voice(websocket: WebSocket):
                 # 控制命令
                 cmd = message.get("command")
                 if cmd == "clear":
-                    session["conversation_history"] = []
+                    await interrupt_turn(websocket, session, "clear")
+                    if session["speculator"]:
+                        session["speculator"].cancel()
+                    session["conversation_history"].clear()
+                    session["asr_stream"].reset()
                     await websocket.send_json({
                         "type": "control",
                         "content": {"message": "Conversation cleared"},
                         "timestamp": datetime.now().timestamp(),
                     })
+                elif cmd == "cancel" or message.get("type") == "cancel":
+                    await interrupt_turn(websocket, session, "cancel", message.get("played_ms"))
                 elif cmd == "ping":
                     await websocket.send_json({
                         "type": "control",
                         "content": {"message": "pong"},
                         "timestamp": datetime.now().timestamp(),
                     })
+                elif message.get("type") == "session.update":
+                    try:
+                        config = apply_session_update(session, message.get("session", {}))
+                        await websocket.send_json({
+                            "type": "control",
+                            "content": {"message": "Session updated", "session": config},
+                            "timestamp": datetime.now().timestamp(),
+                        })
+                    except ValueError as e:
+                        await websocket.send_json({
+                            "type": "error",
+                            "content": {"message": str(e)},
+                            "timestamp": datetime.now().timestamp(),
+                        })
                 elif message.get("type") == "input_text":
                     text = message.get("text", "")
                     if text:
+                        await interrupt_turn(websocket, session, "new_turn")
+                        if session["speculator"]:
+                            session["speculator"].cancel()
                         session["conversation_history"].append({"role": "user", "content": text})
-                        await handle_llm_and_tts_voice(websocket, client_id, text, session)
+                        start_turn(session, lambda turn: handle_llm_and_tts_voice(
+                            websocket, client_id, text, session, turn
+                        ))
     except WebSocketDisconnect:
         logger.info(f"[/ws/voice] Client {client_id} disconnected")
     except Exception as e:
         logger.error(f"[/ws/voice] error: {e}")
     finally:
+        await interrupt_turn(websocket, session, "disconnect")
+        asr_service.close_stream(client_id)
+        admission.close_session()
+        if session["speculator"]:
+            session["speculator"].cancel()
+        session["conversation_history"].clear()
         if client_id in active_connections:
             del active_connections[client_id]
 
@@ -267,44 +394,106 @@ async def handle_llm_and_tts_voice(
     client_id: str,
     user_text: str,
     session: dict,
+    turn: dict,
+    chunks: Optional[ClaimedStream] = None,
 ):
-    """按前端集成文档的格式发送 LLM/TTS。"""
-    try:
-        response_text = ""
-        async for chunk in llm_service.chat_stream(messages=session["conversation_history"]):
-            response_text += chunk
-            await websocket.send_json({
-                "type": "llm",
-                "content": {"text": chunk, "partial": True},
-                "timestamp": datetime.now().timestamp(),
-            })
+    """按前端集成文档的格式发送 LLM/TTS。chunks 为已开始的 LLM 输出 (投机生成命中)"""
+    playback: PlaybackTracker = turn["playback"]
+
+    async def on_delta(chunk: str):
+        await websocket.send_json({
+            "type": "llm",
+            "content": {"text": chunk, "partial": True},
+            "timestamp": datetime.now().timestamp(),
+        })
+
+    async def on_done(response_text: str):
         # 完整 LLM 回复
         session["conversation_history"].append({"role": "assistant", "content": response_text})
+        turn["reply_complete"] = True
         await websocket.send_json({
             "type": "llm",
             "content": {"text": response_text, "partial": False},
             "timestamp": datetime.now().timestamp(),
         })
 
-        # TTS 流式音频（JSON base64）
+    seq = 0
+
+    async def send_audio(audio: bytes, end: bool = False):
+        nonlocal seq
+        if session["audio_transport"] == "binary":
+            # 二进制帧: 流结束时即使没有剩余数据也发送带结束标记的空帧
+            if audio or end:
+                await websocket.send_bytes(pack_audio_frame(
+                    encoder.name, stream_id, seq, encoder.sample_rate, audio, end=end
+                ))
+                seq += 1
+            return
+        if not audio:
+            return
+        await websocket.send_json({
+            "type": "tts",
+            "content": {"audio": base64.b64encode(audio).decode("ascii"), "format": encoder.name},
+            "timestamp": datetime.now().timestamp(),
+        })
+
+    try:
+        # LLM token 边生成边送入 TTS，音频按会话协商的格式编码后以 JSON base64 发送
+        encoder = create_encoder(session["output_audio_format"], tts_service.sample_rate)
+        session["audio_stream_id"] += 1
+        stream_id = session["audio_stream_id"]
         session["is_speaking"] = True
-        async for audio_chunk in tts_service.synthesize_stream(response_text):
-            if not session["is_speaking"]:
-                break
-            b64 = base64.b64encode(audio_chunk).decode("ascii")
-            await websocket.send_json({
-                "type": "tts",
-                "content": {"audio": b64},
-                "timestamp": datetime.now().timestamp(),
-            })
+        text_stream = llm_text_stream(session["conversation_history"].messages(), on_delta, on_done, chunks)
+        async with contextlib.aclosing(tts_service.synthesize_text_stream(
+            text_stream, on_sentence=playback.start_sentence
+        )) as audio_stream:
+            async for audio_chunk in audio_stream:
+                if not session["is_speaking"]:
+                    break
+                playback.add_audio(audio_chunk)
+                await send_audio(encoder.encode(audio_chunk))
+        await send_audio(encoder.flush(), end=True)
+        session["is_speaking"] = False
+    except Overloaded as e:
         session["is_speaking"] = False
+        await websocket.send_json({
+            "type": "error",
+            "content": {"message": str(e), "code": "busy", "retry_after": e.retry_after},
+            "timestamp": datetime.now().timestamp(),
+        })
     except Exception as e:
+        session["is_speaking"] = False
         logger.error(f"[/ws/voice] llm/tts error: {e}")
         await websocket.send_json({
             "type": "error",
             "content": {"message": str(e)},
             "timestamp": datetime.now().timestamp(),
         })
+    finally:
+        if chunks is not None:
+            # 被打断或出错时投机生成的 token 流可能尚未开始读取，在此关闭以取消生成
+            await chunks.aclose()
+
+
+async def transcribe_once(audio_chunk: bytes) -> Optional[dict]:
+    """REST 一次性识别：使用临时 ASRStream，结束后释放"""
+    stream_id = f"rest_{uuid.uuid4().hex}"
+    stream = asr_service.create_stream(stream_id, limited=False)  # 调用方按请求占用 ASR 名额
+    try:
+        # 按流式窗口大小分片送入，长音频不会超出流缓冲上限
+        step = asr_service.sample_rate * asr_service.buffer_duration_ms // 1000 * 2
+        finals = []
+        for offset in range(0, len(audio_chunk), step):
+            result = await asr_service.transcribe_stream(audio_chunk[offset:offset + step], stream)
+            if result and result.get("is_final"):
+                finals.append(result["text"])
+        result = await stream.flush()
+        if result:
+            finals.append(result["text"])
+        text = " ".join(finals)
+        return {"text": text} if text else None
+    finally:
+        asr_service.close_stream(stream_id)
 
 
 @app.post("/api/asr")
@@ -316,14 +505,65 @@ async def api_asr(payload: dict = Body(...)):
             return JSONResponse(status_code=400, content={"success": False, "error": "audio_data required"})
         audio_bytes = base64.b64decode(b64)
         audio_chunk = audio_processor.process_input_audio(audio_bytes)
-        result = await asr_service.transcribe_stream(audio_chunk)
+        async with admission["asr"].slot():
+            result = await transcribe_once(audio_chunk)
         text = result.get("text", "") if result else ""
         return {"text": text, "success": True}
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"/api/asr error: {e}")
         return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
 
 
+@app.post("/api/asr/batch")
+async def api_asr_batch_submit(payload: dict = Body(...)):
+    """批量转写：提交服务器本地的目录或文件列表，返回任务 ID。
+
+    仅在配置了 BATCH_ASR_ROOT 时可用，路径 (可为相对该目录的路径) 必须位于其中。
+    """
+    if not batch_transcriber.root:
+        return JSONResponse(
+            status_code=403,
+            content={"success": False, "error": "Batch transcription is disabled (BATCH_ASR_ROOT not configured)"},
+        )
+    try:
+        files = batch_transcriber.resolve_files(
+            paths=payload.get("paths"),
+            directory=payload.get("directory"),
+            recursive=payload.get("recursive", True),
+        )
+        job = batch_transcriber.submit(files)
+        return {"success": True, **job.summary()}
+    except PathNotAllowed as e:
+        return JSONResponse(status_code=403, content={"success": False, "error": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    except Exception as e:
+        logger.error(f"/api/asr/batch error: {e}")
+        return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
+
+
+@app.get("/api/asr/batch/{job_id}")
+async def api_asr_batch_status(job_id: str):
+    """批量转写：查询任务状态与吞吐。"""
+    job = batch_transcriber.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "job not found"})
+    return {"success": True, **job.summary()}
+
+
+@app.get("/api/asr/batch/{job_id}/results")
+async def api_asr_batch_results(job_id: str):
+    """批量转写：以 NDJSON 流式返回每个文件的结果，最后一行为任务汇总。"""
+    if batch_transcriber.get(job_id) is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "job not found"})
+    return StreamingResponse(
+        batch_transcriber.stream_results(job_id),
+        media_type="application/x-ndjson"
+    )
+
+
 @app.post("/api/llm")
 async def api_llm(payload: dict = Body(...)):
     """LLM REST：接收 messages，返回生成文本。"""
@@ -333,9 +573,12 @@ async def api_llm(payload: dict = Body(...)):
         # temperature = payload.get("temperature")
         # max_tokens = payload.get("max_tokens")
         content = ""
-        async for chunk in llm_service.chat_stream(messages=messages):
-            content += chunk
+        async with admission["llm"].slot():
+            async for chunk in llm_service.chat_stream(messages=messages):
+                content += chunk
         return {"content": content, "success": True}
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"/api/llm error: {e}")
         return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
@@ -343,58 +586,163 @@ async def api_llm(payload: dict = Body(...)):
 
 @app.post("/api/tts")
 async def api_tts(payload: dict = Body(...)):
-    """TTS REST：接收文本与可选发音人，返回 base64 音频。"""
+    """TTS REST：接收文本与可选输出格式 (format: pcm16/wav/g711_ulaw/opus/webm_opus)，返回 base64 音频。"""
     try:
         text = payload.get("text") or ""
         if not text:
             return JSONResponse(status_code=400, content={"success": False, "error": "text required"})
-        audio_bytes = b""
+        try:
+            encoder = create_encoder(
+                check_audio_format(payload.get("format") or DEFAULT_AUDIO_FORMAT),
+                tts_service.sample_rate,
+            )
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+        audio_chunks = []
         async for audio_chunk in tts_service.synthesize_stream(text):
-            audio_bytes += audio_chunk
-        b64 = base64.b64encode(audio_bytes).decode("ascii")
-        return {"audio_data": b64, "success": True}
+            audio_chunks.append(encoder.encode(audio_chunk))
+        audio_chunks.append(encoder.flush())
+        b64 = base64.b64encode(b"".join(audio_chunks)).decode("ascii")
+        return {
+            "audio_data": b64,
+            "format": encoder.name,
+            "content_type": encoder.content_type,
+            "sample_rate": encoder.sample_rate,
+            "success": True,
+        }
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"/api/tts error: {e}")
         return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
 
 
+@app.post("/api/tts/stream")
+async def api_tts_stream(request: Request, payload: dict = Body(...)):
+    """TTS 流式 HTTP：边合成边以分块传输返回音频。
+
+    Body: {"text": "...", "voice": "中文女", "speed": 1.0, "format": 可选}
+    输出格式由 format 指定，否则按 Accept 协商:
+    audio/wav (默认，流式 WAV 头)、audio/L16 (原始 PCM16)、audio/ogg、audio/webm (Opus)、audio/basic (μ-law)
+    """
+    text = payload.get("text") or ""
+    if not text:
+        return JSONResponse(status_code=400, content={"success": False, "error": "text required"})
+
+    try:
+        if payload.get("format"):
+            audio_format = check_audio_format(payload["format"])
+        else:
+            audio_format = negotiate_format(request.headers.get("accept"))
+            if audio_format is None:
+                return JSONResponse(
+                    status_code=406,
+                    content={"success": False, "error": "No acceptable audio format", "formats": available_formats()},
+                )
+        encoder = create_encoder(audio_format, tts_service.sample_rate)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+
+    voice = payload.get("voice") or "中文女"
+    speed = float(payload.get("speed") or 1.0)
+
+    # 响应头发出后无法再返回 503: 队列已满时先行拒绝，名额在每次合成时获取
+    if admission["tts"].full:
+        return overloaded_response(Overloaded("tts", "queue full", admission["tts"].retry_after))
+
+    async def audio_stream():
+        try:
+            async with contextlib.aclosing(tts_service.synthesize_stream(text, voice, speed)) as chunks:
+                async for audio_chunk in chunks:
+                    audio = encoder.encode(audio_chunk)
+                    if audio:
+                        yield audio
+            audio = encoder.flush()
+            if audio:
+                yield audio
+        except Exception as e:
+            # 响应头已发出，只能记录并提前结束
+            logger.error(f"/api/tts/stream error: {e}")
+
+    return StreamingResponse(
+        audio_stream(),
+        media_type=encoder.content_type,
+        headers={"Vary": "Accept", "X-Audio-Format": encoder.name, "X-Sample-Rate": str(encoder.sample_rate)},
+    )
+
+
 @app.post("/api/voice/stream")
-async def api_voice_stream(request):
+async def api_voice_stream(request: Request):
     """Unified streaming endpoint: audio in (raw bytes), NDJSON frames out.
 
+    Query: ?format=pcm16|wav|g711_ulaw|opus|webm_opus (TTS output codec, default pcm16)
+
     Frames:
     {"type": "asr", "text": "..."}
     {"type": "llm", "text": "...", "partial": true/false}
-    {"type": "tts", "audio": "base64_pcm16"}
+    {"type": "tts", "audio": "base64", "format": "pcm16"}
     {"type": "done"}
-    {"type": "error", "message": "..."}
+    {"type": "error", "message": "...", "retry_after": 2 (仅过载时)}
     """
+    for stage in ("asr", "llm", "tts"):
+        if admission[stage].full:
+            return overloaded_response(Overloaded(stage, "queue full", admission[stage].retry_after))
+
     async def frame_stream():
         try:
+            audio_format = check_audio_format(request.query_params.get("format") or DEFAULT_AUDIO_FORMAT)
             body = await request.body()
             if not body:
                 yield json.dumps({"type": "error", "message": "empty audio"}) + "\n"
                 return
 
             audio_chunk = audio_processor.process_input_audio(body)
-            asr_result = await asr_service.transcribe_stream(audio_chunk)
+            async with admission["asr"].slot():
+                asr_result = await transcribe_once(audio_chunk)
             if asr_result and asr_result.get("text"):
                 yield json.dumps({"type": "asr", "text": asr_result["text"]}) + "\n"
             user_text = asr_result.get("text", "") if asr_result else ""
 
-            # LLM streaming
-            llm_acc = ""
-            async for chunk in llm_service.chat_stream(messages=[{"role": "user", "content": user_text}]):
-                llm_acc += chunk
-                yield json.dumps({"type": "llm", "text": chunk, "partial": True}) + "\n"
-            yield json.dumps({"type": "llm", "text": llm_acc, "partial": False}) + "\n"
+            # LLM 与 TTS 并行: llm 帧与 tts 帧按产生顺序交错输出
+            frames: asyncio.Queue = asyncio.Queue()
+
+            async def on_delta(chunk: str):
+                frames.put_nowait({"type": "llm", "text": chunk, "partial": True})
+
+            async def on_done(llm_text: str):
+                frames.put_nowait({"type": "llm", "text": llm_text, "partial": False})
+
+            def put_audio(audio: bytes):
+                if audio:
+                    b64 = base64.b64encode(audio).decode("ascii")
+                    frames.put_nowait({"type": "tts", "audio": b64, "format": audio_format})
 
-            # TTS streaming
-            async for audio_bytes in tts_service.synthesize_stream(llm_acc):
-                b64 = base64.b64encode(audio_bytes).decode("ascii")
-                yield json.dumps({"type": "tts", "audio": b64}) + "\n"
+            async def speak():
+                try:
+                    encoder = create_encoder(audio_format, tts_service.sample_rate)
+                    text_stream = llm_text_stream([{"role": "user", "content": user_text}], on_delta, on_done)
+                    async with contextlib.aclosing(tts_service.synthesize_text_stream(text_stream)) as audio_stream:
+                        async for audio_bytes in audio_stream:
+                            put_audio(encoder.encode(audio_bytes))
+                    put_audio(encoder.flush())
+                    frames.put_nowait({"type": "done"})
+                except Overloaded as e:
+                    frames.put_nowait({"type": "error", "message": str(e), "retry_after": e.retry_after})
+                except Exception as e:
+                    logger.error(f"/api/voice/stream error: {e}")
+                    frames.put_nowait({"type": "error", "message": str(e)})
 
-            yield json.dumps({"type": "done"}) + "\n"
+            speaker = asyncio.create_task(speak())
+            try:
+                while True:
+                    frame = await frames.get()
+                    yield json.dumps(frame) + "\n"
+                    if frame["type"] in ("done", "error"):
+                        break
+            finally:
+                speaker.cancel()
+        except Overloaded as e:
+            yield json.dumps({"type": "error", "message": str(e), "retry_after": e.retry_after}) + "\n"
         except Exception as e:
             logger.error(f"/api/voice/stream error: {e}")
             yield json.dumps({"type": "error", "message": str(e)}) + "\n"
@@ -413,8 +761,8 @@ async def handle_audio_input(
         # 1. 音频预处理
         audio_chunk = audio_processor.process_input_audio(audio_bytes)
         
-        # 2. ASR 实时转写
-        asr_result = await asr_service.transcribe_stream(audio_chunk)
+        # 2. ASR 实时转写 (新的语音起点会打断正在播报的回复)
+        asr_result = await transcribe_chunk(websocket, session, audio_chunk)
         
         if asr_result and asr_result.get("text"):
             text = asr_result["text"]
@@ -424,22 +772,33 @@ async def handle_audio_input(
             await websocket.send_json({
                 "type": "asr.transcript",
                 "text": text,
+                "stable_text": asr_result.get("stable_text", text),
                 "is_final": is_final,
                 "timestamp": datetime.now().isoformat()
             })
             
             # 如果是最终结果，触发 LLM 对话
             if is_final:
+                await interrupt_turn(websocket, session, "new_turn")
+                chunks = claim_speculation(session, text)
                 session["conversation_history"].append({
                     "role": "user",
                     "content": text
                 })
                 
                 # 异步处理 LLM + TTS
-                asyncio.create_task(
-                    handle_llm_and_tts(websocket, client_id, text, session)
-                )
+                start_turn(session, lambda turn: handle_llm_and_tts(
+                    websocket, client_id, text, session, turn, chunks
+                ))
                 
+    except Overloaded as e:
+        # 本句未能识别 (ASR 过载)，连接保持
+        await websocket.send_json({
+            "type": "error",
+            "code": "busy",
+            "message": str(e),
+            "retry_after": e.retry_after
+        })
     except Exception as e:
         logger.error(f"Error processing audio: {e}")
         await websocket.send_json({
@@ -460,84 +819,281 @@ async def handle_text_message(
     if msg_type == "session.update":
         # 更新会话配置
         logger.info(f"Session config updated: {message}")
+        try:
+            config = apply_session_update(session, message.get("session", {}))
+        except ValueError as e:
+            await websocket.send_json({"type": "error", "message": str(e)})
+            return
         await websocket.send_json({
             "type": "session.updated",
-            "session": message.get("session", {})
+            "session": config
         })
         
     elif msg_type == "input_text":
         # 直接文本输入 (不经过 ASR)
         text = message.get("text", "")
+        await interrupt_turn(websocket, session, "new_turn")
+        if session["speculator"]:
+            session["speculator"].cancel()
         session["conversation_history"].append({
             "role": "user",
             "content": text
         })
-        await handle_llm_and_tts(websocket, client_id, text, session)
+        start_turn(session, lambda turn: handle_llm_and_tts(websocket, client_id, text, session, turn))
         
     elif msg_type == "cancel":
-        # 取消当前生成
+        # 取消当前生成 (played_ms: 客户端实际播放的毫秒数，可选)
+        if await interrupt_turn(websocket, session, "cancel", message.get("played_ms")):
+            logger.info("Generation cancelled by user")
+
+
+def apply_session_update(session: dict, config: dict) -> dict:
+    """应用 session.update 中的会话配置，返回生效后的配置
+
+    支持字段:
+    - language: ASR 语言 (zh/en/yue/ja/ko)，"auto" 恢复自动检测
+    - output_audio_format: TTS 输出编码 (pcm16/wav/g711_ulaw/opus/webm_opus)，下一次回复生效
+    - audio_transport: TTS 音频传输方式 json/binary (仅 /ws/voice)
+    """
+    asr_stream = session["asr_stream"]
+    if "output_audio_format" in config:
+        session["output_audio_format"] = check_audio_format(config["output_audio_format"])
+    if "audio_transport" in config:
+        if "audio_transport" not in session:
+            raise ValueError("audio_transport is not supported on this endpoint")
+        if config["audio_transport"] not in ("json", "binary"):
+            raise ValueError(f"Unsupported audio_transport: {config['audio_transport']} (supported: json, binary)")
+        session["audio_transport"] = config["audio_transport"]
+    if "language" in config:
+        asr_stream.language_state.set_override(config["language"])
+    
+    updated = {
+        **config,
+        "language": asr_stream.language_state.decode_language,
+        "output_audio_format": session["output_audio_format"],
+    }
+    if "audio_transport" in session:
+        updated["audio_transport"] = session["audio_transport"]
+    return updated
+
+
+async def reject_websocket(websocket: WebSocket, rejection: Overloaded):
+    """会话数已满: 关闭码 1013 (Try Again Later)，原因中带建议重试时间"""
+    await websocket.close(
+        code=WS_CLOSE_TRY_AGAIN_LATER,
+        reason=f"busy, retry after {rejection.retry_after:.0f}s",
+    )
+
+
+def overloaded_response(e: Overloaded) -> JSONResponse:
+    """阶段过载: HTTP 503 + Retry-After"""
+    return JSONResponse(
+        status_code=503,
+        content={"success": False, "error": str(e), "stage": e.stage},
+        headers={"Retry-After": str(max(1, round(e.retry_after)))},
+    )
+
+
+def observe_partial(session: dict):
+    """每块音频后把当前中间结果交给投机生成 (正在播报回复时不投机)"""
+    speculator = session["speculator"]
+    if speculator and not session["is_speaking"]:
+        speculator.observe(session["asr_stream"].partial_text, session["conversation_history"])
+
+
+def claim_speculation(session: dict, final_text: str) -> Optional[ClaimedStream]:
+    """最终结果到达: 投机生成命中时返回其 token 流 (须在追加用户消息之前调用)"""
+    speculator = session["speculator"]
+    return speculator.claim(final_text, session["conversation_history"]) if speculator else None
+
+
+async def transcribe_chunk(websocket: WebSocket, session: dict, audio_chunk) -> Optional[dict]:
+    """流式 ASR 一块音频；VAD 检测到新的语音起点时打断当前回复 (BARGE_IN_ON_SPEECH)
+
+    ASR 名额按句占用 (见 ASRStream)：名额不足时中间结果延后，
+    语句结束时仍无名额则丢弃该句并抛出 Overloaded，连接保持
+    """
+    asr_stream = session["asr_stream"]
+    onsets = asr_stream.speech_onsets
+    asr_result = await asr_service.transcribe_stream(audio_chunk, asr_stream)
+    if BARGE_IN_ON_SPEECH and asr_stream.speech_onsets != onsets:
+        await interrupt_turn(websocket, session, "speech")
+    observe_partial(session)
+    return asr_result
+
+
+def start_turn(session: dict, run: Callable[[dict], Awaitable[None]]):
+    """在后台启动一轮回复，记录到会话中以便打断 (调用前先 interrupt_turn 结束上一轮)"""
+    turn = {"playback": PlaybackTracker(tts_service.sample_rate), "reply_complete": False}
+    session["turn"] = turn
+    session["turn_task"] = asyncio.create_task(run(turn))
+
+
+async def interrupt_turn(
+    websocket: WebSocket,
+    session: dict,
+    reason: str,
+    played_ms: Optional[float] = None,
+) -> bool:
+    """打断当前回复，返回是否有回复被打断
+
+    取消本轮任务: LLM HTTP 流随之关闭，排队中的 TTS 句子被丢弃。
+    对话历史中的回复截断到已开始播放的句子，并把实际播放时长告知客户端；
+    音频已全部发出但客户端仍在播放时同样截断。
+    played_ms 为客户端上报的已播放时长，未上报时按首块音频发出后的时间估算。
+    """
+    turn, task = session["turn"], session["turn_task"]
+    session["turn"] = session["turn_task"] = None
+    if turn is None:
+        return False
+
+    playback: PlaybackTracker = turn["playback"]
+    if task is not None and not task.done():
+        task.cancel()
+        await asyncio.wait([task])
         session["is_speaking"] = False
-        logger.info("Generation cancelled by user")
+    elif playback.played_ms(played_ms) >= playback.sent_ms:
+        return False  # 已播放完毕
+
+    played = playback.played_ms(played_ms)
+    heard = playback.heard_text(played)
+    history = session["conversation_history"]
+    if turn["reply_complete"]:
+        if heard:
+            history.replace_last({"role": "assistant", "content": heard})
+        else:
+            history.pop()
+    elif heard:
+        history.append({"role": "assistant", "content": heard})
+    logger.info(f"Turn interrupted ({reason}): played {played:.0f}/{playback.sent_ms:.0f} ms")
+
+    info = {"reason": reason, "played_ms": round(played), "sent_ms": round(playback.sent_ms), "text": heard}
+    with contextlib.suppress(Exception):
+        if "audio_transport" in session:
+            # /ws/voice
+            await websocket.send_json({
+                "type": "interrupted",
+                "content": info,
+                "timestamp": datetime.now().timestamp(),
+            })
+        else:
+            await websocket.send_json({
+                "type": "response.interrupted",
+                **info,
+                "timestamp": datetime.now().isoformat(),
+            })
+    return True
+
+
+async def llm_text_stream(
+    messages: List[Dict],
+    on_delta: Callable[[str], Awaitable[None]],
+    on_done: Callable[[str], Awaitable[None]],
+    chunks: Optional[ClaimedStream] = None,
+) -> AsyncGenerator[str, None]:
+    """LLM 流式输出: 每个增量先回调 on_delta 再交给下游 (TTS)，结束时回调 on_done
+
+    chunks 不为空时使用已开始的 LLM 输出 (投机生成，已占用 LLM 名额)，
+    否则按 messages 发起请求，生成期间占用一个 LLM 名额
+    """
+    parts = []
+    if chunks is not None:
+        source, slot = chunks, contextlib.nullcontext()
+    else:
+        source, slot = llm_service.chat_stream(messages=messages), admission["llm"].slot()
+    async with contextlib.aclosing(source) as stream, slot:
+        async for chunk in stream:
+            parts.append(chunk)
+            await on_delta(chunk)
+            yield chunk
+    await on_done("".join(parts))
 
 
 async def handle_llm_and_tts(
     websocket: WebSocket,
     client_id: str,
     user_text: str,
-    session: dict
+    session: dict,
+    turn: dict,
+    chunks: Optional[ClaimedStream] = None,
 ):
-    """处理 LLM 对话 + TTS 流式合成"""
-    try:
-        # 1. LLM 生成回复 (流式)
-        response_text = ""
-        
-        async for chunk in llm_service.chat_stream(
-            messages=session["conversation_history"]
-        ):
-            response_text += chunk
-            
-            # 发送 LLM 文本流
-            await websocket.send_json({
-                "type": "llm.delta",
-                "text": chunk,
-                "timestamp": datetime.now().isoformat()
-            })
-        
-        # 2. LLM 完成
+    """处理 LLM 对话 + TTS 流式合成 (chunks: 投机生成命中时已开始的 LLM 输出)"""
+    playback: PlaybackTracker = turn["playback"]
+
+    # 1. LLM 生成回复 (流式)
+    async def on_delta(chunk: str):
+        # 发送 LLM 文本流
+        await websocket.send_json({
+            "type": "llm.delta",
+            "text": chunk,
+            "timestamp": datetime.now().isoformat()
+        })
+
+    # 2. LLM 完成
+    async def on_done(response_text: str):
         session["conversation_history"].append({
             "role": "assistant",
             "content": response_text
         })
+        turn["reply_complete"] = True
         
         await websocket.send_json({
             "type": "llm.done",
             "text": response_text
         })
-        
-        # 3. TTS 流式生成音频
+
+    try:
+        # 3. TTS 流式生成音频: 第一个完整分句到达即开始合成，不等 LLM 结束
+        #    音频按会话协商的 output_audio_format 流式编码
+        encoder = create_encoder(session["output_audio_format"], tts_service.sample_rate)
         session["is_speaking"] = True
         
-        async for audio_chunk in tts_service.synthesize_stream(response_text):
-            if not session["is_speaking"]:
-                break  # 用户取消
-                
-            # 发送音频块给前端
-            await websocket.send_bytes(audio_chunk)
+        text_stream = llm_text_stream(session["conversation_history"].messages(), on_delta, on_done, chunks)
+        async with contextlib.aclosing(tts_service.synthesize_text_stream(
+            text_stream, on_sentence=playback.start_sentence
+        )) as audio_stream:
+            async for audio_chunk in audio_stream:
+                if not session["is_speaking"]:
+                    break  # 用户取消
+                    
+                # 发送音频块给前端
+                playback.add_audio(audio_chunk)
+                audio = encoder.encode(audio_chunk)
+                if audio:
+                    await websocket.send_bytes(audio)
+        
+        audio = encoder.flush()
+        if audio:
+            await websocket.send_bytes(audio)
         
         # 4. TTS 完成
         await websocket.send_json({
             "type": "tts.done",
+            "format": encoder.name,
             "timestamp": datetime.now().isoformat()
         })
         
         session["is_speaking"] = False
         
+    except Overloaded as e:
+        session["is_speaking"] = False
+        await websocket.send_json({
+            "type": "error",
+            "code": "busy",
+            "message": str(e),
+            "retry_after": e.retry_after
+        })
     except Exception as e:
+        session["is_speaking"] = False
         logger.error(f"Error in LLM/TTS pipeline: {e}")
         await websocket.send_json({
             "type": "error",
             "message": str(e)
         })
+    finally:
+        if chunks is not None:
+            # 被打断或出错时投机生成的 token 流可能尚未开始读取，在此关闭以取消生成
+            await chunks.aclose()
 
 
 if __name__ == "__main__":
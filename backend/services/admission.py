@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+准入控制
+语音管线各阶段 (ASR / LLM / TTS) 的并发上限与有界等待队列，以及全局会话上限。
+过载时快速拒绝 (WebSocket 关闭码 1013 / HTTP 503 + Retry-After)，而不是让所有请求一起变慢；
+队列深度与拒绝次数通过 /stats 暴露，供自动扩缩容使用。
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from loguru import logger
+
+# WebSocket 关闭码: Try Again Later
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class Overloaded(Exception):
+    """阶段或会话已满，请求被拒绝"""
+
+    def __init__(self, stage: str, reason: str, retry_after: float):
+        super().__init__(f"{stage} overloaded ({reason}), retry after {retry_after:.0f}s")
+        self.stage = stage
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    """单个阶段的并发上限 + 有界等待队列
+
+    - 同时执行的请求不超过 max_concurrency
+    - 排队等待的请求不超过 max_queue，队列已满时立即拒绝
+    - 等待超过 max_wait_ms 时拒绝
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: int,
+        max_wait_ms: float,
+        retry_after: float = 1.0,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait_ms / 1000
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        self.active = 0
+        self.waiting = 0
+
+        # 统计
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_seen_ms = 0.0
+
+    @classmethod
+    def from_env(cls, name: str, max_concurrency: int, max_queue: int, max_wait_ms: float) -> "StageLimiter":
+        """按 ADMISSION_<NAME>_CONCURRENCY / _QUEUE / _WAIT_MS 覆盖默认值"""
+        prefix = f"ADMISSION_{name.upper()}"
+        return cls(
+            name,
+            max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(max_concurrency))),
+            max_queue=int(os.getenv(f"{prefix}_QUEUE", str(max_queue))),
+            max_wait_ms=float(os.getenv(f"{prefix}_WAIT_MS", str(max_wait_ms))),
+            retry_after=float(os.getenv("ADMISSION_RETRY_AFTER_S", "2")),
+        )
+
+    @property
+    def saturated(self) -> bool:
+        """所有名额都在使用中 (新请求需要排队)"""
+        return self.active >= self.max_concurrency
+
+    @property
+    def full(self) -> bool:
+        """新请求会被立即拒绝 (用于流式响应开始前的快速检查)"""
+        return self.saturated and self.waiting >= self.max_queue
+
+    async def acquire(self):
+        """获取执行名额；拒绝时抛出 Overloaded"""
+        if self.active < self.max_concurrency and self.waiting == 0:
+            # 快速路径: 有空闲名额且无人排队
+            await self._semaphore.acquire()
+            self.active += 1
+            self.admitted += 1
+            return
+
+        if self.waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise Overloaded(self.name, "queue full", self.retry_after)
+
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise Overloaded(self.name, "wait timeout", self.retry_after) from None
+        finally:
+            self.waiting -= 1
+
+        waited_ms = (time.monotonic() - started) * 1000
+        self.total_wait_ms += waited_ms
+        self.max_wait_seen_ms = max(self.max_wait_seen_ms, waited_ms)
+        self.active += 1
+        self.admitted += 1
+
+    async def try_acquire(self) -> bool:
+        """有空闲名额且无人排队时立即获取，否则返回 False (不排队、不计入拒绝)"""
+        if self.active >= self.max_concurrency or self.waiting > 0:
+            return False
+        await self._semaphore.acquire()  # 有空闲名额，不会挂起
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait_ms": self.max_wait * 1000,
+            "utilization": self.active / self.max_concurrency if self.max_concurrency else 0.0,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait_ms": round(self.total_wait_ms / self.admitted, 1) if self.admitted else 0.0,
+            "max_wait_seen_ms": round(self.max_wait_seen_ms, 1),
+        }
+
+
+class AdmissionController:
+    """全局会话上限 + 各阶段限流器"""
+
+    def __init__(self):
+        self.max_sessions = int(os.getenv("MAX_SESSIONS", "64"))
+        self.retry_after = float(os.getenv("ADMISSION_RETRY_AFTER_S", "2"))
+        self.sessions = 0
+        self.rejected_sessions = 0
+
+        self.stages: Dict[str, StageLimiter] = {
+            "asr": StageLimiter.from_env("asr", max_concurrency=16, max_queue=32, max_wait_ms=2000),
+            "llm": StageLimiter.from_env("llm", max_concurrency=16, max_queue=32, max_wait_ms=3000),
+            "tts": StageLimiter.from_env("tts", max_concurrency=8, max_queue=16, max_wait_ms=3000),
+        }
+
+    def __getitem__(self, stage: str) -> StageLimiter:
+        return self.stages[stage]
+
+    def open_session(self) -> Optional[Overloaded]:
+        """登记一个新会话；已满时返回 Overloaded (不抛出，调用方据此关闭连接)"""
+        if self.sessions >= self.max_sessions:
+            self.rejected_sessions += 1
+            logger.warning(f"Session rejected: {self.sessions}/{self.max_sessions} sessions active")
+            return Overloaded("session", "session limit", self.retry_after)
+        self.sessions += 1
+        return None
+
+    def close_session(self):
+        self.sessions -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "sessions": self.sessions,
+            "max_sessions": self.max_sessions,
+            "rejected_sessions": self.rejected_sessions,
+            "stages": {name: limiter.stats() for name, limiter in self.stages.items()},
+        }
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+ASR 批处理调度器
+跨会话收集待识别的音频窗口，合并为一次批量推理
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+
+@dataclass
+class _PendingWindow:
+    """等待推理的音频窗口"""
+    audio: np.ndarray
+    language: str
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class ASRBatchScheduler:
+    """ASR 动态微批处理
+
+    各会话提交就绪的音频窗口后挂起等待；调度器在 max_wait_ms 内
+    (或凑满 max_batch_size) 收集窗口，按语言分组后执行一次批量推理，
+    再把结果分发回各自的等待协程。以少量排队延迟换取吞吐。
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[np.ndarray], str], List[Optional[Dict]]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        max_producers: Optional[Callable[[], int]] = None,
+    ):
+        self.run_batch = run_batch  # 同步批量推理函数 (在线程池中运行)
+        # 当前可能提交窗口的会话数：批次已包含所有会话时无需再等待
+        self.max_producers = max_producers
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight = 0
+
+        # 统计
+        self._submitted = 0
+        self._batches = 0
+        self._batched_items = 0
+        self._queue_wait_ms_total = 0.0
+        self._batch_size_hist: Dict[int, int] = defaultdict(int)
+
+    async def start(self):
+        """启动调度循环 (需在事件循环内调用)"""
+        if self._worker and not self._worker.done():
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+        logger.info(
+            f"ASR batch scheduler started "
+            f"(max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait_ms})"
+        )
+
+    async def stop(self):
+        """停止调度循环，排队中的窗口返回 None，正在推理的窗口抛出 RuntimeError"""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        if self._queue:
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if not item.future.done():
+                    item.future.set_result(None)
+
+    async def submit(self, audio: np.ndarray, language: str = "auto") -> Optional[Dict]:
+        """提交一个音频窗口，等待其识别结果"""
+        if self._worker is None:
+            raise RuntimeError("ASR batch scheduler not started")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_PendingWindow(audio, language, future))
+        self._submitted += 1
+        return await future
+
+    async def _run(self):
+        while True:
+            batch: List[_PendingWindow] = []
+            try:
+                await self._collect(batch)
+                self._in_flight = len(batch)
+                await self._dispatch(batch)
+            except asyncio.CancelledError:
+                # 调度器停止时批次可能正在收集或推理: 结清其中所有等待者，避免 submit 永久挂起
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(RuntimeError("ASR batch scheduler stopped"))
+                raise
+            except Exception as e:
+                logger.error(f"ASR batch dispatch error: {e}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_result(None)
+            finally:
+                self._in_flight = 0
+
+    async def _collect(self, batch: List[_PendingWindow]):
+        """收集一批窗口到 batch：首个窗口到达后最多再等待 max_wait_ms"""
+        batch.append(await self._queue.get())
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+
+        limit = self.max_batch_size
+        if self.max_producers is not None:
+            limit = min(limit, max(1, self.max_producers()))
+
+        while len(batch) < limit:
+            # 已排队的窗口直接取走，不必等待
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _dispatch(self, batch: List[_PendingWindow]):
+        # 调用方已取消的窗口不再推理
+        batch = [item for item in batch if not item.future.done()]
+        if not batch:
+            return
+
+        # language 是 generate 的调用级参数，按语言分组推理
+        groups: Dict[str, List[_PendingWindow]] = defaultdict(list)
+        for item in batch:
+            groups[item.language].append(item)
+
+        now = time.monotonic()
+        for item in batch:
+            self._queue_wait_ms_total += (now - item.enqueued_at) * 1000
+
+        for language, items in groups.items():
+            results = await asyncio.to_thread(
+                self.run_batch,
+                [item.audio for item in items],
+                language,
+            )
+
+            self._batches += 1
+            self._batched_items += len(items)
+            self._batch_size_hist[len(items)] += 1
+
+            for item, result in zip(items, results):
+                if not item.future.done():
+                    item.future.set_result(result)
+
+    def stats(self) -> Dict:
+        """队列深度与批大小统计"""
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "in_flight": self._in_flight,
+            "submitted": self._submitted,
+            "batches": self._batches,
+            "avg_batch_size": (
+                self._batched_items / self._batches if self._batches else 0.0
+            ),
+            "avg_queue_wait_ms": (
+                self._queue_wait_ms_total / self._batched_items
+                if self._batched_items else 0.0
+            ),
+            "batch_size_hist": dict(sorted(self._batch_size_hist.items())),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+        }
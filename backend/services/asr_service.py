@@ -5,11 +5,21 @@ ASR 服务 - 基于 FunASR (阿里开源)
 """
 
 import asyncio
+import contextlib
+import itertools
 import os
-from typing import AsyncGenerator, Dict, Optional
+import re
+from typing import AsyncGenerator, Dict, Iterator, List, Optional
 import numpy as np
 from loguru import logger
 
+from services.admission import Overloaded, StageLimiter
+from services.asr_batcher import ASRBatchScheduler
+from utils.model_manifest import ModelManifest
+from utils.ring_buffer import AudioRingBuffer
+from utils.transcript_stitcher import TranscriptStitcher, join_tokens, tokenize
+from utils.vad import StreamingVAD, VADResult
+
 try:
     from funasr import AutoModel
     from modelscope.hub.snapshot_download import snapshot_download
@@ -22,6 +32,25 @@ except ImportError:
     logger.warning("FunASR not installed, ASR service will not work")
     AutoModel = None
 
+try:
+    import soundfile as sf
+except ImportError:
+    logger.warning("soundfile not installed, file transcription will not work")
+    sf = None
+
+try:
+    import librosa  # 仅用于文件转写时重采样
+except ImportError:
+    librosa = None
+
+
+# SenseVoice 支持的语言；"auto" 为自动检测
+SUPPORTED_LANGUAGES = {"auto", "zh", "en", "yue", "ja", "ko"}
+
+# SenseVoice 在文本开头输出语言标签，如 <|zh|>
+_LANG_TAG_RE = re.compile(r"<\|(%s)\|>" % "|".join(sorted(SUPPORTED_LANGUAGES - {"auto"})))
+_EMPTY_AUDIO = np.zeros(0, dtype=np.float32)
+
 
 class ASRService:
     """ASR 语音识别服务"""
@@ -34,10 +63,38 @@ class ASRService:
         )
         self.use_cpu = os.getenv("USE_CPU", "0") == "1"
         self.sample_rate = 16000  # Fun-ASR 要求 16kHz
+        self.manifest = ModelManifest()
         
-        # 流式处理缓冲区
-        self.audio_buffer = []
+        # 流式处理配置 (缓冲区由每个连接的 ASRStream 持有)
         self.buffer_duration_ms = 200  # 每 200ms 处理一次
+        # 滑动窗口解码: 窗口 (上下文 + 新音频) 上限与左移后保留的上下文
+        self.window_ms = int(os.getenv("ASR_WINDOW_MS", "3000"))
+        self.context_ms = int(os.getenv("ASR_CONTEXT_MS", "1000"))
+        # 每个流的音频缓冲硬上限，防止异常客户端无限占用内存
+        self.max_buffer_ms = int(os.getenv("ASR_MAX_BUFFER_MS", "10000"))
+        
+        # 文件转写: 分块读取、按静音切分、批量推理
+        self.file_block_s = int(os.getenv("ASR_FILE_BLOCK_S", "10"))
+        self.file_max_segment_s = int(os.getenv("ASR_FILE_MAX_SEGMENT_S", "30"))
+        self.file_batch_size = int(os.getenv("ASR_FILE_BATCH_SIZE", "16"))
+        
+        # 活跃的流式识别会话
+        self.streams: Dict[str, "ASRStream"] = {}
+        
+        # 音频量统计 (VAD 跳过的静音不送入模型)
+        self.audio_ms_received = 0.0
+        self.audio_ms_voiced = 0.0   # VAD 判为语音的音频
+        self.audio_ms_decoded = 0.0  # 实际送入模型的音频 (含窗口上下文)
+        
+        # 跨会话批处理调度 (load_model 时启动)
+        self.batcher = ASRBatchScheduler(
+            self._run_batch_inference,
+            max_batch_size=int(os.getenv("ASR_MAX_BATCH_SIZE", "8")),
+            max_wait_ms=float(os.getenv("ASR_BATCH_WAIT_MS", "20")),
+            max_producers=lambda: len(self.streams),
+        )
+        # ASR 阶段准入控制 (由 server 设置): 流式识别每句占用一个名额，离线转写每批占用一个名额
+        self.limiter: Optional[StageLimiter] = None
         
     async def load_model(self):
         """加载 ASR 模型"""
@@ -47,31 +104,13 @@ class ASRService:
         logger.info(f"Loading ASR model: {self.model_name}")
         
         try:
-            # 下载模型 (首次运行)
-            model_dir = None
-            try:
-                model_dir = snapshot_download(self.model_name)
-                logger.info(f"Model downloaded to (ModelScope): {model_dir}")
-            except Exception as ms_err:
-                logger.warning(f"ModelScope download failed for {self.model_name}: {ms_err}")
-                # 当使用 ModelScope 路径失败时，回退到 Hugging Face 上的公开模型
-                if hf_snapshot_download:
-                    fallback = os.getenv("ASR_MODEL_FALLBACK", "FunAudioLLM/SenseVoiceSmall")
-                    try:
-                        model_dir = hf_snapshot_download(fallback)
-                        # 将模型名切换为 Hugging Face 标识，便于 AutoModel 加载
-                        self.model_name = fallback
-                        logger.info(f"Model downloaded to (HuggingFace): {model_dir}")
-                    except Exception as hf_err:
-                        logger.error(f"HuggingFace fallback download failed for {fallback}: {hf_err}")
-                        raise
-                else:
-                    raise
+            # 解析本地模型目录 (清单命中时不联网)
+            model_dir = await asyncio.to_thread(self.resolve_model_dir)
             
             # 加载模型
             device = "cpu" if self.use_cpu else "cuda"
             self.model = AutoModel(
-                model=self.model_name,
+                model=model_dir,
                 trust_remote_code=True,
                 device=device,
                 ncpu=4 if self.use_cpu else 1,
@@ -79,21 +118,74 @@ class ASRService:
                 batch_size=1,
             )
             
+            await self.batcher.start()
+            
             logger.success(f"✅ ASR model loaded on {device}")
             
         except Exception as e:
             logger.error(f"Failed to load ASR model: {e}")
             raise
     
+    def resolve_model_dir(self) -> str:
+        """解析模型目录: 优先本地清单，未命中时下载并登记"""
+        model_dir = self.manifest.resolve(self.model_name)
+        if model_dir:
+            logger.info(f"Using cached model from manifest: {model_dir}")
+            return model_dir
+        
+        if self.manifest.offline:
+            raise RuntimeError(
+                f"Model {self.model_name} not found in {self.manifest.path} and MODEL_OFFLINE=1. "
+                "Run: python3 prebake_models.py"
+            )
+        
+        # 下载模型 (首次运行)
+        source = "modelscope"
+        try:
+            model_dir = snapshot_download(self.model_name)
+            logger.info(f"Model downloaded to (ModelScope): {model_dir}")
+        except Exception as ms_err:
+            logger.warning(f"ModelScope download failed for {self.model_name}: {ms_err}")
+            # 当使用 ModelScope 路径失败时，回退到 Hugging Face 上的公开模型
+            if not hf_snapshot_download:
+                raise
+            fallback = os.getenv("ASR_MODEL_FALLBACK", "FunAudioLLM/SenseVoiceSmall")
+            try:
+                model_dir = hf_snapshot_download(fallback)
+                source = f"huggingface:{fallback}"
+                logger.info(f"Model downloaded to (HuggingFace): {model_dir}")
+            except Exception as hf_err:
+                logger.error(f"HuggingFace fallback download failed for {fallback}: {hf_err}")
+                raise
+        
+        # 按请求的模型 ID 登记，下次启动直接命中
+        self.manifest.register(self.model_name, model_dir, source=source)
+        return model_dir
+    
+    def create_stream(self, stream_id: str, limited: bool = True) -> "ASRStream":
+        """为一个连接创建独立的流式识别对象 (limited=False: 调用方已自行占用 ASR 名额)"""
+        stream = ASRStream(self, stream_id, self.limiter if limited else None)
+        self.streams[stream_id] = stream
+        return stream
+    
+    def close_stream(self, stream_id: str):
+        """释放连接的流式识别对象"""
+        stream = self.streams.pop(stream_id, None)
+        if stream:
+            stream.reset()
+            stream.closed = True
+    
     async def transcribe_stream(
         self, 
-        audio_chunk: bytes
+        audio_chunk: bytes,
+        stream: "ASRStream"
     ) -> Optional[Dict]:
         """
         流式语音识别
         
         Args:
             audio_chunk: 音频数据 (PCM 16kHz mono)
+            stream: 当前连接的流式识别对象 (由 create_stream 创建)
             
         Returns:
             {
@@ -105,100 +197,483 @@ class ASRService:
         if self.model is None:
             raise RuntimeError("ASR model not loaded")
         
-        try:
-            # 转换为 numpy array
-            audio_np = np.frombuffer(audio_chunk, dtype=np.int16)
-            audio_float = audio_np.astype(np.float32) / 32768.0
-            
-            # 添加到缓冲区
-            self.audio_buffer.append(audio_float)
-            
-            # 计算缓冲区时长
-            total_samples = sum(len(buf) for buf in self.audio_buffer)
-            duration_ms = (total_samples / self.sample_rate) * 1000
-            
-            # 如果缓冲区不足，返回空
-            if duration_ms < self.buffer_duration_ms:
-                return None
-            
-            # 合并缓冲区
-            audio_data = np.concatenate(self.audio_buffer)
-            self.audio_buffer = []
-            
-            # ASR 推理
-            result = await asyncio.to_thread(
-                self._run_inference,
-                audio_data
-            )
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"ASR transcription error: {e}")
-            return None
+        return await stream.accept_audio(audio_chunk)
     
-    def _run_inference(self, audio_data: np.ndarray) -> Dict:
-        """同步推理方法 (在线程池中运行)"""
+    async def infer(self, audio_data: np.ndarray, language: str = "auto") -> Optional[Dict]:
+        """提交一个音频窗口到批处理调度器，等待识别结果"""
+        return await self.batcher.submit(audio_data, language)
+    
+    def _run_batch_inference(
+        self,
+        audio_batch: List[np.ndarray],
+        language: str = "auto"
+    ) -> List[Optional[Dict]]:
+        """同步批量推理方法 (在线程池中运行)"""
         try:
-            # FunASR 推理
+            # FunASR 推理: 一次 generate 处理整批窗口
             res = self.model.generate(
-                input=audio_data,
-                batch_size=1,
-                language="auto",  # 自动检测语言
-                use_itn=True,     # 使用逆文本归一化
+                input=audio_batch,
+                batch_size=len(audio_batch),
+                language=language,  # "auto" 为自动检测语言
+                use_itn=True,       # 使用逆文本归一化
             )
             
-            if res and len(res) > 0:
-                text = res[0].get("text", "")
-                
-                # 判断是否是最终结果 (简单策略: 文本长度 > 3)
-                is_final = len(text) > 3
-                
-                return {
-                    "text": text,
-                    "is_final": is_final,
-                    "confidence": 0.9,  # FunASR 不直接提供置信度
-                    "language": res[0].get("lang", "zh"),
-                }
-            
-            return None
+            results = [self._parse_result(item) for item in (res or [])]
+            # 结果数量与输入不一致时补齐，保证按位置分发
+            results += [None] * (len(audio_batch) - len(results))
+            return results[:len(audio_batch)]
             
         except Exception as e:
             logger.error(f"Inference error: {e}")
+            return [None] * len(audio_batch)
+    
+    def _parse_result(self, item: Dict) -> Optional[Dict]:
+        if not item:
             return None
+        
+        text = item.get("text", "")
+        tag = _LANG_TAG_RE.search(text)
+        
+        # 是否最终结果由 ASRStream 的 VAD 端点决定
+        return {
+            "text": text,
+            "is_final": False,
+            "confidence": 0.9,  # FunASR 不直接提供置信度
+            "language": tag.group(1) if tag else item.get("lang"),
+        }
+    
+    def stats(self) -> Dict:
+        """运行时统计"""
+        skipped_ms = self.audio_ms_received - self.audio_ms_voiced
+        languages: Dict[str, int] = {}
+        for stream in self.streams.values():
+            lang = stream.language_state.decode_language
+            languages[lang] = languages.get(lang, 0) + 1
+        
+        return {
+            "active_streams": len(self.streams),
+            "stream_languages": languages,
+            "audio_ms_received": round(self.audio_ms_received),
+            "audio_ms_voiced": round(self.audio_ms_voiced),
+            "audio_ms_decoded": round(self.audio_ms_decoded),
+            "silence_skip_ratio": (
+                skipped_ms / self.audio_ms_received if self.audio_ms_received else 0.0
+            ),
+            "batch": self.batcher.stats(),
+        }
     
     async def transcribe_file(self, audio_file: str) -> str:
         """转写音频文件 (非流式)"""
+        texts = [
+            segment["text"]
+            async for segment in self.transcribe_file_segments(audio_file)
+            if segment["text"]
+        ]
+        return " ".join(texts)
+    
+    async def transcribe_file_segments(self, audio_file: str) -> AsyncGenerator[Dict, None]:
+        """
+        分段转写音频文件
+        
+        按块读取文件 (不整体加载)，用 VAD 按静音切分，
+        每 file_batch_size 段做一次批量推理。
+        
+        Yields:
+            {"start": 秒, "end": 秒, "text": "识别文本"}
+        """
         if self.model is None:
             raise RuntimeError("ASR model not loaded")
+        if sf is None:
+            raise RuntimeError("soundfile not installed")
         
-        try:
-            result = await asyncio.to_thread(
-                self.model.generate,
-                input=audio_file,
-                batch_size=1,
-                language="auto",
-                use_itn=True,
+        segments = self._iter_file_segments(audio_file)
+        while True:
+            batch = await asyncio.to_thread(
+                lambda: list(itertools.islice(segments, self.file_batch_size))
             )
+            if not batch:
+                break
             
-            if result and len(result) > 0:
-                return result[0].get("text", "")
+            async with self._background_slot():
+                results = await asyncio.to_thread(
+                    self._run_batch_inference,
+                    [segment["audio"] for segment in batch],
+                    "auto"
+                )
             
-            return ""
+            for segment, result in zip(batch, results):
+                yield {
+                    "start": round(segment["start"], 3),
+                    "end": round(segment["end"], 3),
+                    "text": join_tokens(tokenize(result["text"])) if result else "",
+                }
+    
+    @contextlib.asynccontextmanager
+    async def _background_slot(self):
+        """离线转写占用 ASR 名额: 过载时等待重试而不是失败 (后台任务让位于实时会话)"""
+        if self.limiter is None:
+            yield
+            return
+        while True:
+            try:
+                await self.limiter.acquire()
+                break
+            except Overloaded as e:
+                await asyncio.sleep(e.retry_after)
+        try:
+            yield
+        finally:
+            self.limiter.release()
+    
+    def _iter_file_segments(self, audio_file: str) -> Iterator[Dict]:
+        """分块读取音频文件，按静音切分为语音段 (同步生成器，在线程池中运行)"""
+        source_rate = sf.info(audio_file).samplerate
+        piece = self.sample_rate * self.buffer_duration_ms // 1000
+        max_segment = self.sample_rate * self.file_max_segment_s
+        
+        vad = StreamingVAD(sample_rate=self.sample_rate)
+        current = []
+        current_len = 0
+        position = 0  # 已处理的样本数 (16kHz)
+        
+        def emit():
+            audio = np.concatenate(current)
+            end = position - vad.unprocessed_samples
+            return {
+                "start": (end - len(audio)) / self.sample_rate,
+                "end": end / self.sample_rate,
+                "audio": audio,
+            }
+        
+        for block in sf.blocks(
+            audio_file,
+            blocksize=source_rate * self.file_block_s,
+            dtype="float32",
+            always_2d=True,
+        ):
+            audio = block.mean(axis=1)
+            if source_rate != self.sample_rate:
+                if librosa is None:
+                    raise RuntimeError("librosa not installed, cannot resample")
+                audio = librosa.resample(
+                    audio, orig_sr=source_rate, target_sr=self.sample_rate
+                ).astype(np.float32)
             
-        except Exception as e:
-            logger.error(f"File transcription error: {e}")
-            return ""
+            for offset in range(0, len(audio), piece):
+                chunk = audio[offset:offset + piece]
+                result = vad.process(chunk)
+                position += len(chunk)
+                
+                while True:
+                    if len(result.speech):
+                        current.append(result.speech)
+                        current_len += len(result.speech)
+                    
+                    if current and (result.speech_ended or current_len >= max_segment):
+                        yield emit()
+                        current = []
+                        current_len = 0
+                    
+                    if not result.speech_ended:
+                        break
+                    # 终点之后的音频属于下一段
+                    result = vad.process(_EMPTY_AUDIO)
+        
+        if current:
+            yield emit()
     
     async def cleanup(self):
         """清理资源"""
-        self.audio_buffer = []
+        for stream_id in list(self.streams):
+            self.close_stream(stream_id)
+        await self.batcher.stop()
         if self.model:
             del self.model
             self.model = None
         logger.info("ASR service cleaned up")
 
 
+class ASRStream:
+    """单个连接的流式识别状态
+    
+    每个 WebSocket 连接 (或一次 REST 请求) 持有自己的缓冲区、
+    中间结果和最终化状态，避免多个调用方的音频互相混杂。
+    音频先经过 VAD：静音帧直接丢弃，语音终点触发最终结果。
+    语句内采用滑动窗口解码：每次解码 有界左侧上下文 + 新音频，
+    由 TranscriptStitcher 拼接各窗口结果，单次解码开销与语句长度无关。
+    
+    设置了 limiter 时每句话占用一个 ASR 名额 (首次解码时获取，最终结果后释放)：
+    名额已满时不做中间解码，音频留在缓冲区合并到之后的解码；语句结束时
+    仍未获得名额则排队等待，超时或队列已满时丢弃本句并抛出 Overloaded (连接不受影响)。
+    """
+    
+    def __init__(self, service: ASRService, stream_id: str, limiter: Optional[StageLimiter] = None):
+        self.service = service
+        self.stream_id = stream_id
+        self.limiter = limiter
+        self._admitted = False  # 当前语句已占用 ASR 名额
+        self._end_pending = False  # 缓冲区中的语句已结束，下一次调用时输出最终结果
+        self.vad = StreamingVAD(sample_rate=service.sample_rate)
+        self.language_state = LanguageState()
+        
+        # 解码窗口音频 = 已解码的左侧上下文 + 待解码的新音频 (末尾 buffered_samples 个)
+        self.audio_buffer = AudioRingBuffer(
+            service.sample_rate * max(service.max_buffer_ms, service.window_ms * 2) // 1000
+        )
+        self.buffered_samples = 0
+        self.stitcher = TranscriptStitcher()  # 当前语句的拼接文本
+        self.partial_text = ""    # 最近一次中间结果
+        self.final_text = ""      # 最近一次最终结果
+        self.language = None      # 最近一次识别出的语言
+        self.is_final = False
+        self.speech_onsets = 0    # VAD 检测到的语音起点次数 (用于打断检测)
+        self.closed = False
+    
+    @property
+    def buffered_ms(self) -> float:
+        return self.buffered_samples / self.service.sample_rate * 1000
+    
+    async def accept_audio(self, audio_chunk: bytes) -> Optional[Dict]:
+        """接收一段 PCM 音频：VAD 过滤后缓冲，满 buffer_duration_ms 推理，语音结束时给出最终结果"""
+        if self.closed:
+            raise RuntimeError(f"ASR stream {self.stream_id} is closed")
+        
+        try:
+            # 转换为 float32 (单次运算，不产生中间数组)
+            audio_np = np.frombuffer(audio_chunk, dtype=np.int16)
+            audio_float = np.multiply(audio_np, 1 / 32768.0, dtype=np.float32)
+            self.service.audio_ms_received += len(audio_float) / self.service.sample_rate * 1000
+            
+            # 上一块中已检测到终点、尚未输出的语句
+            final = await self._finalize() if self._end_pending else None
+            
+            # VAD: 只保留语音帧。VAD 在终点处停止，终点之后的音频 (下一句的预滚动与起点)
+            # 在本句最终化之后再处理，不会并入本句
+            vad_result = self.vad.process(audio_float)
+            while True:
+                self._accept_speech(vad_result)
+                if not vad_result.speech_ended:
+                    break
+                if final is not None:
+                    # 一块音频中结束了不止一句 (块长超过起点 + 拖尾时长): 下一次调用再输出
+                    self._end_pending = True
+                    break
+                # 语音终点 → 最终结果
+                final = await self._finalize()
+                vad_result = self.vad.process(_EMPTY_AUDIO)
+            
+            if final is not None:
+                return final
+            
+            # 如果缓冲区不足，返回空
+            if self.buffered_ms < self.service.buffer_duration_ms:
+                return None
+            
+            # ASR 名额已满: 跳过中间结果，音频合并到下一次解码
+            if not await self._try_admit():
+                return None
+            
+            return await self._decode_buffer()
+            
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error(f"ASR transcription error [{self.stream_id}]: {e}")
+            return None
+    
+    async def flush(self) -> Optional[Dict]:
+        """输入结束：处理剩余缓冲音频并给出最终结果"""
+        if self.closed:
+            return None
+        
+        try:
+            results = []
+            while True:
+                more = self._end_pending
+                result = await self._finalize()
+                if result:
+                    results.append(result)
+                if not more:
+                    break
+                # 已结束的语句之后还有 VAD 未处理的音频: 输入已结束，逐句识别后合并输出
+                vad_result = self.vad.process(_EMPTY_AUDIO)
+                self._accept_speech(vad_result)
+                self._end_pending = vad_result.speech_ended
+            
+            if not results:
+                return None
+            return {**results[-1], "text": " ".join(r["text"] for r in results)}
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error(f"ASR flush error [{self.stream_id}]: {e}")
+            return None
+    
+    def _accept_speech(self, vad_result: VADResult):
+        if vad_result.speech_started:
+            self.is_final = False
+            self.speech_onsets += 1
+        
+        if len(vad_result.speech):
+            self.service.audio_ms_voiced += len(vad_result.speech) / self.service.sample_rate * 1000
+            self.audio_buffer.append(vad_result.speech)
+            self.buffered_samples = min(
+                self.buffered_samples + len(vad_result.speech),
+                self.audio_buffer.capacity
+            )
+    
+    async def _try_admit(self) -> bool:
+        if not self._admitted and self.limiter is not None:
+            self._admitted = await self.limiter.try_acquire()
+        return self._admitted or self.limiter is None
+    
+    def _release(self):
+        if self._admitted:
+            self._admitted = False
+            self.limiter.release()
+    
+    async def _decode_buffer(self) -> Optional[Dict]:
+        sample_rate = self.service.sample_rate
+        
+        # 解码窗口 = 环形缓冲区中全部音频 (零拷贝视图)
+        has_context = len(self.audio_buffer) > self.buffered_samples
+        window = self.audio_buffer.view()
+        self.buffered_samples = 0
+        self.service.audio_ms_decoded += len(window) / sample_rate * 1000
+        
+        # ASR 推理 (经批处理调度器与其它会话合批)
+        language = self.language_state.decode_language
+        result = await self.service.infer(window, language)
+        self.language_state.observe(result, language)
+        if result and result.get("text"):
+            self.stitcher.update(result["text"], has_context)
+            self.language = result.get("language", self.language)
+        
+        # 窗口超限时左移，只保留最近 context_ms 作为下一窗口的上下文
+        context_samples = sample_rate * self.service.context_ms // 1000
+        if context_samples <= 0 or len(window) > sample_rate * self.service.window_ms // 1000:
+            self.stitcher.slide(context_samples / len(window))
+            self.audio_buffer.discard(len(window) - context_samples)
+        
+        text = self.stitcher.text
+        if not result or not text:
+            return None
+        
+        self.partial_text = text
+        return {
+            **result,
+            "text": text,
+            "stable_text": self.stitcher.stable_text,
+            "unstable_text": self.stitcher.unstable_text,
+            "is_final": False,
+        }
+    
+    async def _finalize(self) -> Optional[Dict]:
+        """语音结束：解码剩余音频，输出整句最终结果"""
+        try:
+            if self.buffered_samples:
+                if not await self._try_admit():
+                    # 排队等待名额；被拒绝时丢弃本句 (finally 中清空)
+                    await self.limiter.acquire()
+                    self._admitted = True
+                await self._decode_buffer()
+            
+            self.stitcher.commit_all()
+            text = self.stitcher.text
+        finally:
+            self._end_pending = False
+            self._release()
+            self.stitcher.reset()
+            self.audio_buffer.clear()
+            self.buffered_samples = 0
+            self.partial_text = ""
+        if not text:
+            return None
+        
+        self.final_text = text
+        self.is_final = True
+        return {
+            "text": text,
+            "is_final": True,
+            "confidence": 0.9,
+            "language": self.language or "zh",
+        }
+    
+    def reset(self):
+        """清空缓冲区与识别状态 (如清空对话时)"""
+        self._release()
+        self._end_pending = False
+        self.vad.reset()
+        self.audio_buffer.clear()
+        self.buffered_samples = 0
+        self.stitcher.reset()
+        self.partial_text = ""
+        self.final_text = ""
+        self.is_final = False
+
+
+class LanguageState:
+    """会话级语言状态
+    
+    自动检测连续 pin_after 个窗口得到同一语言后固定该语言，
+    后续窗口不再做语言识别 (更省算力，中间结果也不会在 zh/en 间跳变)。
+    固定后若连续 unpin_after 个有声窗口识别为空 (低置信信号)，
+    恢复自动检测。显式指定 (session.update) 优先于一切。
+    """
+    
+    def __init__(self, pin_after: Optional[int] = None, unpin_after: Optional[int] = None):
+        self.pin_after = pin_after if pin_after is not None else int(os.getenv("ASR_LANG_PIN_AFTER", "3"))
+        self.unpin_after = unpin_after if unpin_after is not None else int(os.getenv("ASR_LANG_UNPIN_AFTER", "3"))
+        self.override: Optional[str] = None  # 显式指定的语言
+        self.pinned: Optional[str] = None    # 自动固定的语言
+        self._candidate: Optional[str] = None
+        self._votes = 0
+        self._misses = 0
+    
+    @property
+    def decode_language(self) -> str:
+        return self.override or self.pinned or "auto"
+    
+    def set_override(self, language: Optional[str]):
+        """显式指定语言；"auto" 或 None 清除指定并重新自动检测"""
+        if language not in SUPPORTED_LANGUAGES and language is not None:
+            raise ValueError(f"Unsupported language: {language}")
+        self.override = None if language in (None, "auto") else language
+        self._unpin()
+    
+    def observe(self, result: Optional[Dict], requested: str):
+        """根据一个窗口的识别结果更新状态"""
+        if self.override:
+            return
+        
+        text = result.get("text", "") if result else ""
+        if requested == "auto":
+            language = result.get("language") if result else None
+            if not language or not text:
+                return
+            if language == self._candidate:
+                self._votes += 1
+            else:
+                self._candidate = language
+                self._votes = 1
+            if self._votes >= self.pin_after:
+                self.pinned = language
+                self._misses = 0
+                logger.debug(f"ASR language pinned to {language}")
+        else:
+            # 已固定语言：有声窗口识别为空视为低置信
+            self._misses = 0 if text else self._misses + 1
+            if self._misses >= self.unpin_after:
+                logger.debug(f"ASR language {self.pinned} unpinned (low confidence)")
+                self._unpin()
+    
+    def _unpin(self):
+        self.pinned = None
+        self._candidate = None
+        self._votes = 0
+        self._misses = 0
+
+
 # ============================================
 # 🎤 使用示例
 # ============================================
@@ -207,11 +682,13 @@ class ASRService:
 asr = ASRService()
 await asr.load_model()
 
-# 流式识别
+# 流式识别 (每个连接一个 stream)
+stream = asr.create_stream("client_1")
 audio_chunk = b'...'  # PCM 16kHz mono
-result = await asr.transcribe_stream(audio_chunk)
+result = await asr.transcribe_stream(audio_chunk, stream)
 if result:
     print(f"识别: {result['text']}, 最终: {result['is_final']}")
+asr.close_stream("client_1")
 
 # 文件识别
 text = await asr.transcribe_file("audio.wav")
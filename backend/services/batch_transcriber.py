@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+批量离线转写服务
+提交目录或文件列表，后台并行转写，可轮询状态并以 NDJSON 流式获取结果
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Dict, List, Optional
+
+from loguru import logger
+
+try:
+    import soundfile as sf
+except ImportError:
+    logger.warning("soundfile not installed, batch transcription will not work")
+    sf = None
+
+AUDIO_EXTENSIONS = {".wav", ".flac", ".ogg", ".mp3", ".m4a", ".aiff", ".aif"}
+
+
+class PathNotAllowed(ValueError):
+    """路径不存在或不在 BATCH_ASR_ROOT 内 (两种情况同一错误)"""
+
+    def __init__(self):
+        super().__init__("Path not found or not allowed")
+
+
+def _within(root: str, path: str) -> bool:
+    return os.path.commonpath([root, path]) == root
+
+
+@dataclass
+class BatchTranscriptionJob:
+    """批量转写任务"""
+    job_id: str
+    files: List[str]
+    status: str = "queued"  # queued / running / done / failed
+    results: List[Dict] = field(default_factory=list)
+    files_done: int = 0
+    files_failed: int = 0
+    audio_seconds: float = 0.0
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    updated: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def wall_seconds(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """吞吐: 每墙钟小时处理的音频小时数"""
+        wall = self.wall_seconds
+        return self.audio_seconds / wall if wall > 0 else 0.0
+
+    def summary(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "files_total": len(self.files),
+            "files_done": self.files_done,
+            "files_failed": self.files_failed,
+            "audio_hours": round(self.audio_seconds / 3600, 4),
+            "wall_seconds": round(self.wall_seconds, 2),
+            "audio_hours_per_wall_hour": round(self.throughput, 2),
+            "error": self.error,
+        }
+
+    def _notify(self):
+        # 唤醒所有等待结果的读取方
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+
+class BatchTranscriber:
+    """批量转写任务管理"""
+
+    def __init__(self, asr_service):
+        self.asr_service = asr_service
+        self.jobs: Dict[str, BatchTranscriptionJob] = {}
+        self.file_concurrency = int(os.getenv("BATCH_ASR_FILE_CONCURRENCY", "4"))
+        self.max_jobs = int(os.getenv("BATCH_ASR_MAX_JOBS", "100"))  # 保留的任务数上限
+        # 若设置，只允许转写该目录下的文件 (REST 接口必须设置，命令行可不设)
+        self.root = os.getenv("BATCH_ASR_ROOT")
+
+    def resolve_files(
+        self,
+        paths: Optional[List[str]] = None,
+        directory: Optional[str] = None,
+        recursive: bool = True,
+    ) -> List[str]:
+        """展开目录/文件列表为音频文件路径
+
+        设置了 BATCH_ASR_ROOT 时相对路径按该目录解析，所有路径 (解析符号链接后) 必须位于其中；
+        路径不存在与越界抛出同一个 PathNotAllowed，不暴露服务器上的文件是否存在
+        """
+        root = os.path.realpath(self.root) if self.root else None
+        files = [self._resolve(p, root) for p in (paths or [])]
+
+        if directory:
+            directory = self._resolve(directory, root)
+            if root and (not _within(root, directory) or not os.path.isdir(directory)):
+                raise PathNotAllowed()
+            if not os.path.isdir(directory):
+                raise ValueError(f"Directory not found: {directory}")
+            if recursive:
+                walker = os.walk(directory)
+            else:
+                walker = [(directory, [], os.listdir(directory))]
+            for base, _, names in walker:
+                for name in sorted(names):
+                    if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                        path = self._resolve(os.path.join(base, name), root)
+                        if root is None or _within(root, path):
+                            files.append(path)
+
+        if root:
+            if any(not _within(root, f) or not os.path.isfile(f) for f in files):
+                raise PathNotAllowed()
+            return files
+
+        missing = [f for f in files if not os.path.isfile(f)]
+        if missing:
+            raise ValueError(f"Files not found: {missing[:3]}")
+
+        return files
+
+    @staticmethod
+    def _resolve(path: str, root: Optional[str]) -> str:
+        if root is None:
+            return os.path.abspath(path)
+        return os.path.realpath(os.path.join(root, path))
+
+    def submit(self, files: List[str]) -> BatchTranscriptionJob:
+        """提交任务，立即返回 (后台执行)"""
+        if not files:
+            raise ValueError("No audio files to transcribe")
+
+        job = BatchTranscriptionJob(job_id=uuid.uuid4().hex, files=files)
+        self._prune()
+        self.jobs[job.job_id] = job
+        asyncio.create_task(self.run(job))
+        logger.info(f"Batch transcription job {job.job_id} submitted ({len(files)} files)")
+        return job
+
+    def _prune(self):
+        """超出上限时丢弃最早完成的任务"""
+        finished = [j for j in self.jobs.values() if j.status in ("done", "failed")]
+        for job in sorted(finished, key=lambda j: j.created_at)[:max(0, len(self.jobs) + 1 - self.max_jobs)]:
+            del self.jobs[job.job_id]
+
+    def get(self, job_id: str) -> Optional[BatchTranscriptionJob]:
+        return self.jobs.get(job_id)
+
+    async def run(self, job: BatchTranscriptionJob):
+        """执行任务: 多个文件并行，每个文件内部分段批量推理"""
+        job.status = "running"
+        job.started_at = time.time()
+        job._notify()
+
+        semaphore = asyncio.Semaphore(self.file_concurrency)
+
+        async def run_file(path: str):
+            async with semaphore:
+                await self._transcribe_one(job, path)
+
+        try:
+            await asyncio.gather(*(run_file(path) for path in job.files))
+            job.status = "done"
+        except Exception as e:
+            logger.error(f"Batch transcription job {job.job_id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job._notify()
+            logger.info(f"Batch transcription job {job.job_id}: {job.summary()}")
+
+    async def _transcribe_one(self, job: BatchTranscriptionJob, path: str):
+        result = {"file": path}
+        try:
+            segments = [
+                segment
+                async for segment in self.asr_service.transcribe_file_segments(path)
+            ]
+            duration = await asyncio.to_thread(_audio_duration, path)
+
+            result.update({
+                "text": " ".join(s["text"] for s in segments if s["text"]),
+                "segments": segments,
+                "duration_s": round(duration, 3),
+            })
+            job.audio_seconds += duration
+            job.files_done += 1
+        except Exception as e:
+            logger.error(f"Batch transcription failed for {path}: {e}")
+            result["error"] = str(e)
+            job.files_failed += 1
+
+        job.results.append(result)
+        job._notify()
+
+    async def stream_results(self, job_id: str) -> AsyncGenerator[str, None]:
+        """以 NDJSON 行流式输出结果，任务结束时输出汇总行"""
+        job = self.jobs[job_id]
+        sent = 0
+        while True:
+            updated = job.updated
+            while sent < len(job.results):
+                yield json.dumps({"type": "result", **job.results[sent]}, ensure_ascii=False) + "\n"
+                sent += 1
+            if job.status in ("done", "failed"):
+                break
+            await updated.wait()
+
+        yield json.dumps({"type": "summary", **job.summary()}, ensure_ascii=False) + "\n"
+
+
+def _audio_duration(path: str) -> float:
+    return sf.info(path).duration
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+对话历史
+按 token 预算保留最近的对话原文，较早的轮次在后台折叠进滚动摘要 (订单状态)，
+每轮发送给 LLM 的上下文大小保持稳定。token 数在追加消息时增量估算，不重复分词整段历史。
+"""
+
+import asyncio
+import math
+import os
+import re
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+
+# 每条消息的格式开销 (role、分隔符)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数: 中日韩每字约 1 个，其余约 4 个字符 1 个"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class ConversationHistory:
+    """单个会话的对话历史
+
+    - 最近的消息原文保留，总量超过 HISTORY_TOKEN_BUDGET 时，把最早的若干轮
+      (至少保留 HISTORY_KEEP_MESSAGES 条) 移出原文区，收缩到预算的 HISTORY_FOLD_RATIO
+    - 移出的消息交给 summarize(旧摘要, 消息) 在后台合并进摘要；摘要完成前这些消息仍原文发送，
+      但超出预算的部分 (最早的) 不发送
+    - 摘要失败或为空时按 HISTORY_SUMMARY_BACKOFF_MS 指数退避重试，连续失败
+      HISTORY_SUMMARY_RETRIES 次后丢弃这批消息，避免积压
+    - messages() 返回发送给 LLM 的历史: [摘要 (system)] + 待折叠消息 + 原文消息
+    """
+
+    def __init__(
+        self,
+        summarize: Optional[Callable[[str, List[Dict[str, str]]], Awaitable[str]]] = None,
+        budget: Optional[int] = None,
+    ):
+        self.summarize = summarize
+        self.budget = budget if budget is not None else int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+        self.keep_messages = int(os.getenv("HISTORY_KEEP_MESSAGES", "6"))
+        self.fold_ratio = float(os.getenv("HISTORY_FOLD_RATIO", "0.6"))
+        self.summary_retries = int(os.getenv("HISTORY_SUMMARY_RETRIES", "3"))
+        self.summary_backoff = float(os.getenv("HISTORY_SUMMARY_BACKOFF_MS", "500")) / 1000
+
+        self.summary = ""
+        self._summary_tokens = 0
+        self._recent: List[Dict[str, str]] = []
+        self._recent_tokens: List[int] = []  # 每条消息的 token 数 (追加时估算一次)
+        self._recent_total = 0
+        self._folding: List[Dict[str, str]] = []  # 已移出原文区、尚未并入摘要
+        self._folding_tokens: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+        self.version = 0  # 每次追加或清空时递增 (摘要折叠不改变版本)
+
+        # 统计
+        self.folded_messages = 0
+        self.summary_runs = 0
+        self.summary_failures = 0
+        self.dropped_messages = 0
+
+    def append(self, message: Dict[str, str]):
+        """追加一条消息 ({"role", "content"})"""
+        tokens = estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+        self.version += 1
+        self._recent.append(message)
+        self._recent_tokens.append(tokens)
+        self._recent_total += tokens
+        if self.summarize is not None and self._recent_total > self.budget:
+            self._fold()
+
+    def replace_last(self, message: Dict[str, str]):
+        """替换最后一条消息 (如回复被打断后只保留已播放的部分)"""
+        if not self._recent:
+            self.append(message)
+            return
+        tokens = estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+        self.version += 1
+        self._recent_total += tokens - self._recent_tokens[-1]
+        self._recent[-1] = message
+        self._recent_tokens[-1] = tokens
+
+    def pop(self) -> Optional[Dict[str, str]]:
+        """移除最后一条消息"""
+        if not self._recent:
+            return None
+        self.version += 1
+        self._recent_total -= self._recent_tokens.pop()
+        return self._recent.pop()
+
+    def clear(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self.version += 1
+        self.summary = ""
+        self._summary_tokens = 0
+        self._recent.clear()
+        self._recent_tokens.clear()
+        self._recent_total = 0
+        self._folding.clear()
+        self._folding_tokens.clear()
+
+    def messages(self) -> List[Dict[str, str]]:
+        """发送给 LLM 的历史 (不含系统提示词)"""
+        prefix = []
+        if self.summary:
+            prefix.append({"role": "system", "content": f"Conversation so far (summary):\n{self.summary}"})
+        return prefix + self._folding[self._folding_skip():] + self._recent
+
+    @property
+    def tokens(self) -> int:
+        """messages() 的估算 token 数"""
+        return self._summary_tokens + sum(self._folding_tokens[self._folding_skip():]) + self._recent_total
+
+    def _folding_skip(self) -> int:
+        """待折叠消息中因超出预算而不发送的条数 (从最早的开始)"""
+        total = self._summary_tokens + sum(self._folding_tokens) + self._recent_total
+        skip = 0
+        while skip < len(self._folding_tokens) and total > self.budget:
+            total -= self._folding_tokens[skip]
+            skip += 1
+        return skip
+
+    def __len__(self) -> int:
+        return len(self._recent) + len(self._folding)
+
+    def _fold(self):
+        """把最早的消息移出原文区，直到原文区回到预算的 fold_ratio 以内"""
+        target = self.budget * self.fold_ratio
+        total = self._recent_total
+        count = 0
+        while len(self._recent) - count > self.keep_messages and total > target:
+            total -= self._recent_tokens[count]
+            count += 1
+        # 原文区从用户消息开始，避免拆开一问一答
+        while count < len(self._recent) - 1 and self._recent[count].get("role") != "user":
+            count += 1
+        if count == 0:
+            return
+
+        self._folding.extend(self._recent[:count])
+        self._folding_tokens.extend(self._recent_tokens[:count])
+        self._recent_total -= sum(self._recent_tokens[:count])
+        del self._recent[:count]
+        del self._recent_tokens[:count]
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._summarize_loop())
+
+    async def _summarize_loop(self):
+        """后台合并摘要；运行期间新移出的消息在下一轮合并，失败时退避重试"""
+        failures = 0
+        while self._folding:
+            batch = list(self._folding)
+            self.summary_runs += 1
+            try:
+                summary = (await self.summarize(self.summary, batch)).strip()
+                error = None if summary else "empty summary"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e)
+
+            if error is not None:
+                self.summary_failures += 1
+                failures += 1
+                if failures <= self.summary_retries:
+                    logger.warning(f"History summarization failed ({failures}/{self.summary_retries}): {error}")
+                    await asyncio.sleep(self.summary_backoff * 2 ** (failures - 1))
+                    continue
+                # 多次失败: 丢弃最早的这批消息 (不并入摘要)，保证上下文不超预算
+                logger.warning(f"History summarization gave up, dropping {len(batch)} messages: {error}")
+                del self._folding[:len(batch)]
+                del self._folding_tokens[:len(batch)]
+                self.dropped_messages += len(batch)
+                failures = 0
+                continue
+
+            failures = 0
+            self.summary = summary
+            self._summary_tokens = estimate_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+            del self._folding[:len(batch)]
+            del self._folding_tokens[:len(batch)]
+            self.folded_messages += len(batch)
+            logger.debug(
+                f"Folded {len(batch)} messages into history summary ({self._summary_tokens} tokens)"
+            )
+
+    def stats(self) -> Dict:
+        return {
+            "budget": self.budget,
+            "tokens": self.tokens,
+            "recent_messages": len(self._recent),
+            "pending_fold": len(self._folding),
+            "summary_tokens": self._summary_tokens,
+            "folded_messages": self.folded_messages,
+            "summary_runs": self.summary_runs,
+            "summary_failures": self.summary_failures,
+            "dropped_messages": self.dropped_messages,
+        }
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+LLM 回复缓存
+按 (系统提示词, 最近对话窗口, 归一化用户输入) 缓存完整回复，TTL + LRU 淘汰；
+可选的本地向量相似度层用于命中改写过的问法。命中时以 token 流回放，下游流式处理不变。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+_SPACE_RE = re.compile(r"\s+")
+# 回放时的 token 粒度: 英文按单词 (连同后面的空白)，中日韩按单字
+_REPLAY_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]|[^\s぀-ヿ㐀-䶿一-鿿가-힯]+\s*|\s+")
+
+
+@dataclass
+class _Entry:
+    context: str
+    user_text: str
+    response: str
+    embedding: Optional[np.ndarray]
+    created_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class CacheLookup:
+    """一次查询的上下文，未命中时用于写回"""
+    key: str
+    context: str
+    user_text: str
+    embedding: Optional[np.ndarray] = None
+    response: Optional[str] = None
+    tier: Optional[str] = None  # exact / semantic
+    embedding_task: Optional[asyncio.Task] = None  # 后台计算中的用户输入向量
+
+
+class LLMResponseCache:
+    """LLM 回复缓存
+
+    - 只缓存 LLM_CACHE_TURNS 指定轮次的用户输入 (按本次对话中第几条用户消息计)
+    - 精确层: sha256(上下文 + 归一化用户输入)，归一化为 NFKC、忽略大小写/标点/多余空白
+    - 相似度层 (设置 LLM_CACHE_EMBED_MODEL 时启用): 同一上下文中
+      用户输入向量余弦相似度 >= LLM_CACHE_SIMILARITY 视为命中。
+      向量在后台计算，与 LLM 请求并行；只在 LLM_CACHE_EMBED_TIMEOUT_MS 内且首 token 到达前就绪时查询，
+      否则按未命中处理，向量算完后随回复写入供之后的请求匹配
+    """
+
+    def __init__(self, embed: Optional[Callable[[str], Awaitable[np.ndarray]]] = None):
+        self.max_entries = int(os.getenv("LLM_CACHE_SIZE", "256"))
+        self.ttl = float(os.getenv("LLM_CACHE_TTL_S", "3600"))
+        self.turns = {int(t) for t in os.getenv("LLM_CACHE_TURNS", "1").split(",") if t.strip()}
+        self.history_window = int(os.getenv("LLM_CACHE_HISTORY", "4"))
+        self.similarity = float(os.getenv("LLM_CACHE_SIMILARITY", "0.92"))
+        self.embed_timeout = float(os.getenv("LLM_CACHE_EMBED_TIMEOUT_MS", "150")) / 1000
+        self.embed = embed
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+        # 统计
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def cacheable(self, messages: List[Dict[str, str]]) -> bool:
+        """最后一条是用户消息，且其轮次在 LLM_CACHE_TURNS 中 (含历史摘要时无法确定轮次，不缓存)"""
+        if not messages or messages[-1].get("role") != "user":
+            return False
+        if any(m.get("role") == "system" for m in messages):
+            return False
+        depth = sum(1 for m in messages if m.get("role") == "user")
+        return depth in self.turns
+
+    def make_lookup(self, system_prompt: str, model: str, messages: List[Dict[str, str]]) -> CacheLookup:
+        window = messages[:-1][-self.history_window:] if self.history_window > 0 else []
+        context = _sha256([
+            model,
+            normalize_text(system_prompt),
+            [(m.get("role"), normalize_text(m.get("content", ""))) for m in window],
+        ])
+        user_text = normalize_text(messages[-1].get("content", ""), strip_punctuation=True)
+        return CacheLookup(key=_sha256([context, user_text]), context=context, user_text=user_text)
+
+    def get(
+        self,
+        system_prompt: str,
+        model: str,
+        messages: List[Dict[str, str]]
+    ) -> Optional[CacheLookup]:
+        """查询精确层；不可缓存的轮次返回 None，否则返回 lookup (命中时 response 不为空)
+
+        精确层未命中且启用相似度层时，在后台开始计算用户输入向量 (lookup.embedding_task)，
+        由调用方在等待 LLM 首 token 的同时用 match_semantic 查询相似度层
+        """
+        if not self.cacheable(messages):
+            self.skipped += 1
+            return None
+
+        lookup = self.make_lookup(system_prompt, model, messages)
+        entry = self._get_entry(lookup.key)
+        if entry is not None:
+            self.exact_hits += 1
+            lookup.response, lookup.tier = entry.response, "exact"
+            return lookup
+
+        if self.embed is not None and lookup.user_text:
+            lookup.embedding_task = asyncio.create_task(self._embed_unit(lookup.user_text))
+        return lookup
+
+    async def match_semantic(self, lookup: CacheLookup, first_token: Optional[asyncio.Future] = None) -> bool:
+        """等待向量 (不超过 embed_timeout，first_token 先完成时不再等待) 并查询相似度层
+
+        命中时填入 lookup.response 并返回 True；每次未命中的查询调用一次，用于统计
+        """
+        task = lookup.embedding_task
+        if task is not None and self._has_context(lookup.context):
+            if not task.done():
+                waiters = {task} if first_token is None else {task, first_token}
+                await asyncio.wait(waiters, timeout=self.embed_timeout, return_when=asyncio.FIRST_COMPLETED)
+            if task.done() and not task.cancelled():
+                lookup.embedding = task.result()
+            if lookup.embedding is not None:
+                entry = self._nearest(lookup)
+                if entry is not None:
+                    self.semantic_hits += 1
+                    lookup.response, lookup.tier = entry.response, "semantic"
+                    return True
+
+        self.misses += 1
+        return False
+
+    def put(self, lookup: CacheLookup, response: str):
+        """写入完整回复"""
+        if not response.strip():
+            return
+        entry = _Entry(lookup.context, lookup.user_text, response, lookup.embedding)
+        task = lookup.embedding_task
+        if entry.embedding is None and task is not None:
+            # 向量尚未算完: 完成后补写，之后的改写问法即可命中
+            def attach(done: asyncio.Task):
+                if not done.cancelled():
+                    entry.embedding = done.result()
+            if task.done():
+                attach(task)
+            else:
+                task.add_done_callback(attach)
+        self._entries.pop(lookup.key, None)
+        self._entries[lookup.key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _get_entry(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def _embed_unit(self, text: str) -> Optional[np.ndarray]:
+        try:
+            return _unit(await self.embed(text))
+        except Exception as e:
+            logger.warning(f"LLM cache embedding failed: {e}")
+            return None
+
+    def _has_context(self, context: str) -> bool:
+        """同一上下文中是否有可供相似度匹配的条目 (没有时不必等待向量)"""
+        return any(
+            entry.context == context and entry.embedding is not None and not self._expired(entry)
+            for entry in self._entries.values()
+        )
+
+    def _expired(self, entry: _Entry) -> bool:
+        return self.ttl > 0 and time.monotonic() - entry.created_at > self.ttl
+
+    def _nearest(self, lookup: CacheLookup) -> Optional[_Entry]:
+        """同一上下文中向量最相近且超过阈值的条目"""
+        candidates = [
+            (key, entry) for key, entry in self._entries.items()
+            if entry.context == lookup.context and entry.embedding is not None and not self._expired(entry)
+        ]
+        if not candidates:
+            return None
+        scores = np.stack([entry.embedding for _, entry in candidates]) @ lookup.embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        key, entry = candidates[best]
+        self._entries.move_to_end(key)
+        return entry
+
+    def stats(self) -> Dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": (lookups - self.misses) / lookups if lookups else 0.0,
+            "turns": sorted(self.turns),
+            "semantic": self.embed is not None,
+        }
+
+
+async def replay(text: str) -> AsyncGenerator[str, None]:
+    """把缓存的回复按 token 粒度逐段产出 (每段之间让出事件循环)"""
+    for match in _REPLAY_RE.finditer(text):
+        yield match.group()
+        await asyncio.sleep(0)
+
+
+def normalize_text(text: str, strip_punctuation: bool = False) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    if strip_punctuation:
+        text = "".join(" " if unicodedata.category(c).startswith("P") else c for c in text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _sha256(value) -> str:
+    raw = json.dumps(value, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+多后端 LLM 路由
+在一组 OpenAI 兼容后端 (如多个 Ollama 实例) 之间分配流式请求:
+- 按各后端首 token 延迟 (TTFT) 与生成速度的 EWMA，选择预计最快产出首句的健康后端
+- 首 token 超过该后端 TTFT p95 仍未到达时，向另一个后端对冲发出同样的请求，先出 token 的胜出
+- 连续失败的后端熔断一段时间，冷却后放行一个试探请求
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+_END = object()
+
+
+@dataclass
+class LLMBackend:
+    """一个 OpenAI 兼容后端"""
+    name: str
+    base_url: str
+    model: str
+    client: Any  # AsyncOpenAI
+
+    ttft_ewma_ms: Optional[float] = None
+    tokens_per_s_ewma: Optional[float] = None
+    ttft_samples: Deque[float] = field(default_factory=lambda: deque(maxlen=100))
+    inflight: int = 0
+
+    # 熔断
+    consecutive_failures: int = 0
+    open_until: float = 0.0
+    trial_inflight: bool = False
+
+    # 统计
+    requests: int = 0
+    failures: int = 0
+    hedges_won: int = 0
+
+    def ttft_p95_ms(self) -> Optional[float]:
+        if len(self.ttft_samples) < 5:
+            return None
+        return float(np.percentile(self.ttft_samples, 95))
+
+
+class LLMRouter:
+    """流式请求路由 (EWMA 选择 + 对冲 + 熔断)"""
+
+    def __init__(self, backends: List[LLMBackend]):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = backends
+        self.alpha = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.3"))
+        # 评分按 "首 token + 生成这么多 token" 的预计耗时 (约一个短句，TTS 即可开始)
+        self.score_tokens = int(os.getenv("LLM_ROUTER_SCORE_TOKENS", "20"))
+        # 没有 p95 样本时的对冲等待时间；LLM_HEDGE_DELAY_MS=0 关闭对冲
+        self.hedge_delay_ms = float(os.getenv("LLM_HEDGE_DELAY_MS", "800"))
+        self.hedge_min_ms = float(os.getenv("LLM_HEDGE_MIN_MS", "100"))
+        self.breaker_failures = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+        self.breaker_cooldown = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
+        # 对冲失败方继续等到首 token (最多这么久) 以得到真实的 TTFT 样本，输出丢弃
+        self.loser_sample_ms = float(os.getenv("LLM_HEDGE_LOSER_SAMPLE_MS", "5000"))
+
+        # 统计
+        self.hedged = 0
+        self.failovers = 0
+
+    def available(self, backend: LLMBackend, now: float) -> bool:
+        """熔断关闭，或冷却结束且没有进行中的试探请求"""
+        if backend.consecutive_failures < self.breaker_failures:
+            return True
+        return now >= backend.open_until and not backend.trial_inflight
+
+    def pick(self, exclude: Optional[List[LLMBackend]] = None) -> Optional[LLMBackend]:
+        """预计首句最快的可用后端；没有样本的后端优先 (先探测)"""
+        now = time.monotonic()
+        candidates = [
+            b for b in self.backends
+            if (not exclude or b not in exclude) and self.available(b, now)
+        ]
+        if not candidates:
+            return None
+
+        return min(candidates, key=self.score)
+
+    def score(self, backend: LLMBackend) -> float:
+        """预计产出前 score_tokens 个 token 的耗时 (ms)；没有样本时按进行中的请求数排序
+
+        没有生成速度样本的后端 (如总是输掉对冲) 按已知最慢的速度估算，
+        不会因为缺少样本而比测得速度的后端显得更快
+        """
+        if backend.ttft_ewma_ms is None:
+            return backend.inflight
+        expected_ms = backend.ttft_ewma_ms
+        rate = backend.tokens_per_s_ewma
+        if rate is None:
+            rates = [b.tokens_per_s_ewma for b in self.backends if b.tokens_per_s_ewma]
+            rate = min(rates) if rates else None
+        if rate:
+            expected_ms += self.score_tokens / rate * 1000
+        # 排队中的请求按平均生成耗时粗略折算
+        return expected_ms * (1 + backend.inflight)
+
+    def hedge_delay(self, backend: LLMBackend) -> Optional[float]:
+        """对冲等待 (秒)；None 表示不对冲"""
+        if self.hedge_delay_ms <= 0 or len(self.backends) < 2:
+            return None
+        p95 = backend.ttft_p95_ms()
+        delay_ms = self.hedge_delay_ms if p95 is None else max(p95, self.hedge_min_ms)
+        return delay_ms / 1000
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int = 500,
+    ) -> AsyncGenerator[str, None]:
+        """流式生成: 选择后端、必要时对冲，首 token 前失败会换后端重试"""
+        tried: List[LLMBackend] = []
+        attempts: List["_Attempt"] = []
+        last_error: Optional[BaseException] = None
+        hedge_pending = True
+        hedge: Optional[_Attempt] = None
+
+        def launch() -> bool:
+            backend = self.pick(exclude=tried)
+            if backend is None:
+                return False
+            tried.append(backend)
+            attempts.append(_Attempt(self, backend, messages, temperature, max_tokens))
+            return True
+
+        try:
+            if not launch():
+                raise RuntimeError("No healthy LLM backend available")
+
+            while True:
+                # 先出 token (或正常结束) 的请求胜出
+                winner = next((a for a in attempts if a.first.is_set() and a.error is None), None)
+                if winner is not None:
+                    break
+
+                running = [a for a in attempts if not a.first.is_set()]
+                if not running:
+                    # 全部在首 token 前失败: 换一个没试过的后端
+                    if not launch():
+                        raise last_error or RuntimeError("No healthy LLM backend available")
+                    self.failovers += 1
+                    continue
+
+                timeout = self.hedge_delay(running[0].backend) if hedge_pending and len(running) == 1 else None
+                waiters = [asyncio.ensure_future(a.first.wait()) for a in running]
+                done, pending = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in pending:
+                    waiter.cancel()
+
+                if not done:
+                    # 首 token 超时: 对冲 (每个请求最多一次；没有其它可用后端时继续等待)
+                    hedge_pending = False
+                    if launch():
+                        hedge = attempts[-1]
+                        self.hedged += 1
+                        logger.debug(f"LLM hedge: {running[0].backend.name} → {attempts[-1].backend.name}")
+                    continue
+
+                for attempt in running:
+                    if attempt.error is not None:
+                        last_error = attempt.error
+
+            if winner is hedge:
+                winner.backend.hedges_won += 1
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel(lost=True)
+
+            async for text in winner.drain():
+                yield text
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    def record_first_token(self, backend: LLMBackend, ttft_ms: float):
+        """首 token 到达即视为后端健康 (关闭熔断)"""
+        backend.ttft_samples.append(ttft_ms)
+        backend.ttft_ewma_ms = _ewma(backend.ttft_ewma_ms, ttft_ms, self.alpha)
+        if backend.consecutive_failures >= self.breaker_failures:
+            logger.info(f"LLM backend {backend.name} recovered")
+        backend.consecutive_failures = 0
+
+    def record_rate(self, backend: LLMBackend, tokens: int, generation_s: float):
+        if tokens > 1 and generation_s > 0:
+            backend.tokens_per_s_ewma = _ewma(backend.tokens_per_s_ewma, tokens / generation_s, self.alpha)
+
+    def record_abandoned(self, backend: LLMBackend, waited_ms: float):
+        """对冲失败方在采样时限内仍无首 token: 已等待时间作为 TTFT 下限计入"""
+        backend.ttft_samples.append(waited_ms)
+        backend.ttft_ewma_ms = _ewma(backend.ttft_ewma_ms, waited_ms, self.alpha)
+
+    def record_failure(self, backend: LLMBackend, error: BaseException):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.breaker_failures:
+            backend.open_until = time.monotonic() + self.breaker_cooldown
+            logger.warning(
+                f"LLM backend {backend.name} ejected for {self.breaker_cooldown:.0f}s "
+                f"after {backend.consecutive_failures} failures: {error}"
+            )
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "hedged": self.hedged,
+            "failovers": self.failovers,
+            "backends": [
+                {
+                    "name": b.name,
+                    "model": b.model,
+                    "healthy": b.consecutive_failures < self.breaker_failures,
+                    "available": self.available(b, now),
+                    "inflight": b.inflight,
+                    "ttft_ewma_ms": round(b.ttft_ewma_ms, 1) if b.ttft_ewma_ms is not None else None,
+                    "ttft_p95_ms": round(b.ttft_p95_ms(), 1) if b.ttft_p95_ms() is not None else None,
+                    "tokens_per_s_ewma": round(b.tokens_per_s_ewma, 1) if b.tokens_per_s_ewma is not None else None,
+                    "score_ms": round(self.score(b), 1) if b.ttft_ewma_ms is not None else None,
+                    "requests": b.requests,
+                    "failures": b.failures,
+                    "hedges_won": b.hedges_won,
+                }
+                for b in self.backends
+            ],
+        }
+
+
+class _Attempt:
+    """对某个后端的一次流式请求: 后台读取，内容进入队列；first 在首 token 或失败时置位"""
+
+    def __init__(self, router: LLMRouter, backend: LLMBackend, messages, temperature, max_tokens):
+        self.router = router
+        self.backend = backend
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.first = asyncio.Event()
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.lost = False  # 对冲中输给了另一个后端
+        self.started_at = time.monotonic()
+        self._task = asyncio.create_task(self._run(messages, temperature, max_tokens))
+
+    async def _run(self, messages, temperature, max_tokens):
+        backend, router = self.backend, self.router
+        backend.requests += 1
+        backend.inflight += 1
+        trial = backend.consecutive_failures >= router.breaker_failures
+        backend.trial_inflight = backend.trial_inflight or trial
+        started = time.monotonic()
+        first_at = None
+        tokens = 0
+        stream = None
+        try:
+            stream = await backend.client.chat.completions.create(
+                model=backend.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            async for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if first_at is None:
+                    first_at = time.monotonic()
+                    router.record_first_token(backend, (first_at - started) * 1000)
+                    self.first.set()
+                if self.lost:
+                    return  # 对冲失败方: 已取得 TTFT 样本，停止生成
+                tokens += 1
+                self.queue.put_nowait(chunk.choices[0].delta.content)
+            if first_at is None:
+                # 空回复
+                first_at = time.monotonic()
+                router.record_first_token(backend, (first_at - started) * 1000)
+                self.first.set()
+            router.record_rate(backend, tokens, time.monotonic() - first_at)
+            self.queue.put_nowait(_END)
+        except asyncio.CancelledError:
+            # 调用方提前结束 (如用户打断) 不更新 EWMA 与熔断状态；
+            # 对冲失败方采样超时，等待时间作为 TTFT 下限计入
+            if self.lost and first_at is None:
+                router.record_abandoned(backend, (time.monotonic() - started) * 1000)
+            raise
+        except Exception as e:
+            router.record_failure(backend, e)
+            self.error = e
+            self.queue.put_nowait(e)
+            self.first.set()
+        finally:
+            self.done = True
+            backend.inflight -= 1
+            if trial:
+                backend.trial_inflight = False
+            if stream is not None and hasattr(stream, "close"):
+                # 关闭 HTTP 流 (释放连接，后端停止生成)
+                with contextlib.suppress(Exception):
+                    await stream.close()
+
+    async def drain(self) -> AsyncGenerator[str, None]:
+        while True:
+            item = await self.queue.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def cancel(self, lost: bool = False):
+        """结束请求；lost=True (对冲失败方) 时先等到首 token 或采样时限再结束"""
+        if self._task.done() or self.lost:
+            return
+        if not lost or self.first.is_set():
+            self._task.cancel()
+            return
+        self.lost = True
+        remaining = self.router.loser_sample_ms / 1000 - (time.monotonic() - self.started_at)
+        asyncio.get_running_loop().call_later(max(0.0, remaining), self._task.cancel)
+
+
+def _ewma(previous: Optional[float], value: float, alpha: float) -> float:
+    return value if previous is None else alpha * value + (1 - alpha) * previous
+
+
+def parse_backends(spec: str, default_model: str) -> List[Dict[str, str]]:
+    """LLM_BACKENDS: 逗号分隔的 base URL，可写成 model@url 指定模型"""
+    backends = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model, url = "", item
+        if not item.startswith(("http://", "https://")):
+            model, _, url = item.partition("@")
+        backends.append({"base_url": url.rstrip("/"), "model": model or default_model})
+    return backends
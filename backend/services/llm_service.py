@@ -4,15 +4,25 @@ LLM 服务 - 对话引擎
 支持远程 API (OpenAI/Anthropic) 和本地模型 (Ollama/Qwen)
 """
 
+import asyncio
+import contextlib
 import os
-from typing import AsyncGenerator, List, Dict
+import time
+from typing import AsyncGenerator, List, Dict, Optional
 from loguru import logger
 
+from services.admission import StageLimiter
+from services.llm_cache import LLMResponseCache, replay
+from services.llm_router import LLMBackend, LLMRouter, parse_backends
+from services.llm_speculation import SpeculationMetrics, SpeculativeTurn
+
 try:
     from openai import AsyncOpenAI
+    import httpx
 except ImportError:
     logger.warning("OpenAI SDK not installed")
     AsyncOpenAI = None
+    httpx = None
 
 
 class LLMService:
@@ -30,6 +40,10 @@ class LLMService:
         self.api_base = os.getenv("LLM_API_BASE", "https://api.openai.com/v1")
         self.model = os.getenv("LLM_MODEL", "gpt-4o-mini")
         
+        # 多后端路由: 逗号分隔的 OpenAI 兼容 base URL (可写 model@url)，设置后流式对话在其间路由
+        self.backends_spec = os.getenv("LLM_BACKENDS", "")
+        self.router: Optional[LLMRouter] = None
+        
         # 系统提示词 (从现有配置复制)
         self.system_prompt = """
 You are a voice order-taking AI agent for Chunky Chook (Chicken & Chips) in Auckland.
@@ -57,43 +71,175 @@ Your job is to take accurate pickup orders quickly, confirm details, and avoid m
 - Speak naturally and conversationally
 """.strip()
         
+        # HTTP 连接池 (所有请求共享，保持长连接)
+        self.max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+        self.max_keepalive = int(os.getenv("LLM_MAX_KEEPALIVE", "16"))
+        self.keepalive_expiry = float(os.getenv("LLM_KEEPALIVE_EXPIRY_S", "300"))
+        self.connect_timeout = float(os.getenv("LLM_CONNECT_TIMEOUT_S", "5"))
+        self.request_timeout = float(os.getenv("LLM_TIMEOUT_S", "60"))
+        
+        # 保温: 空闲超过该间隔时让 Ollama 重新确认模型常驻内存 (0 关闭)
+        self.keep_warm_interval = float(os.getenv("LLM_KEEP_WARM_S", "120"))
+        self.ollama_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        
         self.client = None
+        self.http_client = None
+        self._init_lock = asyncio.Lock()
+        self._keep_warm_task: Optional[asyncio.Task] = None
+        self._last_used = 0.0
+        self.warmup_ms: Optional[float] = None
+        
+        # 历史摘要: 较早的对话折叠成订单状态摘要 (见 ConversationHistory)
+        self.summary_max_tokens = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "200"))
+        self.summary_prompt = """
+You maintain the running state of a pickup order conversation at Chunky Chook.
+Merge the previous summary and the new conversation lines into one updated summary.
+Keep only what matters for the order: items with quantities and options, customer name,
+phone number, pickup time, open questions, and anything already confirmed.
+Reply with the summary only, as short bullet points.
+""".strip()
+        
+        # 回复缓存 (LLM_CACHE=0 关闭)；设置 LLM_CACHE_EMBED_MODEL 时启用相似问法匹配
+        self.embed_model = os.getenv("LLM_CACHE_EMBED_MODEL", "")
+        self.cache = None
+        if os.getenv("LLM_CACHE", "1") == "1":
+            self.cache = LLMResponseCache(embed=self._embed if self.embed_model else None)
+        
+        # 投机生成: ASR 中间结果稳定后提前开始生成 (LLM_SPECULATIVE=1 开启)
+        self.speculative = os.getenv("LLM_SPECULATIVE", "0") == "1"
+        self.speculation = SpeculationMetrics()
+        
+        # LLM 阶段准入控制 (由 server 设置): 投机生成与历史摘要也占用名额
+        self.limiter: Optional[StageLimiter] = None
         
     async def initialize(self):
-        """初始化 LLM 客户端"""
+        """初始化 LLM 客户端 (共享连接池)，本地模型会预热并定期保温"""
         if AsyncOpenAI is None:
             raise RuntimeError("OpenAI SDK not installed. Run: pip install openai")
         
-        if self.use_local:
-            # 使用 Ollama 本地模型
-            logger.info(f"Initializing local LLM: {self.ollama_model}")
-            logger.info(f"Ollama endpoint: {self.ollama_base}")
+        async with self._init_lock:
+            if self.client is not None:
+                return
             
-            self.client = AsyncOpenAI(
-                api_key="ollama",  # Ollama 不需要真实 API key
-                base_url=self.ollama_base
+            self.http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.request_timeout, connect=self.connect_timeout),
             )
-            self.model = self.ollama_model
             
-            # 测试连接
+            if self.backends_spec:
+                self.router = self._create_router()
+            
+            if self.use_local:
+                # 使用 Ollama 本地模型
+                logger.info(f"Initializing local LLM: {self.ollama_model}")
+                logger.info(f"Ollama endpoint: {self.ollama_base}")
+                
+                self.client = AsyncOpenAI(
+                    api_key="ollama",  # Ollama 不需要真实 API key
+                    base_url=self.ollama_base,
+                    http_client=self.http_client,
+                )
+                self.model = self.ollama_model
+                
+                if self.keep_warm_interval > 0:
+                    self._keep_warm_task = asyncio.create_task(self._keep_warm_loop())
+                
+                # 预热: 加载模型并测试连接
+                try:
+                    logger.info("Warming up Ollama model...")
+                    await self.warm_up()
+                    logger.success(f"✅ Local LLM initialized: {self.ollama_model} (warm-up {self.warmup_ms:.0f}ms)")
+                except Exception as e:
+                    logger.error(f"Failed to connect to Ollama: {e}")
+                    logger.warning("Ollama 可能未运行，请确保:")
+                    logger.warning("  1. Mac 本地: ollama serve")
+                    logger.warning("  2. Docker: 使用 host.docker.internal")
+                    raise
+            else:
+                # 使用远程 API
+                self.client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.api_base,
+                    http_client=self.http_client,
+                )
+                logger.success(f"✅ LLM service initialized (API: {self.api_base})")
+    
+    async def warm_up(self):
+        """预热: 让 Ollama 把模型加载进内存，再发一个极短请求建立连接"""
+        started = time.monotonic()
+        await self._preload_model()
+        await self._test_connection()
+        self.warmup_ms = (time.monotonic() - started) * 1000
+        self._last_used = time.monotonic()
+    
+    def _create_router(self) -> LLMRouter:
+        """按 LLM_BACKENDS 为每个后端创建客户端 (共享连接池)"""
+        default_model = self.ollama_model if self.use_local else self.model
+        api_key = "ollama" if self.use_local else self.api_key
+        backends = [
+            LLMBackend(
+                name=f"{spec['model']}@{spec['base_url']}",
+                base_url=spec["base_url"],
+                model=spec["model"],
+                client=AsyncOpenAI(api_key=api_key, base_url=spec["base_url"], http_client=self.http_client),
+            )
+            for spec in parse_backends(self.backends_spec, default_model)
+        ]
+        logger.info(f"LLM router: {len(backends)} backends ({', '.join(b.name for b in backends)})")
+        return LLMRouter(backends)
+    
+    async def _preload_model(self):
+        """Ollama 原生接口: 空 prompt 的 generate 只加载模型，并设置常驻时长 (多后端时逐个预热)"""
+        if self.router:
+            targets = [(b.base_url, b.model) for b in self.router.backends]
+        else:
+            targets = [(self.ollama_base, self.ollama_model)]
+        results = await asyncio.gather(
+            *(self._preload_one(base, model) for base, model in targets), return_exceptions=True
+        )
+        errors = [r for r in results if isinstance(r, Exception)]
+        for (base, _), result in zip(targets, results):
+            if isinstance(result, Exception) and len(targets) > 1:
+                logger.warning(f"LLM preload failed for {base}: {result}")
+        if len(errors) == len(targets):
+            raise errors[0]
+    
+    async def _preload_one(self, base_url: str, model: str):
+        native_base = base_url.rstrip("/")
+        if native_base.endswith("/v1"):
+            native_base = native_base[:-3]
+        response = await self.http_client.post(
+            f"{native_base}/api/generate",
+            json={"model": model, "keep_alive": self.ollama_keep_alive},
+        )
+        response.raise_for_status()
+    
+    async def _keep_warm_loop(self):
+        """定期保温，防止 Ollama 在两次高峰之间卸载模型"""
+        while True:
+            await asyncio.sleep(self.keep_warm_interval)
+            if time.monotonic() - self._last_used < self.keep_warm_interval:
+                continue  # 最近有请求，模型与连接都是热的
             try:
-                # 简单测试请求
-                logger.info("Testing Ollama connection...")
-                await self._test_connection()
-                logger.success(f"✅ Local LLM initialized: {self.ollama_model}")
+                await self._preload_model()
+                self._last_used = time.monotonic()
+                logger.debug(f"LLM keep-warm ping ok ({self.ollama_model})")
             except Exception as e:
-                logger.error(f"Failed to connect to Ollama: {e}")
-                logger.warning("Ollama 可能未运行，请确保:")
-                logger.warning("  1. Mac 本地: ollama serve")
-                logger.warning("  2. Docker: 使用 host.docker.internal")
-                raise
-        else:
-            # 使用远程 API
-            self.client = AsyncOpenAI(
-                api_key=self.api_key,
-                base_url=self.api_base
-            )
-            logger.success(f"✅ LLM service initialized (API: {self.api_base})")
+                logger.warning(f"LLM keep-warm ping failed: {e}")
+    
+    async def close(self):
+        """停止保温并关闭连接池"""
+        if self._keep_warm_task:
+            self._keep_warm_task.cancel()
+            self._keep_warm_task = None
+        if self.http_client:
+            await self.http_client.aclose()
+            self.http_client = None
+        self.client = None
     
     async def _test_connection(self):
         """测试 Ollama 连接"""
@@ -108,6 +254,57 @@ Your job is to take accurate pickup orders quickly, confirm details, and avoid m
         except Exception as e:
             raise ConnectionError(f"Cannot connect to Ollama: {e}")
     
+    def create_speculator(self) -> Optional[SpeculativeTurn]:
+        """为会话创建投机生成状态 (未开启时返回 None)"""
+        if not self.speculative:
+            return None
+        return SpeculativeTurn(lambda messages: self.chat_stream(messages=messages), self.speculation, self.limiter)
+    
+    async def summarize_history(self, summary: str, messages: List[Dict[str, str]]) -> str:
+        """把较早的对话合并进滚动摘要 (后台调用，占用一个 LLM 名额；失败或过载时抛出异常)"""
+        if self.client is None:
+            await self.initialize()
+        
+        lines = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt = [
+            {"role": "system", "content": self.summary_prompt},
+            {"role": "user", "content": f"Previous summary:\n{summary or '(none)'}\n\nNew conversation:\n{lines}"},
+        ]
+        slot = self.limiter.slot() if self.limiter is not None else contextlib.nullcontext()
+        async with slot:
+            if self.router:
+                # 多后端: 与对话相同的后端选择与熔断 (跳过已熔断的后端，结果计入健康状态)
+                async with contextlib.aclosing(self.router.stream(prompt, 0.2, self.summary_max_tokens)) as stream:
+                    return "".join([text async for text in stream])
+            
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=prompt,
+                temperature=0.2,
+                max_tokens=self.summary_max_tokens,
+            )
+        return response.choices[0].message.content or ""
+    
+    async def _embed(self, text: str) -> List[float]:
+        """用同一端点的 embeddings 接口计算向量 (Ollama 需先拉取对应模型)"""
+        response = await self.client.embeddings.create(model=self.embed_model, input=text)
+        return response.data[0].embedding
+    
+    def stats(self) -> Dict:
+        """连接池配置、预热状态与缓存命中情况"""
+        return {
+            "model": self.model,
+            "initialized": self.client is not None,
+            "warmup_ms": round(self.warmup_ms, 1) if self.warmup_ms is not None else None,
+            "idle_s": round(time.monotonic() - self._last_used, 1) if self._last_used else None,
+            "keep_warm_interval_s": self.keep_warm_interval if self._keep_warm_task else 0,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "cache": self.cache.stats() if self.cache else None,
+            "speculation": self.speculation.stats() if self.speculative else None,
+            "router": self.router.stats() if self.router else None,
+        }
+    
     async def chat_stream(
         self,
         messages: List[Dict[str, str]],
@@ -127,30 +324,91 @@ Your job is to take accurate pickup orders quickly, confirm details, and avoid m
         """
         if self.client is None:
             await self.initialize()
+        self._last_used = time.monotonic()
+        
+        lookup = None
+        if self.cache:
+            lookup = self.cache.get(self.system_prompt, self.model, messages)
+            if lookup and lookup.response is not None:
+                logger.debug(f"LLM cache hit ({lookup.tier}): {lookup.user_text[:40]}")
+                async for token in replay(lookup.response):
+                    yield token
+                return
         
+        parts: List[str] = []
+        semantic_hit = False
         try:
             # 添加系统提示词
             full_messages = [
                 {"role": "system", "content": self.system_prompt}
             ] + messages
             
-            # 流式请求
-            stream = await self.client.chat.completions.create(
-                model=self.model,
-                messages=full_messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
-            
-            # 返回文本流
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            async with contextlib.aclosing(self._generate(full_messages, temperature, max_tokens)) as tokens:
+                if lookup is not None:
+                    # 相似度层与 LLM 请求并行查询: 向量在首 token 前 (且不超过超时) 就绪并命中时改为回放
+                    first = asyncio.ensure_future(anext(tokens, None))
+                    try:
+                        semantic_hit = await self.cache.match_semantic(lookup, first)
+                        if not semantic_hit:
+                            text = await first
+                            if text is not None:
+                                parts.append(text)
+                                yield text
+                    finally:
+                        if not first.done():
+                            first.cancel()
+                            await asyncio.wait({first})
+                
+                if not semantic_hit:
+                    async for text in tokens:
+                        parts.append(text)
+                        yield text
                     
         except Exception as e:
             logger.error(f"LLM chat error: {e}")
             yield f"[Error: {str(e)}]"
+            return
+        
+        if semantic_hit:
+            logger.debug(f"LLM cache hit ({lookup.tier}): {lookup.user_text[:40]}")
+            async for token in replay(lookup.response):
+                yield token
+            return
+        
+        # 只缓存完整生成的回复 (出错或被调用方提前关闭时不会走到这里)
+        if lookup is not None:
+            self.cache.put(lookup, "".join(parts))
+    
+    async def _generate(
+        self,
+        full_messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncGenerator[str, None]:
+        """向 LLM 发起流式请求，逐段产出文本"""
+        if self.router:
+            # 多后端: 路由 + 对冲
+            async with contextlib.aclosing(self.router.stream(full_messages, temperature, max_tokens)) as stream:
+                async for text in stream:
+                    yield text
+            return
+        
+        # 流式请求
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=full_messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        
+        # 返回文本流；调用方提前关闭 (如用户打断) 时关闭 HTTP 流，后端停止生成
+        try:
+            async for chunk in stream:
+                if chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
     
     async def chat(
         self,
@@ -160,6 +418,7 @@ Your job is to take accurate pickup orders quickly, confirm details, and avoid m
         """非流式对话"""
         if self.client is None:
             await self.initialize()
+        self._last_used = time.monotonic()
         
         try:
             full_messages = [
@@ -183,8 +442,9 @@ Your job is to take accurate pickup orders quickly, confirm details, and avoid m
 # 💬 使用示例
 # ============================================
 """
-# 初始化
+# 初始化 (启动时调用: 建立连接池、预热模型)
 llm = LLMService()
+await llm.initialize()
 
 # 流式对话
 messages = [
@@ -197,4 +457,7 @@ async for token in llm.chat_stream(messages):
 # 非流式
 response = await llm.chat(messages)
 print(response)
+
+# 关闭
+await llm.close()
 """
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+投机式 LLM 生成
+ASR 中间结果稳定一段时间 (通常是用户说完后的尾部静音) 后，先用它开始生成并暂存输出；
+最终结果与之归一化后一致时直接接管已生成的 token，否则取消重来。
+LLM 的首 token 延迟大部分被尾部静音掩盖。
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from services.admission import StageLimiter
+from services.conversation_history import ConversationHistory
+from services.llm_cache import normalize_text
+
+_END = object()
+
+
+class SpeculationMetrics:
+    """所有会话共享的投机生成统计"""
+
+    def __init__(self):
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted_tokens = 0
+        self.head_start_ms = 0.0  # 命中时投机生成领先最终结果的时间 (累计)
+
+    def stats(self) -> Dict:
+        decided = self.hits + self.misses
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / decided if decided else 0.0,
+            "wasted_tokens": self.wasted_tokens,
+            "avg_head_start_ms": round(self.head_start_ms / self.hits, 1) if self.hits else 0.0,
+        }
+
+
+class SpeculativeTurn:
+    """单个会话的投机生成状态
+
+    - observe(): 每收到一块音频调用一次；中间结果持续 LLM_SPECULATIVE_STABLE_MS 未变化时开始生成
+    - claim(): 最终结果到达时调用；命中返回 token 流 (先输出暂存的 token，再接续实时生成)，
+      未命中返回 None 并取消投机生成。token 流关闭时 (即使尚未开始读取) 取消生成，
+      调用方须在本轮结束时关闭它
+    - 中间结果在生成期间变化，或对话历史有新消息时，投机生成作废
+    - 设置了 limiter 时投机生成占用一个 LLM 名额 (命中后随生成一起交给本轮回复)，
+      LLM 阶段已满时不投机
+    """
+
+    def __init__(
+        self,
+        chat_stream: Callable[[List[Dict[str, str]]], AsyncIterator[str]],
+        metrics: SpeculationMetrics,
+        limiter: Optional[StageLimiter] = None,
+    ):
+        self.chat_stream = chat_stream
+        self.metrics = metrics
+        self.limiter = limiter
+        self.stable_ms = float(os.getenv("LLM_SPECULATIVE_STABLE_MS", "300"))
+        self.min_chars = int(os.getenv("LLM_SPECULATIVE_MIN_CHARS", "4"))
+
+        self._partial = ""
+        self._changed_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._text = ""           # 投机生成所用文本 (归一化)
+        self._version = -1        # 开始时的对话历史版本
+        self._started_at = 0.0
+        self._generated = 0
+        self._claimed: Optional["ClaimedStream"] = None  # 最近认领的 token 流
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None
+
+    def observe(self, partial: str, history: ConversationHistory):
+        """更新中间结果；稳定足够久时开始投机生成"""
+        if not partial:
+            return  # 语句已结束 (由 claim 处理) 或尚未开始
+        now = time.monotonic()
+        if partial != self._partial:
+            self._partial = partial
+            self._changed_at = now
+            if self.active and normalize_text(partial, strip_punctuation=True) != self._text:
+                self._discard()
+            return
+
+        if self.active or (now - self._changed_at) * 1000 < self.stable_ms:
+            return
+        if self.limiter is not None and self.limiter.saturated:
+            return
+        text = normalize_text(partial, strip_punctuation=True)
+        if len(text) < self.min_chars:
+            return
+        self._start(partial, text, history)
+
+    def claim(self, final_text: str, history: ConversationHistory) -> Optional["ClaimedStream"]:
+        """最终结果到达 (追加进历史之前调用)"""
+        self._partial = ""
+        self._release_claimed()
+        if not self.active:
+            return None
+        if normalize_text(final_text, strip_punctuation=True) != self._text or history.version != self._version:
+            self._discard()
+            return None
+
+        self.metrics.hits += 1
+        self.metrics.head_start_ms += (time.monotonic() - self._started_at) * 1000
+        self._claimed = ClaimedStream(self._task, self._queue)
+        self._task = self._queue = None
+        return self._claimed
+
+    def cancel(self):
+        """丢弃进行中的投机生成 (新的文本输入、清空对话、断开连接)，包括已认领但未开始读取的"""
+        self._partial = ""
+        self._release_claimed()
+        if self.active:
+            self._discard()
+
+    def _release_claimed(self):
+        # 已开始读取的 token 流由读取方负责关闭
+        if self._claimed is not None and not self._claimed.started:
+            self._claimed.close()
+        self._claimed = None
+
+    def _start(self, partial: str, text: str, history: ConversationHistory):
+        messages = history.messages() + [{"role": "user", "content": partial}]
+        self._text = text
+        self._version = history.version
+        self._started_at = time.monotonic()
+        self._generated = 0
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(messages, self._queue))
+        self.metrics.started += 1
+        logger.debug(f"Speculative LLM generation started: {partial[:40]}")
+
+    async def _run(self, messages: List[Dict[str, str]], queue: asyncio.Queue):
+        try:
+            slot = self.limiter.slot() if self.limiter is not None else contextlib.nullcontext()
+            async with slot, contextlib.aclosing(self.chat_stream(messages)) as stream:
+                async for chunk in stream:
+                    self._generated += 1
+                    queue.put_nowait(chunk)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_END)
+
+    def _discard(self):
+        self._task.cancel()
+        self.metrics.misses += 1
+        self.metrics.wasted_tokens += self._generated
+        self._task = self._queue = None
+
+
+class ClaimedStream:
+    """已认领的投机生成 token 流: 先输出暂存的 token，再接续实时生成
+
+    关闭 (aclose/close) 时取消生成任务；与生成器不同，尚未开始迭代时关闭同样生效
+    """
+
+    def __init__(self, task: asyncio.Task, queue: asyncio.Queue):
+        self._task = task
+        self._queue = queue
+        self.started = False
+        self._closed = False
+
+    def __aiter__(self) -> "ClaimedStream":
+        return self
+
+    async def __anext__(self) -> str:
+        self.started = True
+        if self._closed:
+            raise StopAsyncIteration
+        item = await self._queue.get()
+        if item is _END:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            self.close()
+            raise item
+        return item
+
+    def close(self):
+        self._closed = True
+        self._task.cancel()
+
+    async def aclose(self):
+        self.close()
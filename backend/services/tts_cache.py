@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+TTS 句级音频缓存
+按 (归一化文本, 音色, 语速, 模型) 内容寻址，内存 LRU + 可选磁盘 PCM 两级，
+并发请求同一未缓存句子时只合成一次 (singleflight)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from loguru import logger
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+class TTSCache:
+    """TTS 音频缓存
+
+    - 内存层: OrderedDict 实现的 LRU，按字节数上限淘汰
+    - 磁盘层: TTS_CACHE_DIR 下的原始 PCM 文件 (可选，不自动清理)
+    - 同一 key 的并发未命中共享同一个合成任务；发起方被取消时
+      合成任务继续执行并写入缓存，其它等待方不受影响；
+      所有等待方都取消 (如用户打断) 时停止合成，释放算力
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, disk_dir: Optional[str] = None):
+        self.max_bytes = (
+            max_bytes if max_bytes is not None
+            else int(float(os.getenv("TTS_CACHE_MB", "64")) * 1024 * 1024)
+        )
+        self.disk_dir = disk_dir or os.getenv("TTS_CACHE_DIR") or None
+
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+
+        # 统计
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.abandoned = 0
+
+    @staticmethod
+    def make_key(text: str, voice: str, speed: float, model: str) -> str:
+        """缓存 key: 归一化文本 (NFKC、合并空白、忽略大小写) + 合成参数的 sha256"""
+        normalized = _SPACE_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip().casefold()
+        raw = json.dumps([normalized, voice, round(float(speed), 3), model], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get_or_synthesize(
+        self,
+        key: str,
+        synthesize: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        """命中直接返回 PCM；未命中时合成 (同 key 并发请求共享一次合成)"""
+        audio = self._get_memory(key)
+        if audio is not None:
+            self.memory_hits += 1
+            return audio
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.create_task(self._load(key, synthesize))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[key] -= 1
+            if self._waiters[key] == 0:
+                del self._waiters[key]
+                if not task.done():
+                    task.cancel()
+                    self.abandoned += 1
+
+    async def _load(self, key: str, synthesize: Callable[[], Awaitable[bytes]]) -> bytes:
+        audio = await asyncio.to_thread(self._read_disk, key) if self.disk_dir else None
+        if audio is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            audio = await synthesize()
+            if self.disk_dir:
+                await asyncio.to_thread(self._write_disk, key, audio)
+
+        self._put_memory(key, audio)
+        return audio
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        # 所有等待方都已取消时，异常也要被取出，避免 "never retrieved" 警告
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"TTS cache load failed for {key[:12]}: {task.exception()}")
+
+    def _get_memory(self, key: str) -> Optional[bytes]:
+        audio = self._entries.get(key)
+        if audio is not None:
+            self._entries.move_to_end(key)
+        return audio
+
+    def _put_memory(self, key: str, audio: bytes):
+        if len(audio) > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = audio
+        self._bytes += len(audio)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.pcm")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError as e:
+            logger.warning(f"TTS cache read failed {path}: {e}")
+            return None
+
+    def _write_disk(self, key: str, audio: bytes):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"TTS cache write failed {path}: {e}")
+
+    def stats(self) -> Dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "evictions": self.evictions,
+            "hit_ratio": (lookups - self.misses) / lookups if lookups else 0.0,
+            "inflight": len(self._inflight),
+            "disk_dir": self.disk_dir,
+        }
@@ -6,13 +6,20 @@ TTS 服务 - 基于 CosyVoice (阿里开源)
 
 import asyncio
 import os
-from typing import AsyncGenerator
+import wave
+from typing import AsyncGenerator, AsyncIterable, AsyncIterator, Callable, Iterator, List, Optional
 import numpy as np
 from loguru import logger
 
+from services.admission import Overloaded, StageLimiter
+from services.tts_worker_pool import TTSWorkerPool
+from services.tts_cache import TTSCache
+from services.tts_templates import TTSTemplateLibrary
+from utils.model_manifest import ModelManifest
+from utils.text_segmenter import TextSegmenter
+
 try:
     import torch
-    import torchaudio
 except ImportError:
     logger.warning("PyTorch not installed, TTS service will not work")
     torch = None
@@ -29,9 +36,30 @@ class TTSService:
         )
         self.use_cpu = os.getenv("USE_CPU", "0") == "1"
         self.sample_rate = 24000  # CosyVoice 输出 24kHz
+        self.manifest = ModelManifest()
         
         # 流式生成配置
         self.chunk_size = 1024  # 每个音频块的样本数
+        # 使用模型的流式推理 (逐帧输出)，首块延迟取决于模型首帧而非整句
+        self.model_stream = os.getenv("TTS_MODEL_STREAM", "1") == "1"
+        # 流水线预合成深度: 播放第 N 句时最多提前合成好的句子数 (0 为逐句串行)
+        self.lookahead = int(os.getenv("TTS_LOOKAHEAD", "2"))
+        
+        # 句级音频缓存 (TTS_CACHE=0 关闭)
+        self.cache = TTSCache() if os.getenv("TTS_CACHE", "1") == "1" else None
+        
+        # 跨会话共用的合成线程池 (load_model 时启动，TTS_WORKERS 未设置时与默认线程池同大小)
+        self.active_streams = 0  # 正在合成的音频流数
+        workers = os.getenv("TTS_WORKERS")
+        self.pool = TTSWorkerPool(self._iter_pcm, workers=int(workers) if workers else None)
+        # TTS 阶段准入控制 (由 server 设置): 每次实际合成占用一个名额，命中缓存不占用
+        self.limiter: Optional[StageLimiter] = None
+        
+        # 模板话术: 固定片段启动时预合成，运行时只合成槽位 (TTS_TEMPLATES=0 关闭)
+        self.templates = (
+            TTSTemplateLibrary(self._synthesize_text, sample_rate=self.sample_rate)
+            if os.getenv("TTS_TEMPLATES", "1") == "1" else None
+        )
         
     async def load_model(self):
         """加载 TTS 模型"""
@@ -58,11 +86,12 @@ class TTSService:
                 logger.warning("CUDA not available, falling back to CPU")
                 device = "cpu"
             
-            # 加载模型
-            model_dir = f"pretrained_models/{self.model_name}"
+            # 加载模型 (清单 → MODEL_DIR → pretrained_models)
+            model_dir = await asyncio.to_thread(self.resolve_model_dir)
             
             # 如果模型不存在，提供下载提示
-            if not os.path.exists(model_dir):
+            if model_dir is None:
+                model_dir = f"pretrained_models/{self.model_name}"
                 logger.warning(
                     f"Model not found at {model_dir}\n"
                     "Please download the model:\n"
@@ -74,12 +103,38 @@ class TTSService:
             self.model = CosyVoice(model_dir)
             self.device = device
             
+            await self.pool.start()
+            
+            if self.templates:
+                try:
+                    await self.templates.prerender()
+                except Exception as e:
+                    logger.warning(f"Template pre-rendering failed, templates disabled: {e}")
+                    self.templates = None
+            
             logger.success(f"✅ TTS model loaded on {device}")
             
         except Exception as e:
             logger.error(f"Failed to load TTS model: {e}")
             raise
     
+    def resolve_model_dir(self):
+        """解析本地模型目录，首次发现时登记到清单；找不到返回 None"""
+        model_dir = self.manifest.resolve(self.model_name)
+        if model_dir:
+            logger.info(f"Using cached model from manifest: {model_dir}")
+            return model_dir
+        
+        for candidate in (
+            os.path.join(self.manifest.cache_dir, self.model_name),
+            os.path.join("pretrained_models", self.model_name),
+        ):
+            if os.path.isdir(candidate):
+                self.manifest.register(self.model_name, candidate)
+                return os.path.abspath(candidate)
+        
+        return None
+    
     async def synthesize_stream(
         self, 
         text: str,
@@ -103,69 +158,255 @@ class TTSService:
         try:
             logger.info(f"Synthesizing: {text[:50]}...")
             
-            # 文本分段 (按句子)
-            sentences = self._split_text(text)
+            # 文本分段 (首段短、后续接近目标长度)
+            sentences = TextSegmenter().segment(text)
             
-            for sentence in sentences:
-                if not sentence.strip():
-                    continue
-                
-                # 合成音频 (在线程池中运行)
-                audio_chunks = await asyncio.to_thread(
-                    self._synthesize_sentence,
-                    sentence,
-                    voice,
-                    speed
-                )
-                
+            async for chunk in self._iter_sentence_audio(_aiter(sentences), voice, speed):
                 # 流式返回音频块
-                for chunk in audio_chunks:
-                    yield chunk
+                yield chunk
                     
         except Exception as e:
             logger.error(f"TTS synthesis error: {e}")
             raise
     
-    def _split_text(self, text: str) -> list:
-        """文本分句"""
-        # 简单分句策略
-        separators = ["。", "！", "？", ".", "!", "?", "\n"]
+    async def synthesize_text_stream(
+        self,
+        text_stream: AsyncIterator[str],
+        voice: str = "中文女",
+        speed: float = 1.0,
+        on_sentence: Optional[Callable[[str], None]] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        增量语音合成: 边接收文本 (如 LLM token 流) 边合成
+        
+        后台任务持续读取 text_stream 并增量分段，
+        首段 (短分句) 完整即开始合成，不必等待全部文本。
+        调用方停止迭代时停止读取并关闭 text_stream (如 LLM 流)，丢弃排队中的句子。
+        on_sentence(text) 在每句的第一块音频产出之前调用，用于对应音频与文本。
+        
+        Yields:
+            音频数据块 (PCM 24kHz mono)
+        """
+        if self.model is None:
+            raise RuntimeError("TTS model not loaded")
         
-        sentences = []
-        current = ""
+        sentence_queue: asyncio.Queue = asyncio.Queue()
         
-        for char in text:
-            current += char
-            if char in separators:
-                sentences.append(current.strip())
-                current = ""
+        async def read_text():
+            segmenter = TextSegmenter()
+            try:
+                async for delta in text_stream:
+                    for sentence in segmenter.feed(delta):
+                        sentence_queue.put_nowait(sentence)
+                for sentence in segmenter.flush():
+                    sentence_queue.put_nowait(sentence)
+                sentence_queue.put_nowait(None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                sentence_queue.put_nowait(e)
+            finally:
+                # 上游生成器 (LLM 流) 随之关闭，不再继续生成
+                if hasattr(text_stream, "aclose"):
+                    await text_stream.aclose()
         
-        if current.strip():
-            sentences.append(current.strip())
+        async def sentences():
+            while True:
+                item = await sentence_queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
         
-        return sentences
+        reader = asyncio.create_task(read_text())
+        try:
+            async for chunk in self._iter_sentence_audio(sentences(), voice, speed, on_sentence):
+                yield chunk
+        except Exception as e:
+            logger.error(f"TTS synthesis error: {e}")
+            raise
+        finally:
+            reader.cancel()
     
-    def _synthesize_sentence(
+    async def _iter_sentence_audio(
         self,
-        text: str,
+        sentences: AsyncIterable[str],
         voice: str,
-        speed: float
-    ) -> list:
-        """合成单个句子 (同步方法)"""
+        speed: float,
+        on_sentence: Optional[Callable[[str], None]] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """按句子顺序产出音频块
+        
+        后台任务按顺序逐句合成，每句对应一个块队列，模型每产出一帧
+        即放入该句的队列，调用方无需等整句合成完。句队列放入容量为
+        lookahead 的队列：调用方输出第 N 句时，第 N+1..N+lookahead 句
+        已在合成 (lookahead=0 时等本句输出完再合成下一句)。
+        调用方停止迭代时取消后台任务，不再合成后续句子。
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(self.lookahead, 1))
+        self.active_streams += 1
+        
+        async def produce():
+            chunks = None
+            try:
+                async for sentence in sentences:
+                    chunks = asyncio.Queue()
+                    await queue.put((sentence, chunks))
+                    await self._segment_audio(sentence, voice, speed, chunks.put_nowait)
+                    chunks.put_nowait(None)
+                    if self.lookahead <= 0:
+                        await chunks.join()
+                    chunks = None
+                await queue.put(None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if chunks is not None:
+                    chunks.put_nowait(e)
+                else:
+                    await queue.put(e)
+        
+        producer = asyncio.create_task(produce())
         try:
-            # CosyVoice 推理
-            # 注意: 实际 API 可能不同，需根据 CosyVoice 文档调整
-            output = self.model.inference_sft(
-                text=text,
-                spk_id=voice,
-                speed=speed,
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                sentence, chunks = item
+                if on_sentence:
+                    on_sentence(sentence)
+                while True:
+                    chunk = await chunks.get()
+                    chunks.task_done()
+                    if chunk is None:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    yield chunk
+        finally:
+            producer.cancel()
+            self.active_streams -= 1
+    
+    async def _segment_audio(
+        self,
+        segment: str,
+        voice: str,
+        speed: float,
+        emit: Callable[[bytes], None]
+    ):
+        """合成一个文本分段: 命中模板的部分用预合成音频拼接，其余正常合成"""
+        match = self.templates.match(segment, voice, speed) if self.templates else None
+        if match is None:
+            await self._sentence_audio(segment, voice, speed, emit)
+            return
+        
+        if match.prefix:
+            await self._sentence_audio(match.prefix, voice, speed, emit)
+        try:
+            await self.templates.render(
+                match.name,
+                match.slots,
+                lambda pcm: [emit(chunk) for chunk in self._split_chunks(pcm)],
             )
+        except Exception as e:
+            logger.error(f"Template {match.name} render error: {e}")
+            emit(self._silence_chunk())
+        if match.suffix:
+            await self._segment_audio(match.suffix, voice, speed, emit)
+    
+    async def _sentence_audio(
+        self,
+        sentence: str,
+        voice: str,
+        speed: float,
+        emit: Callable[[bytes], None]
+    ):
+        """合成单句，音频按 chunk_size 分块后逐块交给 emit
+        
+        优先查缓存；未命中时边合成边输出，合成完成后写入缓存。
+        合成失败时输出一块静音。
+        """
+        def emit_pcm(pcm: bytes):
+            for chunk in self._split_chunks(pcm):
+                emit(chunk)
+        
+        try:
+            if self.cache is None:
+                await self._submit(sentence, voice, speed, emit_pcm, collect=False)
+                return
+            
+            # 本次调用发起合成时音频已逐帧输出；命中缓存或合并到
+            # 其它请求的合成时拿到的是整句音频
+            streamed = False
             
+            def synthesize():
+                nonlocal streamed
+                streamed = True
+                return self._submit(sentence, voice, speed, emit_pcm)
+            
+            key = TTSCache.make_key(sentence, voice, speed, self.model_name)
+            audio = await self.cache.get_or_synthesize(key, synthesize)
+            if not streamed:
+                emit_pcm(audio)
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error(f"Sentence synthesis error: {e}")
+            emit(self._silence_chunk())
+    
+    async def _synthesize_text(self, text: str, voice: str, speed: float) -> bytes:
+        """整段合成为 PCM (经缓存与批处理，不做分段)，失败时抛出异常"""
+        def synthesize():
+            return self._submit(text, voice, speed, lambda pcm: None)
+        
+        if self.cache is None:
+            return await synthesize()
+        key = TTSCache.make_key(text, voice, speed, self.model_name)
+        return await self.cache.get_or_synthesize(key, synthesize)
+    
+    async def _submit(
+        self,
+        text: str,
+        voice: str,
+        speed: float,
+        on_pcm: Callable[[bytes], None],
+        collect: bool = True
+    ) -> bytes:
+        """提交到合成线程池；设置了 limiter 时合成期间占用一个 TTS 名额 (过载时抛出 Overloaded)"""
+        if self.limiter is None:
+            return await self.pool.submit(text, voice, speed, on_pcm, collect)
+        async with self.limiter.slot():
+            return await self.pool.submit(text, voice, speed, on_pcm, collect)
+    
+    def _iter_pcm(
+        self,
+        text: str,
+        voice: str,
+        speed: float
+    ) -> Iterator[bytes]:
+        """逐帧合成 int16 PCM (同步生成器，在工作线程中迭代，失败时抛出异常)"""
+        # CosyVoice 推理: stream=True 时返回逐帧生成器
+        # 注意: 实际 API 可能不同，需根据 CosyVoice 文档调整
+        output = self.model.inference_sft(
+            text,
+            voice,
+            stream=self.model_stream,
+            speed=speed,
+        )
+        
+        # 兼容一次性返回整句的实现
+        if isinstance(output, dict) or hasattr(output, "cpu"):
+            output = [output]
+        
+        for frame in output:
             # 提取音频数据
-            if isinstance(output, dict) and "tts_speech" in output:
-                audio_tensor = output["tts_speech"]
+            if isinstance(frame, dict) and "tts_speech" in frame:
+                audio_tensor = frame["tts_speech"]
             else:
-                audio_tensor = output
+                audio_tensor = frame
             
             # 转换为 numpy
             audio_np = audio_tensor.cpu().numpy()
@@ -175,20 +416,24 @@ class TTSService:
                 audio_np = audio_np.mean(axis=0)
             
             # 转换为 int16 PCM
-            audio_int16 = (audio_np * 32767).astype(np.int16)
-            
-            # 分块
-            chunks = []
-            for i in range(0, len(audio_int16), self.chunk_size):
-                chunk = audio_int16[i:i + self.chunk_size]
-                chunks.append(chunk.tobytes())
-            
-            return chunks
-            
-        except Exception as e:
-            logger.error(f"Sentence synthesis error: {e}")
-            # 返回空音频块
-            return [b'\x00' * self.chunk_size * 2]
+            yield (audio_np * 32767).astype(np.int16).tobytes()
+    
+    def _split_chunks(self, audio: bytes) -> list:
+        """按 chunk_size 个样本分块"""
+        step = self.chunk_size * 2
+        return [audio[i:i + step] for i in range(0, len(audio), step)]
+    
+    def _silence_chunk(self) -> bytes:
+        return b'\x00' * self.chunk_size * 2
+    
+    def stats(self) -> dict:
+        """运行时统计"""
+        return {
+            "active_streams": self.active_streams,
+            "workers": self.pool.stats(),
+            "cache": self.cache.stats() if self.cache else None,
+            "templates": self.templates.stats() if self.templates else None,
+        }
     
     async def synthesize_to_file(
         self,
@@ -196,29 +441,19 @@ class TTSService:
         output_file: str,
         voice: str = "中文女"
     ):
-        """合成音频文件 (非流式)"""
+        """合成音频文件 (边合成边写入 WAV，不在内存中拼接整段音频)"""
         if self.model is None:
             raise RuntimeError("TTS model not loaded")
         
         try:
-            # 收集所有音频块
-            audio_chunks = []
-            async for chunk in self.synthesize_stream(text, voice):
-                audio_chunks.append(chunk)
-            
-            # 合并音频
-            audio_bytes = b''.join(audio_chunks)
-            audio_np = np.frombuffer(audio_bytes, dtype=np.int16)
-            
-            # 保存为 WAV
-            audio_float = audio_np.astype(np.float32) / 32768.0
-            audio_tensor = torch.from_numpy(audio_float).unsqueeze(0)
-            
-            torchaudio.save(
-                output_file,
-                audio_tensor,
-                self.sample_rate
-            )
+            with wave.open(output_file, "wb") as wav_file:
+                wav_file.setnchannels(1)
+                wav_file.setsampwidth(2)  # int16
+                wav_file.setframerate(self.sample_rate)
+                
+                async for chunk in self.synthesize_stream(text, voice):
+                    wav_file.writeframesraw(chunk)
+            # 关闭时 wave 模块回填 RIFF/data 长度
             
             logger.success(f"Audio saved to {output_file}")
             
@@ -228,6 +463,8 @@ class TTSService:
     
     async def cleanup(self):
         """清理资源"""
+        await self.pool.stop()
+        
         if self.model:
             del self.model
             self.model = None
@@ -238,6 +475,11 @@ class TTSService:
         logger.info("TTS service cleaned up")
 
 
+async def _aiter(items: List[str]) -> AsyncGenerator[str, None]:
+    for item in items:
+        yield item
+
+
 # ============================================
 # 🎙️ 使用示例
 # ============================================
@@ -251,6 +493,10 @@ async for audio_chunk in tts.synthesize_stream("你好，世界！"):
     # 发送音频块给客户端
     await websocket.send_bytes(audio_chunk)
 
+# 增量合成 (边生成文本边合成)
+async for audio_chunk in tts.synthesize_text_stream(llm.chat_stream(messages)):
+    await websocket.send_bytes(audio_chunk)
+
 # 文件合成
 await tts.synthesize_to_file("测试文本", "output.wav")
 """
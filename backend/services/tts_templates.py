@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+TTS 模板音频
+固定话术在启动时预合成为 PCM，运行时只合成变量槽位 (姓名、数字、菜品)，
+再与预合成片段交叉淡化拼接。确认类回复几乎不占 TTS 算力，并且可以立即开始播放。
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from utils.audio_splice import Crossfader, trim_silence
+
+# 与 LLMService.system_prompt 中的点餐流程对应的默认模板
+# 模板在 TTS 文本分段内匹配，每个模板应为一句完整的话
+DEFAULT_TEMPLATES = {
+    "greeting": "Kia ora, welcome to Chunky Chook!",
+    "ask_order": "What can I get for you today?",
+    "anything_else": "Would you like anything else with that?",
+    "ask_name_phone": "Can I get a name and phone number for the pickup?",
+    "order_ready": "Your order will be ready in about {minutes} minutes.",
+    "thanks_items": "Thanks {name}, that's {items}.",
+    "pickup": "Thanks {name}, your order will be ready for pickup in about {minutes} minutes.",
+}
+
+_SLOT_RE = re.compile(r"\{(\w+)\}")
+_SPEAKABLE_RE = re.compile(r"\w")
+_END_PUNCT = ".!?。！？"
+
+
+@dataclass
+class _Template:
+    name: str
+    text: str
+    parts: List[Tuple[str, bool]]  # (固定文本 或 槽位名, 是否槽位)
+    pattern: "re.Pattern"
+
+
+@dataclass
+class TemplateMatch:
+    """文本中命中的模板"""
+    name: str
+    slots: Dict[str, str]
+    prefix: str  # 模板之前的文本 (正常合成)
+    suffix: str  # 模板之后的文本
+
+
+class TTSTemplateLibrary:
+    """模板话术库
+
+    synthesize(text, voice, speed) 返回整句 int16 PCM，用于预合成固定片段和运行时合成槽位。
+    预合成只针对 voice (TTS_TEMPLATE_VOICE) 与语速 1.0，其它音色/语速不使用模板。
+    """
+
+    def __init__(
+        self,
+        synthesize: Callable[[str, str, float], Awaitable[bytes]],
+        templates: Optional[Dict[str, str]] = None,
+        sample_rate: int = 24000,
+    ):
+        self.synthesize = synthesize
+        self.voice = os.getenv("TTS_TEMPLATE_VOICE", "中文女")
+        self.sample_rate = sample_rate
+        self.fade_samples = int(float(os.getenv("TTS_CROSSFADE_MS", "15")) * sample_rate / 1000)
+
+        if templates is None:
+            templates = self._load_templates()
+        self._templates = {name: self._compile(name, text) for name, text in templates.items()}
+        self._fixed: Dict[str, np.ndarray] = {}  # 固定片段文本 → 预合成 PCM
+        self.ready = False
+
+        # 统计
+        self.hits = 0
+        self.fixed_ms_served = 0.0
+        self.slot_ms_synthesized = 0.0
+        self.prerender_seconds = 0.0
+
+    def _load_templates(self) -> Dict[str, str]:
+        path = os.getenv("TTS_TEMPLATES_FILE")
+        if not path:
+            return dict(DEFAULT_TEMPLATES)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _compile(name: str, text: str) -> _Template:
+        parts: List[Tuple[str, bool]] = []
+        regex = ""
+        pos = 0
+        seen = set()
+        for match in _SLOT_RE.finditer(text):
+            if match.start() > pos:
+                parts.append((text[pos:match.start()], False))
+                regex += _fixed_regex(text[pos:match.start()])
+            slot = match.group(1)
+            parts.append((slot, True))
+            if slot in seen:
+                regex += f"(?P={slot})"
+            else:
+                # 槽位不跨句，但允许 "12.50" 这样的小数点
+                regex += rf"(?P<{slot}>(?:[^{_END_PUNCT}]|\.(?=\d)){{1,80}}?)"
+                seen.add(slot)
+            pos = match.end()
+        if pos < len(text):
+            parts.append((text[pos:], False))
+            regex += _fixed_regex(text[pos:].rstrip(_END_PUNCT))
+        # 模板须是完整的句子: 从文本开头或上一句的句末标点之后开始，到句末标点或文本结尾结束
+        regex = rf"(?:^|(?<=[{_END_PUNCT}]))\s*" + regex + rf"(?:[{_END_PUNCT}](?!\d)|\s*$)"
+        return _Template(name, text, parts, re.compile(regex, re.IGNORECASE))
+
+    async def prerender(self):
+        """预合成所有固定片段 (启动时调用一次)"""
+        started = time.monotonic()
+        texts = {
+            _speakable(text)
+            for template in self._templates.values()
+            for text, is_slot in template.parts
+            if not is_slot and _speakable(text)
+        }
+        for text in sorted(texts):
+            pcm = await self.synthesize(text, self.voice, 1.0)
+            self._fixed[text] = trim_silence(np.frombuffer(pcm, dtype=np.int16))
+
+        self.prerender_seconds = time.monotonic() - started
+        self.ready = True
+        total_ms = sum(piece.size for piece in self._fixed.values()) * 1000 / self.sample_rate
+        logger.info(
+            f"Pre-rendered {len(self._fixed)} template phrases for {len(self._templates)} templates "
+            f"({total_ms / 1000:.1f}s audio in {self.prerender_seconds:.1f}s)"
+        )
+
+    def match(self, text: str, voice: str, speed: float) -> Optional[TemplateMatch]:
+        """在文本中查找第一个命中的模板 (需与预合成的音色/语速一致)"""
+        if not self.ready or voice != self.voice or abs(speed - 1.0) > 1e-3:
+            return None
+
+        best = None
+        for template in self._templates.values():
+            found = template.pattern.search(text)
+            if found and (best is None or found.start() < best[1].start()):
+                best = (template, found)
+        if best is None:
+            return None
+
+        template, found = best
+        slots = {name: value.strip() for name, value in found.groupdict().items()}
+        if not all(slots.values()):
+            return None
+        return TemplateMatch(
+            name=template.name,
+            slots=slots,
+            prefix=text[:found.start()].strip(),
+            suffix=text[found.end():].strip(),
+        )
+
+    async def render(self, name: str, slots: Dict[str, str], emit: Callable[[bytes], None]):
+        """按模板输出音频: 固定片段立即输出，槽位并发合成后按顺序交叉淡化拼接"""
+        template = self._templates[name]
+        self.hits += 1
+
+        # 所有槽位同时提交 (经批处理调度器合并)，第一个固定片段无需等待
+        slot_tasks = {
+            slot: asyncio.create_task(self._render_slot(slots[slot]))
+            for slot in {text for text, is_slot in template.parts if is_slot}
+        }
+        fader = Crossfader(self.fade_samples)
+        try:
+            for text, is_slot in template.parts:
+                if is_slot:
+                    piece = await slot_tasks[text]
+                else:
+                    piece = self._fixed.get(_speakable(text))
+                    if piece is None:
+                        continue
+                    self.fixed_ms_served += piece.size * 1000 / self.sample_rate
+                pcm = fader.add(piece)
+                if pcm:
+                    emit(pcm)
+            pcm = fader.flush()
+            if pcm:
+                emit(pcm)
+        finally:
+            for task in slot_tasks.values():
+                task.cancel()
+
+    async def _render_slot(self, text: str) -> np.ndarray:
+        pcm = await self.synthesize(text, self.voice, 1.0)
+        piece = trim_silence(np.frombuffer(pcm, dtype=np.int16))
+        self.slot_ms_synthesized += piece.size * 1000 / self.sample_rate
+        return piece
+
+    def stats(self) -> Dict:
+        served = self.fixed_ms_served + self.slot_ms_synthesized
+        return {
+            "templates": len(self._templates),
+            "fixed_phrases": len(self._fixed),
+            "ready": self.ready,
+            "voice": self.voice,
+            "hits": self.hits,
+            "fixed_ms_served": round(self.fixed_ms_served, 1),
+            "slot_ms_synthesized": round(self.slot_ms_synthesized, 1),
+            # 模板回复中需要实时合成的音频占比
+            "synthesized_fraction": self.slot_ms_synthesized / served if served else 0.0,
+            "prerender_seconds": round(self.prerender_seconds, 2),
+        }
+
+
+def _fixed_regex(text: str) -> str:
+    """固定文本 → 正则: 空白可变，标点前后允许空白"""
+    words = text.split()
+    regex = r"\s+".join(re.escape(word) for word in words)
+    if text[:1].isspace():
+        regex = r"\s*" + regex
+    if text[-1:].isspace():
+        regex += r"\s*"
+    return regex
+
+
+def _speakable(text: str) -> str:
+    """固定片段中需要朗读的部分 (去掉两端的空白与标点)；纯标点返回空字符串"""
+    text = text.strip(" \t\n,，、;；:：" + _END_PUNCT)
+    return text if _SPEAKABLE_RE.search(text) else ""
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+TTS 工作线程池
+所有会话的句子合成共用一个有界线程池: 每句在自己的线程中逐帧合成并立即回调，
+超出线程数的句子排队，队列深度与排队延迟可观测
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, Optional
+
+from loguru import logger
+
+
+def default_workers() -> int:
+    """与 asyncio 默认线程池相同的线程数"""
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class TTSWorkerPool:
+    """有界 TTS 工作线程池
+
+    CosyVoice 没有批量推理接口，这里不做批处理: 每句占用一个线程，
+    make_frames(text, voice, speed) 返回的逐帧生成器在该线程中迭代，
+    每帧产出后立即回调 on_pcm。与直接使用默认线程池相比:
+    - 线程数由 TTS_WORKERS 单独限定，不与 ASR、文件 IO 等共用默认线程池
+    - 调用方取消时，工作线程在当前帧结束后停止该句；尚未开始的句子不再合成
+    - 统计排队深度、排队延迟与运行中的句子数
+    """
+
+    def __init__(
+        self,
+        make_frames: Callable[[str, str, float], Iterator[bytes]],
+        workers: Optional[int] = None,
+    ):
+        self.make_frames = make_frames
+        self.workers = max(1, workers or default_workers())
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+
+        # 统计
+        self._submitted = 0
+        self._completed = 0
+        self._cancelled = 0
+        self._started = 0
+        self._queue_wait_ms_total = 0.0
+        self._max_queue_wait_ms = 0.0
+
+    async def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tts")
+            logger.info(f"TTS worker pool started (workers={self.workers})")
+
+    async def stop(self):
+        """停止线程池: 未开始的句子取消，正在合成的句子在当前帧结束后退出"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(
+        self,
+        text: str,
+        voice: str,
+        speed: float,
+        on_pcm: Callable[[bytes], None],
+        collect: bool = True,
+    ) -> bytes:
+        """合成一个句子，合成过程中逐帧回调 on_pcm
+
+        collect=True 时返回整句 PCM，否则返回 b""。
+        调用方被取消时，工作线程在当前帧结束后停止该句的合成。
+        """
+        if self._executor is None:
+            raise RuntimeError("TTS worker pool not started")
+
+        loop = asyncio.get_running_loop()
+        stopped = threading.Event()
+        enqueued_at = time.monotonic()
+        state = {"dequeued": False}
+
+        def run() -> bytes:
+            with self._lock:
+                if state["dequeued"]:
+                    return b""  # 开始前已被取消，计数已在 submit 中处理
+                state["dequeued"] = True
+                self.queued -= 1
+                if stopped.is_set():
+                    self._cancelled += 1
+                    return b""
+                self.running += 1
+                self._started += 1
+                waited_ms = (time.monotonic() - enqueued_at) * 1000
+                self._queue_wait_ms_total += waited_ms
+                self._max_queue_wait_ms = max(self._max_queue_wait_ms, waited_ms)
+            frames = []
+            try:
+                for pcm in self.make_frames(text, voice, speed):
+                    if stopped.is_set():
+                        with self._lock:
+                            self._cancelled += 1
+                        break
+                    if collect:
+                        frames.append(pcm)
+                    try:
+                        loop.call_soon_threadsafe(on_pcm, pcm)
+                    except RuntimeError:
+                        break  # 事件循环已关闭
+                else:
+                    with self._lock:
+                        self._completed += 1
+            finally:
+                with self._lock:
+                    self.running -= 1
+            return b"".join(frames)
+
+        with self._lock:
+            self.queued += 1
+            self._submitted += 1
+        try:
+            return await loop.run_in_executor(self._executor, run)
+        finally:
+            stopped.set()
+            with self._lock:
+                if not state["dequeued"]:
+                    # 排队中被取消: 线程池可能不会再执行 run，这里结清计数
+                    state["dequeued"] = True
+                    self.queued -= 1
+                    self._cancelled += 1
+
+    def stats(self) -> Dict:
+        """排队深度、运行中的句子数与排队延迟"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "utilization": self.running / self.workers,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "cancelled": self._cancelled,
+                "avg_queue_wait_ms": round(self._queue_wait_ms_total / self._started, 1) if self._started else 0.0,
+                "max_queue_wait_ms": round(self._max_queue_wait_ms, 1),
+            }
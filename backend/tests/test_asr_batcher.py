@@ -0,0 +1,29 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from services.asr_batcher import ASRBatchScheduler
+
+
+def test_stop_resolves_in_flight_batch():
+    """推理进行中停止调度器时，批次内的 submit 不应永久挂起"""
+    release = threading.Event()
+
+    def run_batch(audio_batch, language):
+        release.wait(2)
+        return [{"text": "x"} for _ in audio_batch]
+
+    async def main():
+        batcher = ASRBatchScheduler(run_batch, max_batch_size=2, max_wait_ms=0)
+        await batcher.start()
+        pending = [asyncio.create_task(batcher.submit(np.zeros(160, dtype=np.float32))) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert batcher.stats()["in_flight"] > 0
+
+        await batcher.stop()
+        release.set()
+        results = await asyncio.wait_for(asyncio.gather(*pending, return_exceptions=True), 1)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+
+from services.asr_service import ASRStream
+
+SR = 16000
+
+
+def pcm(samples):
+    return (samples * 32767).astype(np.int16).tobytes()
+
+
+def tone(ms, freq):
+    t = np.arange(SR * ms // 1000) / SR
+    return np.sin(2 * np.pi * freq * t) * 0.5
+
+
+def silence(ms):
+    return np.zeros(SR * ms // 1000)
+
+
+def test_final_excludes_next_utterance_onset(monkeypatch):
+    """一块音频同时含上一句终点与下一句起点时，下一句不并入上一句的最终结果"""
+    monkeypatch.setenv("VAD_HANGOVER_MS", "300")
+    monkeypatch.setenv("VAD_PREROLL_MS", "100")
+
+    async def infer(window, language):
+        # 按窗口中的主频区分两句 (220Hz → "a"，440Hz → "b")
+        spectrum = np.abs(np.fft.rfft(window))
+        freqs = np.fft.rfftfreq(len(window), 1 / SR)
+        words = [w for f, w in ((220, "a"), (440, "b")) if spectrum[np.abs(freqs - f) < 5].max() > 0.1 * spectrum.max()]
+        return {"text": " ".join(words), "language": "en"}
+
+    service = SimpleNamespace(
+        sample_rate=SR, max_buffer_ms=10000, window_ms=3000, buffer_duration_ms=10000, context_ms=1000,
+        audio_ms_received=0, audio_ms_voiced=0, audio_ms_decoded=0, infer=infer,
+    )
+
+    async def main():
+        stream = ASRStream(service, "test")
+        assert await stream.accept_audio(pcm(tone(500, 220))) is None
+
+        final = await stream.accept_audio(pcm(np.concatenate([silence(400), tone(300, 440)])))
+        assert final["is_final"] and final["text"] == "a"
+        assert stream.speech_onsets == 2
+
+        final = await stream.flush()
+        assert final["text"] == "b"
+
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from services.llm_cache import LLMResponseCache
+
+
+def fake_embed(delay_s):
+    """按首字母给出方向的向量 ("hello" 与 "hello!" 视为同义)"""
+    async def embed(text):
+        await asyncio.sleep(delay_s)
+        return [1.0, 0.0] if text.startswith("h") else [0.0, 1.0]
+    return embed
+
+
+def ask(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_slow_embedding_does_not_delay_the_request(monkeypatch):
+    """向量超时未就绪时按未命中处理，写入后补上向量，之后的改写问法命中相似度层"""
+    monkeypatch.setenv("LLM_CACHE_EMBED_TIMEOUT_MS", "50")
+    monkeypatch.setenv("LLM_CACHE_SIMILARITY", "0.9")
+
+    async def main():
+        cache = LLMResponseCache(embed=fake_embed(0.3))
+
+        lookup = cache.get("sys", "m", ask("hello there"))
+        assert await cache.match_semantic(lookup) is False  # 没有可匹配的条目，不等待向量
+        cache.put(lookup, "hi!")
+
+        lookup = cache.get("sys", "m", ask("hey you"))
+        started = time.monotonic()
+        assert await cache.match_semantic(lookup) is False
+        assert time.monotonic() - started < 0.2  # 最多等待超时时间
+
+        await asyncio.sleep(0.4)  # 第一条的向量已在后台补写
+        lookup = cache.get("sys", "m", ask("howdy"))
+        await asyncio.sleep(0.35)
+        assert await cache.match_semantic(lookup) is True
+        assert lookup.response == "hi!"
+
+    asyncio.run(main())
+
+
+def test_first_token_stops_waiting_for_embedding(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_EMBED_TIMEOUT_MS", "1000")
+
+    async def main():
+        cache = LLMResponseCache(embed=fake_embed(0.01))
+        lookup = cache.get("sys", "m", ask("hello"))
+        await asyncio.sleep(0.05)
+        cache.put(lookup, "hi!")
+
+        cache.embed = fake_embed(0.5)
+        lookup = cache.get("sys", "m", ask("hi"))
+        first_token = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().call_later(0.05, first_token.set_result, "token")
+        started = time.monotonic()
+        assert await cache.match_semantic(lookup, first_token) is False
+        assert time.monotonic() - started < 0.3
+
+    asyncio.run(main())
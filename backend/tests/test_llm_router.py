@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+from services.llm_router import LLMBackend, LLMRouter
+
+
+def stub_client(ttft_s: float, token_s: float, tokens: int = 5):
+    """OpenAI 兼容客户端桩: 首 token 延迟 ttft_s，之后每 token_s 秒一个 token"""
+
+    class Stream:
+        def __init__(self):
+            self.sent = 0
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if self.sent >= tokens:
+                raise StopAsyncIteration
+            await asyncio.sleep(ttft_s if self.sent == 0 else token_s)
+            self.sent += 1
+            return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="x"))])
+
+        async def close(self):
+            pass
+
+    async def create(**kwargs):
+        return Stream()
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_backend_that_loses_hedges_stops_being_picked(monkeypatch):
+    """总是输掉对冲的慢后端没有生成速度样本，不能因此一直被优先选择"""
+    monkeypatch.setenv("LLM_HEDGE_DELAY_MS", "50")
+    monkeypatch.setenv("LLM_HEDGE_LOSER_SAMPLE_MS", "2000")
+
+    async def run():
+        slow = LLMBackend("slow", "http://slow", "m", stub_client(0.4, 0.01))
+        fast = LLMBackend("fast", "http://fast", "m", stub_client(0.01, 0.01))
+        router = LLMRouter([slow, fast])
+
+        first_picks = []
+        for _ in range(6):
+            first_picks.append(router.pick().name)
+            assert "".join([t async for t in router.stream([])]) == "xxxxx"
+            await asyncio.sleep(0.5)  # 让对冲失败方完成 TTFT 采样
+        return router, slow, fast, first_picks
+
+    router, slow, fast, first_picks = asyncio.run(run())
+
+    assert slow.ttft_ewma_ms > 300  # 记录的是真实首 token 时间，而不是对冲等待时间
+    assert router.score(slow) > router.score(fast)
+    assert first_picks[-4:] == ["fast"] * 4
+    assert router.hedged <= 2
+
+
+def test_caller_cancellation_is_not_recorded(monkeypatch):
+    """调用方取消 (用户打断) 不计入 TTFT 样本与熔断"""
+    monkeypatch.setenv("LLM_HEDGE_DELAY_MS", "0")
+
+    async def run():
+        backend = LLMBackend("a", "http://a", "m", stub_client(0.5, 0.01))
+        router = LLMRouter([backend])
+
+        async def consume():
+            async for _ in router.stream([]):
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        return backend
+
+    backend = asyncio.run(run())
+    assert list(backend.ttft_samples) == []
+    assert backend.ttft_ewma_ms is None
+    assert backend.failures == 0
@@ -0,0 +1,32 @@
+import numpy as np
+
+from utils.vad import StreamingVAD
+
+SR = 16000
+
+
+def tone(ms):
+    t = np.arange(SR * ms // 1000) / SR
+    return (np.sin(2 * np.pi * 220 * t) * 0.5).astype(np.float32)
+
+
+def silence(ms):
+    return np.zeros(SR * ms // 1000, dtype=np.float32)
+
+
+def test_next_utterance_in_same_chunk_is_not_merged():
+    """同一块中含上一句的终点与下一句的起点: 在终点处切开，下一句从预滚动开始"""
+    vad = StreamingVAD(SR, onset_ms=60, hangover_ms=300, preroll_ms=100)
+    assert vad.process(tone(500)).speech_started
+
+    # 拖尾静音确认终点后，同一块里紧接着下一句
+    result = vad.process(np.concatenate([silence(400), tone(300)]))
+    assert result.speech_ended and not result.speech_started
+    assert len(result.speech) == SR * 300 // 1000  # 只有拖尾静音，不含下一句
+    assert vad.unprocessed_samples == SR * 400 // 1000  # 终点之后的 100ms 静音 + 300ms 语音
+
+    result = vad.process(np.zeros(0, dtype=np.float32))
+    assert result.speech_started and not result.speech_ended
+    # 下一句 = 预滚动 (100ms 静音) + 300ms 语音
+    assert len(result.speech) == SR * 400 // 1000
+    assert not result.speech[:SR * 100 // 1000].any()
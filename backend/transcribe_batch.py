@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+批量离线转写命令行工具
+与 /api/asr/batch 共用 BatchTranscriber，结果以 NDJSON 输出
+
+用法:
+    python3 transcribe_batch.py recordings/ -o results.ndjson
+    python3 transcribe_batch.py a.wav b.wav
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+from loguru import logger
+
+from services.asr_service import ASRService
+from services.batch_transcriber import BatchTranscriber
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="批量转写音频文件 (输出 NDJSON)")
+    parser.add_argument("inputs", nargs="+", help="音频文件或目录")
+    parser.add_argument("-o", "--output", help="输出文件 (默认 stdout)")
+    parser.add_argument("--no-recursive", action="store_true", help="目录不递归")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+
+    asr_service = ASRService()
+    await asr_service.load_model()
+    transcriber = BatchTranscriber(asr_service)
+
+    files = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            files += transcriber.resolve_files(directory=path, recursive=not args.no_recursive)
+        else:
+            files += transcriber.resolve_files(paths=[path])
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        job = transcriber.submit(files)
+        async for line in transcriber.stream_results(job.job_id):
+            out.write(line)
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        await asr_service.cleanup()
+
+    summary = job.summary()
+    logger.info(
+        f"Transcribed {summary['files_done']}/{summary['files_total']} files, "
+        f"{summary['audio_hours']} audio hours in {summary['wall_seconds']}s "
+        f"({summary['audio_hours_per_wall_hour']} audio-hours per wall-hour)"
+    )
+    return 0 if job.status == "done" and not job.files_failed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+输出音频编码
+把 TTS 输出的 PCM (int16 mono) 流式编码为客户端协商的格式:
+- pcm16:     原始 PCM (默认)
+- wav:       PCM16 WAV，流式头 (长度字段未知)，适合 HTTP 直接播放
+- g711_ulaw: G.711 μ-law 8kHz (电话线路)
+- opus:      Opus in Ogg (需要 PyAV)
+- webm_opus: Opus in WebM (需要 PyAV，浏览器 MediaSource 可直接播放)
+"""
+
+import os
+import struct
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+try:
+    import av
+except ImportError:
+    logger.warning("PyAV not installed, Opus output will not be available")
+    av = None
+
+AUDIO_FORMATS = ("pcm16", "wav", "g711_ulaw", "opus", "webm_opus")
+DEFAULT_AUDIO_FORMAT = "pcm16"
+
+# HTTP Accept 媒体类型 → 格式名
+MEDIA_TYPES = {
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/l16": "pcm16",
+    "audio/pcm": "pcm16",
+    "audio/basic": "g711_ulaw",
+    "audio/pcmu": "g711_ulaw",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/webm": "webm_opus",
+}
+
+
+class PCMEncoder:
+    """原始 int16 PCM (直通)"""
+
+    name = "pcm16"
+
+    def __init__(self, sample_rate: int = 24000):
+        self.sample_rate = sample_rate
+        self.content_type = f"audio/L16;rate={sample_rate};channels=1"
+
+    def encode(self, pcm: bytes) -> bytes:
+        return pcm
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class WavEncoder(PCMEncoder):
+    """PCM16 WAV 流式输出: 第一块前写入 RIFF 头，长度字段填 0xFFFFFFFF (未知)"""
+
+    name = "wav"
+
+    def __init__(self, sample_rate: int = 24000):
+        super().__init__(sample_rate)
+        self.content_type = "audio/wav"
+        self._header_sent = False
+
+    def encode(self, pcm: bytes) -> bytes:
+        if self._header_sent:
+            return pcm
+        self._header_sent = True
+        return wav_header(self.sample_rate) + pcm
+
+    def flush(self) -> bytes:
+        # 没有任何音频时也输出一个合法的空 WAV
+        return self.encode(b"") if not self._header_sent else b""
+
+
+def wav_header(sample_rate: int, data_size: int = 0xFFFFFFFF, channels: int = 1) -> bytes:
+    """PCM16 WAV 文件头；data_size 未知时 RIFF/data 长度填 0xFFFFFFFF"""
+    riff_size = 0xFFFFFFFF if data_size == 0xFFFFFFFF else 36 + data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * channels * 2, channels * 2, 16,
+        b"data", data_size,
+    )
+
+
+class MulawEncoder:
+    """G.711 μ-law 8kHz
+
+    先用 FIR 低通 + 整数倍抽取流式降采样到 8kHz (滤波器状态跨块保留)，
+    再逐样本查表式编码为 8 bit μ-law。
+    """
+
+    name = "g711_ulaw"
+    content_type = "audio/basic"
+
+    def __init__(self, sample_rate: int = 24000, target_rate: int = 8000, taps: int = 63):
+        if sample_rate % target_rate:
+            raise ValueError(f"Cannot resample {sample_rate} Hz to {target_rate} Hz by decimation")
+        self.sample_rate = target_rate
+        self.factor = sample_rate // target_rate
+
+        # 加窗 sinc 低通，截止频率略低于目标奈奎斯特频率
+        cutoff = 0.45 / self.factor
+        n = np.arange(taps) - (taps - 1) / 2
+        self._taps = (2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)).astype(np.float32)
+        self._history = np.zeros(taps - 1, dtype=np.float32)
+        self._consumed = 0  # 已输入的样本数，用于保持抽取相位
+
+    def encode(self, pcm: bytes) -> bytes:
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        if samples.size == 0:
+            return b""
+
+        padded = np.concatenate([self._history, samples])
+        filtered = np.convolve(padded, self._taps, mode="valid")
+        self._history = padded[-(len(self._taps) - 1):]
+
+        start = -self._consumed % self.factor
+        self._consumed += samples.size
+        decimated = np.clip(np.rint(filtered[start::self.factor]), -32768, 32767).astype(np.int16)
+        return linear_to_ulaw(decimated).tobytes()
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def linear_to_ulaw(samples: np.ndarray) -> np.ndarray:
+    """int16 PCM → G.711 μ-law (uint8)"""
+    x = samples.astype(np.int32)
+    sign = np.where(x < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(x), 32635) + 0x84
+    # 指数: 最高有效位位置 (bit 7..14 → 0..7)
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+class _ByteSink:
+    """只写的内存输出，供 PyAV 以非 seek 的流式方式封装"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class OpusEncoder:
+    """Opus 流式编码 (Ogg 或 WebM 封装)
+
+    每次 encode 返回已完成封装的字节 (可能为空，编码器按帧缓冲)；
+    flush 结束码流并返回剩余数据。一个实例对应一个完整的码流。
+    """
+
+    def __init__(self, sample_rate: int = 24000, container: str = "ogg", bitrate: int = None):
+        if av is None:
+            raise RuntimeError("PyAV not installed. Run: pip install av")
+
+        self.name = "opus" if container == "ogg" else "webm_opus"
+        self.content_type = "audio/ogg; codecs=opus" if container == "ogg" else "audio/webm; codecs=opus"
+        self.sample_rate = sample_rate
+        self._pts = 0
+
+        self._sink = _ByteSink()
+        # 降低页/簇时长，使数据尽快输出而不是攒满再写
+        options = {"page_duration": "60000"} if container == "ogg" else {"live": "1", "cluster_time_limit": "100"}
+        self._container = av.open(self._sink, mode="w", format=container, options=options)
+        self._stream = self._container.add_stream("libopus", rate=sample_rate)
+        self._stream.layout = "mono"
+        self._stream.bit_rate = bitrate or int(os.getenv("OPUS_BITRATE", "24000"))
+
+    def encode(self, pcm: bytes) -> bytes:
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if samples.size == 0:
+            return b""
+
+        frame = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = self.sample_rate
+        frame.pts = self._pts
+        self._pts += samples.size
+
+        for packet in self._stream.encode(frame):
+            self._container.mux(packet)
+        return self._sink.take()
+
+    def flush(self) -> bytes:
+        for packet in self._stream.encode(None):
+            self._container.mux(packet)
+        self._container.close()
+        return self._sink.take()
+
+
+def create_encoder(audio_format: str = DEFAULT_AUDIO_FORMAT, sample_rate: int = 24000):
+    """按格式名创建流式编码器 (每个音频流一个实例)"""
+    if audio_format == "pcm16":
+        return PCMEncoder(sample_rate)
+    if audio_format == "wav":
+        return WavEncoder(sample_rate)
+    if audio_format == "g711_ulaw":
+        return MulawEncoder(sample_rate)
+    if audio_format == "opus":
+        return OpusEncoder(sample_rate, container="ogg")
+    if audio_format == "webm_opus":
+        return OpusEncoder(sample_rate, container="webm")
+    raise ValueError(f"Unsupported audio format: {audio_format} (supported: {', '.join(AUDIO_FORMATS)})")
+
+
+def check_audio_format(audio_format: str) -> str:
+    """校验格式名及其依赖，返回格式名；不支持时抛出 ValueError"""
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported audio format: {audio_format} (supported: {', '.join(AUDIO_FORMATS)})")
+    if audio_format in ("opus", "webm_opus") and av is None:
+        raise ValueError(f"Audio format {audio_format} requires PyAV (pip install av)")
+    return audio_format
+
+
+def negotiate_format(accept: Optional[str], default: str = "wav") -> Optional[str]:
+    """按 HTTP Accept 头选择输出格式
+
+    取 q 值最高且可用的格式，"*/*"、"audio/*" 或未提供时返回 default；
+    没有可接受的格式时返回 None (应答 406)。
+    """
+    if not accept:
+        return default
+
+    available = available_formats()
+    candidates = []
+    for order, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media_type = fields[0].lower()
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q <= 0:
+            continue
+        if media_type in ("*/*", "audio/*"):
+            audio_format = default
+        else:
+            audio_format = MEDIA_TYPES.get(media_type)
+        if audio_format and available[audio_format]:
+            candidates.append((-q, order, audio_format))
+
+    return min(candidates)[2] if candidates else None
+
+
+def available_formats() -> Dict[str, bool]:
+    """各格式在当前环境下是否可用"""
+    return {fmt: fmt not in ("opus", "webm_opus") or av is not None for fmt in AUDIO_FORMATS}
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+二进制音频帧
+/ws/voice 二进制传输模式下，每个 TTS 音频块作为一个 WebSocket 二进制帧发送，
+帧头为固定 16 字节 (网络字节序):
+
+    offset  size  field
+    0       1     version      协议版本 (当前为 1)
+    1       1     codec        编码 (见 CODEC_IDS)
+    2       1     flags        bit0: 本条音频流的最后一帧
+    3       1     reserved
+    4       4     stream_id    音频流 ID (每次回复递增)
+    8       4     seq          帧序号 (每条流从 0 开始)
+    12      4     sample_rate  采样率 (Hz)
+    16      ...   payload      编码后的音频数据 (最后一帧可能为空)
+"""
+
+import struct
+from typing import Dict, NamedTuple
+
+FRAME_VERSION = 1
+FLAG_END = 0x01
+
+CODEC_IDS: Dict[str, int] = {
+    "pcm16": 1,
+    "g711_ulaw": 2,
+    "opus": 3,
+    "webm_opus": 4,
+    "wav": 5,
+}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+
+_HEADER = struct.Struct("!BBBxIII")
+HEADER_SIZE = _HEADER.size
+
+
+class AudioFrame(NamedTuple):
+    codec: str
+    stream_id: int
+    seq: int
+    sample_rate: int
+    end: bool
+    payload: bytes
+
+
+def pack_audio_frame(
+    codec: str,
+    stream_id: int,
+    seq: int,
+    sample_rate: int,
+    payload: bytes,
+    end: bool = False,
+) -> bytes:
+    """帧头 + 音频数据"""
+    header = _HEADER.pack(
+        FRAME_VERSION,
+        CODEC_IDS[codec],
+        FLAG_END if end else 0,
+        stream_id & 0xFFFFFFFF,
+        seq & 0xFFFFFFFF,
+        sample_rate,
+    )
+    return header + payload
+
+
+def unpack_audio_frame(data: bytes) -> AudioFrame:
+    """解析二进制音频帧 (供测试与 Python 客户端使用)"""
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"Audio frame too short: {len(data)} bytes")
+    version, codec_id, flags, stream_id, seq, sample_rate = _HEADER.unpack_from(data)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported audio frame version: {version}")
+    return AudioFrame(
+        codec=CODEC_NAMES.get(codec_id, str(codec_id)),
+        stream_id=stream_id,
+        seq=seq,
+        sample_rate=sample_rate,
+        end=bool(flags & FLAG_END),
+        payload=data[HEADER_SIZE:],
+    )
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+音频拼接
+模板音频与槽位音频的静音裁剪与短交叉淡化
+"""
+
+from typing import Optional
+
+import numpy as np
+
+
+def trim_silence(samples: np.ndarray, threshold_db: float = -40.0, margin: int = 240) -> np.ndarray:
+    """裁掉首尾低于阈值 (相对满幅) 的静音，两端各保留 margin 个样本"""
+    if samples.size == 0:
+        return samples
+    threshold = 32768 * 10 ** (threshold_db / 20)
+    loud = np.flatnonzero(np.abs(samples.astype(np.int32)) > threshold)
+    if loud.size == 0:
+        return samples
+    start = max(0, loud[0] - margin)
+    end = min(samples.size, loud[-1] + 1 + margin)
+    return samples[start:end]
+
+
+class Crossfader:
+    """按顺序拼接 int16 片段，相邻片段之间做等功率交叉淡化
+
+    add() 返回可以立即输出的 PCM：每个片段的最后 fade 个样本先保留，
+    与下一个片段的开头混合后再输出；flush() 输出最后保留的尾部。
+    """
+
+    def __init__(self, fade_samples: int = 360):
+        self.fade = max(0, fade_samples)
+        self._tail: Optional[np.ndarray] = None
+
+    def add(self, piece: np.ndarray) -> bytes:
+        piece = piece.astype(np.float32)
+        if self._tail is None:
+            head = np.empty(0, dtype=np.float32)
+        else:
+            n = min(self._tail.size, piece.size)
+            t = (np.arange(n, dtype=np.float32) + 0.5) / max(n, 1)
+            mixed = self._tail[self._tail.size - n:] * np.cos(t * np.pi / 2) + piece[:n] * np.sin(t * np.pi / 2)
+            head = np.concatenate([self._tail[:self._tail.size - n], mixed])
+            piece = piece[n:]
+
+        keep = min(self.fade, piece.size)
+        self._tail = piece[piece.size - keep:]
+        return _to_pcm(np.concatenate([head, piece[:piece.size - keep]]))
+
+    def flush(self) -> bytes:
+        tail, self._tail = self._tail, None
+        return _to_pcm(tail) if tail is not None else b""
+
+
+def _to_pcm(samples: np.ndarray) -> bytes:
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16).tobytes()
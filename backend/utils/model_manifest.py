@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+本地模型清单
+将模型 ID 解析为已校验的本地目录，命中时启动过程不做任何网络请求
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Optional
+from loguru import logger
+
+
+class ModelManifest:
+    """模型清单 (MODEL_DIR/manifest.json)
+
+    每个条目记录模型目录及其中每个文件的大小和 sha256。
+    启动时按 MODEL_VERIFY 校验:
+      - none:   只检查目录存在
+      - size:   检查文件齐全且大小一致 (默认，毫秒级)
+      - sha256: 完整校验哈希 (较慢，适合预构建镜像后自检)
+    MODEL_OFFLINE=1 时清单未命中直接报错，不尝试下载。
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or os.getenv("MODEL_DIR", "pretrained_models")
+        self.path = os.path.join(self.cache_dir, "manifest.json")
+        self.verify_mode = os.getenv("MODEL_VERIFY", "size")
+        self.offline = os.getenv("MODEL_OFFLINE", "0") == "1"
+        self.entries: Dict[str, Dict] = self._load()
+
+        if self.offline:
+            # 阻止 huggingface_hub 的隐式联网检查
+            os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+    def _load(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f).get("models", {})
+        except Exception as e:
+            logger.warning(f"Failed to read model manifest {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "models": self.entries}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def resolve(self, model_id: str) -> Optional[str]:
+        """返回已校验的本地模型目录，未登记或校验失败返回 None"""
+        entry = self.entries.get(model_id)
+        if entry is None:
+            return None
+
+        if not self.verify(entry, self.verify_mode):
+            logger.warning(f"Model {model_id} failed {self.verify_mode} verification at {entry['path']}")
+            return None
+
+        return entry["path"]
+
+    def register(self, model_id: str, model_dir: str, source: str = "local") -> Dict:
+        """登记模型目录 (计算所有文件的大小与 sha256)"""
+        model_dir = os.path.abspath(model_dir)
+        files = {}
+        for root, _, names in os.walk(model_dir):
+            for name in names:
+                full_path = os.path.join(root, name)
+                rel_path = os.path.relpath(full_path, model_dir)
+                if rel_path.startswith(".git" + os.sep):
+                    continue
+                files[rel_path] = {
+                    "size": os.path.getsize(full_path),
+                    "sha256": _sha256(full_path),
+                }
+
+        entry = {
+            "path": model_dir,
+            "source": source,
+            "registered_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "files": files,
+        }
+        # 重新读取后合并，避免覆盖其它进程/服务刚登记的条目
+        self.entries = self._load()
+        self.entries[model_id] = entry
+        self._save()
+        logger.info(f"Registered model {model_id} -> {model_dir} ({len(files)} files)")
+        return entry
+
+    def verify(self, entry: Dict, mode: str = "size") -> bool:
+        """按 mode 校验条目对应的目录"""
+        model_dir = entry.get("path", "")
+        if not os.path.isdir(model_dir):
+            return False
+        if mode == "none":
+            return True
+
+        for rel_path, meta in entry.get("files", {}).items():
+            full_path = os.path.join(model_dir, rel_path)
+            if not os.path.isfile(full_path) or os.path.getsize(full_path) != meta["size"]:
+                return False
+            if mode == "sha256" and _sha256(full_path) != meta["sha256"]:
+                return False
+        return True
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+播放进度
+记录一轮回复已发送的音频时长与每句在音频中的起点，
+用户打断时据此估算实际播放到哪里、听到了哪些文本 (用于截断对话历史)。
+"""
+
+import time
+from typing import List, Optional, Tuple
+
+
+class PlaybackTracker:
+    """一轮回复的播放进度 (PCM 16-bit mono)"""
+
+    def __init__(self, sample_rate: int = 24000):
+        self.sample_rate = sample_rate
+        self.sent_ms = 0.0
+        self.first_audio_at: Optional[float] = None
+        self._sentences: List[Tuple[float, str]] = []  # (音频起点 ms, 文本)
+
+    def start_sentence(self, text: str):
+        """下一块音频属于新的一句"""
+        self._sentences.append((self.sent_ms, text))
+
+    def add_audio(self, pcm: bytes):
+        if not pcm:
+            return
+        if self.first_audio_at is None:
+            self.first_audio_at = time.monotonic()
+        self.sent_ms += len(pcm) / 2 / self.sample_rate * 1000
+
+    def played_ms(self, reported_ms: Optional[float] = None) -> float:
+        """已播放时长: 客户端上报优先，否则按首块音频发出后的实际时间估算 (不超过已发送时长)"""
+        if reported_ms is not None:
+            return max(0.0, min(float(reported_ms), self.sent_ms))
+        if self.first_audio_at is None:
+            return 0.0
+        return min((time.monotonic() - self.first_audio_at) * 1000, self.sent_ms)
+
+    def heard_text(self, played_ms: float) -> str:
+        """已开始播放的句子 (正在播放的一句整句计入)"""
+        text = ""
+        for start_ms, sentence in self._sentences:
+            if start_ms >= played_ms:
+                break
+            text = _join(text, sentence)
+        return text
+
+
+def _join(left: str, right: str) -> str:
+    """拼接分段: 两侧都是 ASCII 文本时补一个空格"""
+    if not left:
+        return right
+    if left[-1].isascii() and not left[-1].isspace() and right[:1].isascii() and not right[:1].isspace():
+        return f"{left} {right}"
+    return left + right
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+预分配的 float32 音频环形缓冲区
+O(1) 追加与时长查询，窗口读取零拷贝
+"""
+
+import numpy as np
+
+
+class AudioRingBuffer:
+    """定容音频环形缓冲区
+
+    存储区长度为 2 × capacity，每个样本同时写入 i 与 i + capacity 两处
+    (镜像)，因此任意不超过 capacity 的最近窗口都是一段连续内存，
+    可以直接返回视图而无需拼接。超过容量时丢弃最旧的样本 (硬上限)。
+
+    注意: view() 返回的视图在下一次 append 之前有效。
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=np.float32)
+        self._write = 0   # 下一个写入位置 (0 <= _write < capacity)
+        self._size = 0
+        self.dropped = 0  # 因超出容量被丢弃的样本数
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, samples: np.ndarray):
+        """追加 float32 样本"""
+        n = len(samples)
+        if n == 0:
+            return
+        if n > self.capacity:
+            # 单次写入超过容量：只保留最新部分
+            self.dropped += n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+
+        self._write_at(self._write, samples)
+        self._write = (self._write + n) % self.capacity
+
+        overflow = self._size + n - self.capacity
+        if overflow > 0:
+            self.dropped += overflow
+        self._size = min(self._size + n, self.capacity)
+
+    def _write_at(self, pos: int, samples: np.ndarray):
+        first = min(len(samples), self.capacity - pos)
+        self._data[pos:pos + first] = samples[:first]
+        self._data[pos + self.capacity:pos + self.capacity + first] = samples[:first]
+        rest = len(samples) - first
+        if rest:
+            self._data[:rest] = samples[first:]
+            self._data[self.capacity:self.capacity + rest] = samples[first:]
+
+    def view(self, n: int = None) -> np.ndarray:
+        """最近 n 个样本的视图 (默认全部)，零拷贝，调用方不应修改"""
+        n = self._size if n is None else min(n, self._size)
+        start = (self._write - n) % self.capacity
+        return self._data[start:start + n]
+
+    def discard(self, n: int):
+        """丢弃最旧的 n 个样本"""
+        self._size -= min(n, self._size)
+
+    def clear(self):
+        self._size = 0
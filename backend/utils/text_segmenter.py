@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+TTS 文本分段
+在中英文混排文本中识别句子/分句边界 (数字、价格、缩写不误切)，
+按延迟策略组织合成单元: 首段尽量短以尽快出声，之后合并/切分到目标长度以提高吞吐。
+既可一次处理整段文本，也可增量接收 LLM token 流。
+"""
+
+import os
+import re
+from typing import List, Optional, Tuple
+
+# 句末标点 (ASCII 的 "." 需结合上下文判断，见 _boundary_kind)
+TERMINALS = set("。！？；…!?\n")
+# 分句标点
+CLAUSES = set("，、：,;:")
+# ASCII 标点: 后面是空白、中文或结束时才算边界 ("3.5"、"1,000"、"10:30" 不切)
+ASCII_PUNCT = set(".,;:")
+# 紧跟在标点后的闭合符号，归入前一段
+CLOSERS = set("\"'”’）)]」』】》")
+
+# 以 "." 结尾但不表示句末的常见缩写 (小写比较)
+ABBREVIATIONS = {
+    "mr.", "mrs.", "ms.", "dr.", "prof.", "sr.", "jr.", "st.", "vs.", "etc.",
+    "e.g.", "i.e.", "no.", "inc.", "ltd.", "co.", "corp.", "approx.", "dept.",
+    "a.m.", "p.m.", "u.s.", "u.k.", "fig.", "vol.", "jan.", "feb.", "aug.",
+    "sept.", "oct.", "nov.", "dec.",
+}
+_INITIALS_RE = re.compile(r"(?:[A-Za-z]\.)+")
+
+# 朗读长度单位: 一个中日韩字符计 1，一个英文单词/数字计 1.5
+_UNIT_RE = re.compile(
+    r"[぀-ヿ㐀-䶿一-鿿가-힯]"
+    r"|[A-Za-z0-9]+(?:[.,'][A-Za-z0-9]+)*"
+)
+_WORD_WEIGHT = 1.5
+
+_WAIT = "wait"
+_TERMINAL = "terminal"
+_CLAUSE = "clause"
+
+
+def speech_units(text: str) -> float:
+    """估算朗读长度 (中文字数当量)"""
+    return sum(_unit_weight(m.group()) for m in _UNIT_RE.finditer(text))
+
+
+def _unit_weight(token: str) -> float:
+    return 1 if _is_cjk(token) else _WORD_WEIGHT
+
+
+def _is_cjk(char: str) -> bool:
+    return len(char) == 1 and not char.isascii() and _UNIT_RE.fullmatch(char) is not None
+
+
+class TextSegmenter:
+    """延迟感知的增量分段器
+
+    - 首段: 在朗读长度落在 [first_min, first_max] 的第一个边界处切出
+    - 后续: 在长度落在 [target, max_units] 的第一个句末边界处切出 (短句与后文合并)
+    - 超过上限仍无合适边界时，退回到限制内的最后一个边界、空白，最后才硬切
+
+    feed() 接收任意长度的文本增量，返回本次可以确定的段落；
+    flush() 在输入结束时返回剩余段落；segment() 一次处理整段文本。
+    """
+
+    def __init__(
+        self,
+        first_min: Optional[float] = None,
+        first_max: Optional[float] = None,
+        target: Optional[float] = None,
+        max_units: Optional[float] = None,
+    ):
+        self.first_min = first_min if first_min is not None else float(os.getenv("TTS_FIRST_SEGMENT_MIN", "4"))
+        self.first_max = first_max if first_max is not None else float(os.getenv("TTS_FIRST_SEGMENT_MAX", "16"))
+        self.target = target if target is not None else float(os.getenv("TTS_SEGMENT_TARGET", "30"))
+        self.max_units = max_units if max_units is not None else float(os.getenv("TTS_SEGMENT_MAX", "60"))
+        self.reset()
+
+    def reset(self):
+        self._buffer = ""
+        self._scan = 0  # 已扫描到的位置
+        # 已发现的边界: (结束位置, 类型, 从缓冲区开头到该位置的朗读长度)
+        self._boundaries: List[Tuple[int, str, float]] = []
+        self._first_done = False
+
+    def feed(self, text: str) -> List[str]:
+        self._buffer += text
+        return self._drain(final=False)
+
+    def flush(self) -> List[str]:
+        segments = self._drain(final=True)
+        self.reset()
+        return segments
+
+    def segment(self, text: str) -> List[str]:
+        self.reset()
+        segments = []
+        # 分块送入，缓冲区保持在单段长度量级，长文本也是线性时间
+        for i in range(0, len(text), 256):
+            segments += self.feed(text[i:i + 256])
+        return segments + self.flush()
+
+    def _drain(self, final: bool) -> List[str]:
+        segments = []
+        while True:
+            self._scan_boundaries(final)
+            cut = self._choose_cut(final)
+            if cut is None:
+                return segments
+
+            segment = self._buffer[:cut].strip()
+            base = self._units_at(cut)
+            remaining = [(end - cut, kind, units) for end, kind, units in self._boundaries if end > cut]
+            self._buffer = self._buffer[cut:]
+            self._scan = max(0, self._scan - cut)
+            if base is not None:
+                self._boundaries = [(end, kind, units - base) for end, kind, units in remaining]
+            else:
+                # 在边界之间切分 (硬切)，重新计算剩余边界的长度
+                self._boundaries = self._rebase([(end, kind) for end, kind, _ in remaining])
+            if segment:
+                segments.append(segment)
+                self._first_done = True
+
+    def _units_at(self, pos: int) -> Optional[float]:
+        if pos == 0:
+            return 0.0
+        for end, _, units in self._boundaries:
+            if end == pos:
+                return units
+        return None
+
+    def _rebase(self, boundaries: List[Tuple[int, str]]) -> List[Tuple[int, str, float]]:
+        rebased = []
+        start, units = 0, 0.0
+        for end, kind in boundaries:
+            units += speech_units(self._buffer[start:end])
+            rebased.append((end, kind, units))
+            start = end
+        return rebased
+
+    def _scan_boundaries(self, final: bool):
+        buffer = self._buffer
+        last_end, last_units = (self._boundaries[-1][0], self._boundaries[-1][2]) if self._boundaries else (0, 0.0)
+        i = self._scan
+        while i < len(buffer):
+            kind = self._boundary_kind(i, final)
+            if kind == _WAIT:
+                break
+            i += 1
+            if kind is None:
+                continue
+            while i < len(buffer) and buffer[i] in CLOSERS:
+                i += 1
+            last_units += speech_units(buffer[last_end:i])
+            last_end = i
+            self._boundaries.append((i, kind, last_units))
+        self._scan = i
+
+    def _boundary_kind(self, i: int, final: bool) -> Optional[str]:
+        buffer = self._buffer
+        char = buffer[i]
+        if char not in TERMINALS and char not in CLAUSES and char not in ASCII_PUNCT:
+            return None
+
+        # 需要下一个字符才能判断 (连续标点、"3.5"、闭合引号)
+        nxt = buffer[i + 1] if i + 1 < len(buffer) else None
+        if nxt is None and not final:
+            return _WAIT
+
+        # "？！"、"..." 等连续标点在最后一个处切
+        if nxt is not None and (nxt in TERMINALS or (nxt == "." and (char == "." or char in TERMINALS))):
+            return None
+
+        if char in ASCII_PUNCT:
+            if nxt is not None and not (nxt.isspace() or _is_cjk(nxt) or nxt in CLOSERS):
+                return None
+            if char == "." and self._is_abbreviation(i):
+                return None
+            return _TERMINAL if char == "." else _CLAUSE
+
+        return _TERMINAL if char in TERMINALS else _CLAUSE
+
+    def _is_abbreviation(self, i: int) -> bool:
+        """buffer[i] 处的 "." 是否属于缩写、首字母或列表序号"""
+        start = i
+        while start > 0 and not self._buffer[start - 1].isspace() and not _is_cjk(self._buffer[start - 1]):
+            start -= 1
+        word = self._buffer[start:i + 1]
+        if word.lower() in ABBREVIATIONS or _INITIALS_RE.fullmatch(word):
+            return True
+        # 行首 "1. " 视为列表序号
+        return word[:-1].isdigit() and (start == 0 or self._buffer[start - 1] == "\n")
+
+    def _choose_cut(self, final: bool) -> Optional[int]:
+        """返回下一个切分位置，暂不切分时返回 None"""
+        if not self._buffer.strip():
+            return None
+
+        if not self._first_done:
+            limit = self.first_max
+            for end, _, units in self._boundaries:
+                if self.first_min <= units <= limit:
+                    return end
+        else:
+            limit = self.max_units
+            for end, kind, units in self._boundaries:
+                if kind == _TERMINAL and self.target <= units <= limit:
+                    return end
+
+        if self._boundaries:
+            last_end, _, last_units = self._boundaries[-1]
+        else:
+            last_end, last_units = 0, 0.0
+        total = last_units + speech_units(self._buffer[last_end:])
+
+        if total <= limit:
+            return len(self._buffer) if final else None
+
+        # 超长: 退回到限制内的最后一个边界 (句末优先)
+        within = [(end, kind) for end, kind, units in self._boundaries if units <= limit]
+        terminals = [end for end, kind in within if kind == _TERMINAL]
+        if terminals:
+            return terminals[-1]
+        if within:
+            return within[-1][0]
+        return self._hard_cut(limit)
+
+    def _hard_cut(self, limit: float) -> int:
+        """无标点的超长文本: 在限制内的最后一个空白处切分，没有空白则按字切"""
+        units, pos = 0.0, len(self._buffer)
+        for match in _UNIT_RE.finditer(self._buffer):
+            units += _unit_weight(match.group())
+            if units > limit:
+                pos = match.start()
+                break
+        space = max(self._buffer.rfind(" ", 0, pos), self._buffer.rfind("\n", 0, pos))
+        if space > 0:
+            return space + 1
+        return max(pos, 1)
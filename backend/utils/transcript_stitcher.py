@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+流式识别文本拼接
+滑动窗口解码时，将各窗口的识别结果拼接为连续文本，
+并区分稳定前缀 (不再变化) 与不稳定后缀 (可能被后续窗口修正)
+"""
+
+import re
+from typing import List
+
+# SenseVoice 等模型输出的富文本标签，如 <|zh|><|NEUTRAL|>
+_TAG_RE = re.compile(r"<\|[^|]*\|>")
+# 中文按字切分，其它按空白切分；标点附着在前一个词上
+_TOKEN_RE = re.compile(r"[\u3400-\u9fff][^\w\s]*|[^\s\u3400-\u9fff]+")
+_PUNCT_RE = re.compile(r"[^\w]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """切分识别文本 (中英混合)"""
+    return _TOKEN_RE.findall(_TAG_RE.sub("", text))
+
+
+def join_tokens(tokens: List[str]) -> str:
+    """拼接 token：英文单词之间补空格，中文直接相连"""
+    text = ""
+    for token in tokens:
+        if text and text[-1].isascii() and token[:1].isascii() and token[:1].isalnum():
+            text += " "
+        text += token
+    return text
+
+
+def _key(token: str) -> str:
+    """比较用的归一化形式：忽略大小写与标点"""
+    return _PUNCT_RE.sub("", token).lower()
+
+
+class TranscriptStitcher:
+    """滑动窗口识别结果拼接 (局部一致性策略)
+
+    - 每个窗口的假设先去掉与已提交文本重叠的部分 (窗口的左侧上下文)
+    - 与上一窗口假设的最长公共前缀视为稳定，提交
+    - 其余部分作为不稳定后缀，等待下一窗口确认或修正
+    """
+
+    def __init__(self, max_overlap_tokens: int = 48, max_skip_tokens: int = 2):
+        self.max_overlap_tokens = max_overlap_tokens
+        self.max_skip_tokens = max_skip_tokens  # 窗口边界截断的词可能被识别错，允许跳过
+        self.committed: List[str] = []
+        self.unstable: List[str] = []
+        self._window_tokens = 0  # 最近一个窗口假设的 token 数
+
+    def update(self, hypothesis: str, has_context: bool = True):
+        """合并一个窗口的识别假设
+
+        Args:
+            hypothesis: 当前窗口 (左侧上下文 + 新音频) 的识别文本
+            has_context: 窗口是否包含已识别过的左侧上下文
+        """
+        tokens = tokenize(hypothesis)
+        self._window_tokens = len(tokens)
+        if has_context:
+            tokens = self._drop_overlap(tokens)
+
+        # 与上一次不稳定后缀的公共前缀 → 稳定
+        n = 0
+        while n < len(tokens) and n < len(self.unstable) and _key(tokens[n]) == _key(self.unstable[n]):
+            n += 1
+
+        self.committed.extend(tokens[:n])
+        self.unstable = tokens[n:]
+
+    def slide(self, keep_ratio: float):
+        """窗口左移：被丢弃音频对应的文本直接提交
+
+        没有时间戳，按 token 在窗口内均匀分布估算：保留窗口末尾
+        keep_ratio 比例的 token 为不稳定，由保留的上下文音频重新识别。
+        """
+        keep = round(self._window_tokens * keep_ratio)
+        n = max(0, len(self.unstable) - keep)
+        self.committed.extend(self.unstable[:n])
+        self.unstable = self.unstable[n:]
+
+    def commit_all(self):
+        """提交全部不稳定后缀 (语句结束时)"""
+        self.committed.extend(self.unstable)
+        self.unstable = []
+
+    def reset(self):
+        self.committed = []
+        self.unstable = []
+        self._window_tokens = 0
+
+    def _drop_overlap(self, tokens: List[str]) -> List[str]:
+        """去掉假设开头与已提交文本末尾重叠的部分"""
+        tail = [_key(t) for t in self.committed[-self.max_overlap_tokens:]]
+        keys = [_key(t) for t in tokens]
+
+        for skip in range(min(self.max_skip_tokens, len(keys)) + 1):
+            # 跳过开头 token 时要求至少两个 token 重叠，避免误判
+            min_k = 1 if skip == 0 else 2
+            for k in range(min(len(tail), len(keys) - skip), min_k - 1, -1):
+                if tail[-k:] == keys[skip:skip + k]:
+                    return tokens[skip + k:]
+        return tokens
+
+    @property
+    def stable_text(self) -> str:
+        return join_tokens(self.committed)
+
+    @property
+    def unstable_text(self) -> str:
+        return join_tokens(self.unstable)
+
+    @property
+    def text(self) -> str:
+        return join_tokens(self.committed + self.unstable)
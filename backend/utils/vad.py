@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+流式语音活动检测 (VAD)
+基于短时能量 + 过零率，NumPy 向量化逐帧计算
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Tuple
+import numpy as np
+
+
+@dataclass
+class VADResult:
+    """一次 process 调用的检测结果"""
+    speech: np.ndarray          # 需要送入 ASR 的语音样本 (含预滚动/拖尾)
+    speech_started: bool = False  # 本次调用中检测到语音起点
+    speech_ended: bool = False    # 本次调用中检测到语音终点 (端点)，终点之后的音频未处理
+    in_speech: bool = False       # 调用结束时是否处于语音段内
+
+
+class StreamingVAD:
+    """流式 VAD
+
+    - 按 frame_ms 分帧，向量化计算每帧能量 (dBFS) 与过零率
+    - 能量高于自适应噪声底 + threshold_db 且过零率不过高的帧判为语音
+    - 连续 onset_ms 语音帧确认起点，连续 hangover_ms 静音帧确认终点
+    - 起点前保留 preroll_ms 音频，避免吞掉首字
+    - 每次 process 在语音终点处停止：终点之后的音频留待下一次调用，
+      作为下一句 (从其预滚动开始) 检测，不会混入刚结束的语句
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        frame_ms: int = 20,
+        threshold_db: float = None,
+        min_energy_db: float = None,
+        max_zcr: float = 0.35,
+        onset_ms: int = None,
+        hangover_ms: int = None,
+        preroll_ms: int = None,
+    ):
+        self.sample_rate = sample_rate
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.threshold_db = threshold_db if threshold_db is not None else float(os.getenv("VAD_THRESHOLD_DB", "12"))
+        self.min_energy_db = min_energy_db if min_energy_db is not None else float(os.getenv("VAD_MIN_ENERGY_DB", "-50"))
+        self.max_zcr = max_zcr
+
+        onset_ms = onset_ms if onset_ms is not None else int(os.getenv("VAD_ONSET_MS", "60"))
+        hangover_ms = hangover_ms if hangover_ms is not None else int(os.getenv("VAD_HANGOVER_MS", "600"))
+        preroll_ms = preroll_ms if preroll_ms is not None else int(os.getenv("VAD_PREROLL_MS", "200"))
+        self.onset_frames = max(1, onset_ms // frame_ms)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.preroll_frames = max(0, preroll_ms // frame_ms)
+
+        self.noise_floor_db = -60.0  # 自适应噪声底估计
+
+        # 统计
+        self.frames_total = 0
+        self.frames_speech = 0
+
+        self.reset()
+
+    def reset(self):
+        """重置检测状态 (噪声底估计与统计保留)"""
+        self._remainder = np.zeros(0, dtype=np.float32)
+        self._pending = []        # 起点确认前的候选帧 (含预滚动)
+        self._voiced_run = 0      # 连续语音帧数
+        self._silence_run = 0     # 语音段内连续静音帧数
+        self.in_speech = False
+
+    @property
+    def unprocessed_samples(self) -> int:
+        """已接收但尚未处理的样本数 (不足一帧的尾部，或上次终点之后的音频)"""
+        return len(self._remainder)
+
+    def process(self, audio: np.ndarray) -> VADResult:
+        """处理一段 float32 音频，返回其中的语音部分与端点事件
+
+        检测到终点时返回终点之前的语音 (speech_ended=True)，其后的音频未处理；
+        调用方结束该语句后应再以空数组调用一次，从下一句开始继续检测。
+        """
+        if len(self._remainder):
+            audio = np.concatenate([self._remainder, audio])
+
+        n_frames = len(audio) // self.frame_len
+        self._remainder = audio[n_frames * self.frame_len:].copy()
+        if n_frames == 0:
+            return VADResult(speech=np.zeros(0, dtype=np.float32), in_speech=self.in_speech)
+
+        frames = audio[:n_frames * self.frame_len].reshape(n_frames, self.frame_len)
+        voiced, energy_db = self._classify(frames)
+
+        out = []
+        started = ended = False
+        for i, (frame, is_voiced) in enumerate(zip(frames, voiced)):
+            if not self.in_speech:
+                self._pending.append(frame)
+                self._voiced_run = self._voiced_run + 1 if is_voiced else 0
+                if self._voiced_run >= self.onset_frames:
+                    # 起点确认：输出预滚动 + 候选帧
+                    self.in_speech = True
+                    started = True
+                    self._silence_run = 0
+                    out.extend(self._pending)
+                    self._pending = []
+                elif len(self._pending) > self.preroll_frames + self.onset_frames:
+                    self._pending.pop(0)
+            else:
+                out.append(frame)
+                self._silence_run = 0 if is_voiced else self._silence_run + 1
+                if self._silence_run >= self.hangover_frames:
+                    # 终点确认：语音结束
+                    self.in_speech = False
+                    ended = True
+                    self._voiced_run = 0
+                    self._pending = []
+                    # 终点之后的帧属于下一句，留到下一次调用
+                    self._remainder = np.concatenate([frames[i + 1:].reshape(-1), self._remainder])
+                    n_frames = i + 1
+                    break
+
+        # 用已处理的静音帧缓慢更新噪声底 (终点之后的帧下次处理时再计入)
+        silent = energy_db[:n_frames][~voiced[:n_frames]]
+        if len(silent):
+            self.noise_floor_db = 0.95 * self.noise_floor_db + 0.05 * float(np.mean(silent))
+
+        self.frames_total += n_frames
+        self.frames_speech += len(out)
+
+        speech = np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+        return VADResult(
+            speech=speech,
+            speech_started=started,
+            speech_ended=ended,
+            in_speech=self.in_speech,
+        )
+
+    def _classify(self, frames: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """逐帧判定语音/静音 (向量化)，同时返回各帧能量 (dBFS)"""
+        energy = np.mean(frames * frames, axis=1)
+        energy_db = 10.0 * np.log10(energy + 1e-10)
+
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (self.frame_len - 1)
+
+        threshold = max(self.noise_floor_db + self.threshold_db, self.min_energy_db)
+        voiced = (energy_db > threshold) & (zcr < self.max_zcr)
+        return voiced, energy_db
+
+    @property
+    def speech_ratio(self) -> float:
+        return self.frames_speech / self.frames_total if self.frames_total else 0.0